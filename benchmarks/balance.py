@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import sys
+from collections import Counter
+
+import aiohttp
+from aiohttp import hdrs
+from wsrpc_aiohttp import WSRPCClient
+
+from benchmarks.server import Server, parents, run_server
+
+parser = argparse.ArgumentParser(
+    description="Distribution of sessions over workers per balancer",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument("--forks", type=int, default=4)
+parser.add_argument("--sessions", type=int, default=200)
+parser.add_argument("--concurrency", type=int, default=8)
+parser.add_argument("--shell", default="/bin/sh")
+
+
+class SessionClient(WSRPCClient):
+    async def handle_binary(self, message: aiohttp.WSMessage) -> None:
+        pass
+
+
+def sessions_per_worker(server: Server) -> list[int]:
+    shells = Counter(parents().values())
+    return [shells[worker] for worker in server.workers]
+
+
+async def measure(balancer: str, args: argparse.Namespace) -> None:
+    clients: list[SessionClient] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with run_server(
+        f"--forks={args.forks}",
+        f"--balancer={balancer}",
+        f"--shell={args.shell}",
+    ) as server:
+
+        async def open_session() -> None:
+            async with semaphore:
+                client = SessionClient(
+                    server.url.with_path("ws/").with_scheme("ws"),
+                    headers={hdrs.ORIGIN: str(server.url)},
+                )
+                await client.connect()
+                clients.append(client)
+                await client.proxy.pty.ready(cols=80, rows=24)
+
+        try:
+            await asyncio.gather(
+                *(open_session() for _ in range(args.sessions)),
+            )
+            counts = sessions_per_worker(server)
+        finally:
+            for client in clients:
+                await client.close()
+
+    mean = sum(counts) / len(counts)
+    sys.stdout.write(
+        f"{balancer:<14} {' '.join(f'{c:>5}' for c in counts)}"
+        f"   max/mean {max(counts) / mean:.2f}\n",
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    sys.stdout.write(f"{'balancer':<14} sessions per worker\n")
+    await measure("shared", args)
+    await measure("least-loaded", args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parser.parse_args()))
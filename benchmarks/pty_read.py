@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import resource
+import sys
+import time
+
+from tty_aiohttp.app.handlers.ws.buffers import read_buffers
+from tty_aiohttp.app.handlers.ws.pty import Terminal
+from tty_aiohttp.app.handlers.ws.spawn import spawn
+from tty_aiohttp.app.metrics import PTY_READS, REGISTRY
+
+parser = argparse.ArgumentParser(
+    description="Cost of the PTY read path under bulk and interactive output",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument("--bulk-bytes", type=int, default=256 * 1024 * 1024)
+parser.add_argument("--writes", type=int, default=20000)
+parser.add_argument("--write-size", type=int, default=16)
+
+INTERACTIVE = """
+import os, sys, time
+count, size = int(sys.argv[1]), int(sys.argv[2])
+for _ in range(count):
+    os.write(1, b"." * size)
+    time.sleep(0.0001)
+"""
+
+
+class NullSocket:
+    def __init__(self) -> None:
+        self.received = 0
+
+    async def send_bytes(self, data: bytes | memoryview) -> None:
+        self.received += len(data)
+
+    async def close(self, **kwargs: object) -> bool:
+        return True
+
+
+def cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def reads() -> float:
+    return REGISTRY.values[PTY_READS._index]
+
+
+async def measure(name: str, argv: list[str]) -> None:
+    shell = await spawn(argv)
+    ws = NullSocket()
+    arenas = read_buffers.arenas_allocated
+    count, cpu, started = reads(), cpu_time(), time.perf_counter()
+    terminal = Terminal(shell.process, shell.fd, ws)  # type: ignore[arg-type]
+    await shell.process.wait()
+    elapsed, cpu = time.perf_counter() - started, cpu_time() - cpu
+    count = reads() - count
+    arenas = read_buffers.arenas_allocated - arenas
+    await terminal.close()
+    sys.stdout.write(
+        f"{name:<12} {count:>10.0f} {ws.received / elapsed / 2**20:>10.1f} "
+        f"{cpu / count * 1e6:>12.2f} {arenas:>8}\n",
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    sys.stdout.write(
+        f"{'output':<12} {'reads':>10} {'MiB/s':>10} {'cpu us/read':>12} "
+        f"{'arenas':>8}\n",
+    )
+    await measure("bulk", ["sh", "-c", f"yes | head -c {args.bulk_bytes}"])
+    await measure(
+        "interactive",
+        [
+            sys.executable,
+            "-c",
+            INTERACTIVE,
+            str(args.writes),
+            str(args.write_size),
+        ],
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import sys
+import threading
+from collections.abc import Awaitable, Callable
+from contextlib import suppress
+
+from aiomisc import entrypoint
+
+from tty_aiohttp.app.handlers.ws.spawn import spawn
+
+Waiter = Callable[[], Awaitable[int]]
+Starter = Callable[[list[str]], Awaitable[tuple[Waiter, Callable[[], None]]]]
+
+parser = argparse.ArgumentParser(
+    description="Thread count and memory of live shells per reaping strategy",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument("--sessions", type=int, nargs="+", default=[10, 100, 500])
+parser.add_argument("--pool-size", type=int, default=4)
+
+
+def rss_kib() -> int:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+async def start_asyncio(argv: list[str]) -> tuple[Waiter, Callable[[], None]]:
+    process = await asyncio.create_subprocess_exec(
+        *argv,
+        start_new_session=True,
+    )
+
+    def kill() -> None:
+        with suppress(ProcessLookupError):
+            process.kill()
+
+    return process.wait, kill
+
+
+async def start_reaper(argv: list[str]) -> tuple[Waiter, Callable[[], None]]:
+    shell = await spawn(argv)
+    return shell.process.wait, shell.kill
+
+
+async def measure(name: str, start: Starter, sessions: int) -> None:
+    # Let the thread pool and the reaper settle before counting
+    wait, kill = await start(["true"])
+    await wait()
+    kill()
+
+    threads, rss = threading.active_count(), rss_kib()
+    children = [await start(["sleep", "3600"]) for _ in range(sessions)]
+    await asyncio.sleep(0.5)
+    threads, rss = threading.active_count() - threads, rss_kib() - rss
+
+    for wait, kill in children:
+        kill()
+        await wait()
+
+    sys.stdout.write(f"{name:<10} {sessions:>8} {threads:>8} {rss:>10}\n")
+
+
+async def main(args: argparse.Namespace) -> None:
+    sys.stdout.write(
+        f"{'reaper':<10} {'sessions':>8} {'threads':>8} {'rss KiB':>10}\n",
+    )
+    for sessions in args.sessions:
+        await measure("asyncio", start_asyncio, sessions)
+        await measure("reaper", start_reaper, sessions)
+
+
+if __name__ == "__main__":
+    arguments = parser.parse_args()
+    with entrypoint(pool_size=arguments.pool_size) as loop:
+        loop.run_until_complete(main(arguments))
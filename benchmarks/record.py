@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from tty_aiohttp.app.handlers.ws.recorder import Recorder, RecordingOptions
+
+parser = argparse.ArgumentParser(
+    description="Event loop cost of recording output, per recorded byte",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument("--bulk-bytes", type=int, default=256 * 1024 * 1024)
+parser.add_argument("--bulk-read", type=int, default=20 * 1024)
+parser.add_argument("--writes", type=int, default=200000)
+parser.add_argument("--write-size", type=int, default=16)
+parser.add_argument("--compression-level", type=int, default=6)
+parser.add_argument("--queue-bytes", type=int, default=4 * 1024 * 1024)
+
+# Terminal output compresses about this well, so the writer is not timed
+# against incompressible noise
+SAMPLE = (
+    b"\x1b[32mdrwxr-xr-x\x1b[0m  2 user group  4096 Jan  1 00:00 "
+    b"\x1b[1;34mdirectory\x1b[0m\r\n"
+    b"-rw-r--r--  1 user group 12345 Jan  1 00:00 file.txt\r\n"
+)
+
+
+async def measure(
+    name: str,
+    args: argparse.Namespace,
+    total: int,
+    chunk: int,
+) -> None:
+    data = (SAMPLE * (chunk // len(SAMPLE) + 1))[:chunk]
+    with tempfile.TemporaryDirectory() as directory:
+        recorder = Recorder(
+            RecordingOptions(
+                directory=directory,
+                queue_bytes=args.queue_bytes,
+                compression_level=args.compression_level,
+            ),
+        )
+        recorder.start()
+        recording = recorder.record(os.getpid())
+        started, cpu = time.perf_counter(), time.thread_time()
+        for offset in range(0, total, chunk):
+            recording.output(data)
+            # Lets the batch timers run, as reads of a real PTY would
+            if offset // chunk % 64 == 0:
+                await asyncio.sleep(0)
+        recording.close()
+        cpu = time.thread_time() - cpu
+        await recorder.close()
+        elapsed = time.perf_counter() - started
+        stored = sum(
+            os.path.getsize(os.path.join(directory, name))
+            for name in os.listdir(directory)
+        )
+    stats = recorder.stats
+    sys.stdout.write(
+        f"{name:<12} {cpu / total * 1e9:>12.2f} "
+        f"{stats.recorded / elapsed / 2**20:>10.1f} "
+        f"{stats.dropped / total * 100:>9.1f}% "
+        f"{stored / max(stats.recorded, 1):>8.3f}\n",
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    sys.stdout.write(
+        f"{'output':<12} {'loop ns/B':>12} {'MiB/s':>10} {'dropped':>10} "
+        f"{'ratio':>8}\n",
+    )
+    await measure("bulk", args, args.bulk_bytes, args.bulk_read)
+    await measure(
+        "interactive",
+        args,
+        args.writes * args.write_size,
+        args.write_size,
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parser.parse_args()))
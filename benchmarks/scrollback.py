@@ -0,0 +1,67 @@
+import argparse
+import gc
+import sys
+import tempfile
+import time
+
+from tty_aiohttp.app.handlers.ws.pty import REPLAY_PREFIX
+from tty_aiohttp.app.handlers.ws.scrollback import RingBuffer
+
+parser = argparse.ArgumentParser(
+    description="Worker RSS per idle session with heap and spilled scrollback",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument("--sessions", type=int, default=2000)
+parser.add_argument("--scrollback", type=int, default=256 * 1024)
+parser.add_argument(
+    "--directory",
+    default=tempfile.gettempdir(),
+    help="Where spilled scrollback is mapped from",
+)
+
+
+def rss_kib() -> int:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def measure(name: str, args: argparse.Namespace, spill: bool) -> None:
+    gc.collect()
+    rss = rss_kib()
+    output = b"\x1b[32m$\x1b[0m ls -la\r\n" * (args.scrollback // 20)
+    rings = []
+    for _ in range(args.sessions):
+        ring = RingBuffer(args.scrollback)
+        ring.append(output)
+        if spill:
+            ring.spill(args.directory)
+        rings.append(ring)
+    idle = (rss_kib() - rss) / args.sessions
+
+    # A reattach builds the replay frame straight from the ring
+    started = time.perf_counter()
+    for ring in rings[:100]:
+        ring.tail(REPLAY_PREFIX)
+    replay = (time.perf_counter() - started) / min(100, len(rings))
+
+    for ring in rings:
+        ring.restore()
+    sys.stdout.write(
+        f"{name:<10} {args.sessions:>8} {idle:>15.1f} {replay * 1e6:>10.1f}\n",
+    )
+
+
+def main(args: argparse.Namespace) -> None:
+    sys.stdout.write(
+        f"{'scrollback':<10} {'sessions':>8} {'rss KiB/session':>15} "
+        f"{'replay us':>10}\n",
+    )
+    measure("heap", args, spill=False)
+    measure("spilled", args, spill=True)
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
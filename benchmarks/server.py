@@ -0,0 +1,108 @@
+import asyncio
+import os
+import signal
+import socket
+import sys
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass
+
+import aiohttp
+from yarl import URL
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def parents() -> dict[int, int]:
+    result = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        with suppress(OSError), open(f"/proc/{name}/stat") as stat:
+            # The command may contain spaces, the fields after it do not
+            fields = stat.read().rsplit(")", 1)[1].split()
+            result[int(name)] = int(fields[1])
+    return result
+
+
+def children(pid: int) -> list[int]:
+    return sorted(child for child, ppid in parents().items() if ppid == pid)
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def _status(pid: int, key: str) -> int:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith(f"{key}:"):
+                return int(line.split()[1])
+    return 0
+
+
+def rss_kib(pid: int) -> int:
+    return _status(pid, "VmRSS")
+
+
+def threads(pid: int) -> int:
+    return _status(pid, "Threads")
+
+
+def open_fds(pid: int) -> int:
+    return len(os.listdir(f"/proc/{pid}/fd"))
+
+
+def zombies(pid: int) -> int:
+    count = 0
+    for child in children(pid):
+        with suppress(OSError), open(f"/proc/{child}/stat") as stat:
+            count += stat.read().rsplit(")", 1)[1].split()[0] == "Z"
+    return count
+
+
+async def wait_ready(url: URL, timeout: float = 30) -> None:
+    async with aiohttp.ClientSession() as session:
+        async with asyncio.timeout(timeout):
+            while True:
+                with suppress(aiohttp.ClientError):
+                    async with session.get(url.with_path("/api/v1/ping")):
+                        return
+                await asyncio.sleep(0.1)
+
+
+@dataclass(frozen=True)
+class Server:
+    process: asyncio.subprocess.Process
+    url: URL
+
+    @property
+    def workers(self) -> list[int]:
+        return children(self.process.pid)
+
+
+@asynccontextmanager
+async def run_server(*arguments: str) -> AsyncIterator[Server]:
+    url = URL.build(scheme="http", host="127.0.0.1", port=free_port())
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-m",
+        "tty_aiohttp.app",
+        f"--api-port={url.port}",
+        "--log-level=warning",
+        *arguments,
+    )
+    try:
+        await wait_ready(url)
+        yield Server(process, url)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        await process.wait()
@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import signal
+import sys
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import suppress
+from dataclasses import asdict, dataclass
+
+import aiohttp
+from aiohttp import hdrs
+
+from benchmarks.server import (
+    Server,
+    children,
+    open_fds,
+    rss_kib,
+    run_server,
+    threads,
+    zombies,
+)
+from benchmarks.ws import TermClient, open_session
+
+CLOSED = b"Process closed"
+SHELL_PID = re.compile(rb"PID:(\d+):")
+SETTLE_TIMEOUT = 30.0
+
+parser = argparse.ArgumentParser(
+    description="Resource leaks of the worker across terminal churn",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument("--sessions", type=int, default=2000)
+parser.add_argument("--batch", type=int, default=200)
+parser.add_argument("--concurrency", type=int, default=16)
+parser.add_argument("--warmup", type=int, default=2, help="Batches")
+parser.add_argument("--shell", default="/bin/sh")
+parser.add_argument("--max-fd-growth", type=int, default=4)
+parser.add_argument("--max-thread-growth", type=int, default=2)
+parser.add_argument("--max-rss-growth", type=int, default=16384, help="KiB")
+parser.add_argument("--json", help="Write the samples to this file")
+
+
+@dataclass(frozen=True)
+class Sample:
+    sessions: int
+    open_fds: int
+    threads: int
+    zombies: int
+    shells: int
+    terminals: int
+    rss_kib: int
+
+
+async def disconnect(server: Server) -> None:
+    client = await open_session(server.url)
+    await client.close()
+
+
+async def shell_exit(server: Server) -> None:
+    client = await open_session(server.url)
+    try:
+        since = client.received
+        await client.input(b"exit\n")
+        await client.wait_for(CLOSED, since)
+    finally:
+        await client.close()
+
+
+async def kill_during_write(server: Server) -> None:
+    client = await open_session(server.url)
+    try:
+        await client.run("echo PID:$$:")
+        match = SHELL_PID.search(client.tail)
+        assert match is not None
+        # A line longer than the tty accepts keeps the writer busy
+        since = client.received
+        await client.input(b"x" * 256 * 1024)
+        os.kill(int(match.group(1)), signal.SIGKILL)
+        await client.wait_for(CLOSED, since)
+    finally:
+        await client.close()
+
+
+async def disconnect_during_spawn(server: Server) -> None:
+    client = TermClient(
+        server.url.with_path("ws/").with_scheme("ws"),
+        headers={hdrs.ORIGIN: str(server.url)},
+    )
+    await client.connect()
+    ready = asyncio.ensure_future(client.proxy.pty.ready(cols=80, rows=24))
+    await client.close()
+    with suppress(Exception, asyncio.CancelledError):
+        await ready
+
+
+SCENARIOS: tuple[Callable[[Server], Awaitable[None]], ...] = (
+    disconnect,
+    shell_exit,
+    kill_during_write,
+    disconnect_during_spawn,
+)
+
+
+async def churn(server: Server, count: int, concurrency: int) -> None:
+    scenarios = itertools.islice(itertools.cycle(SCENARIOS), count)
+
+    async def run() -> None:
+        for scenario in scenarios:
+            await scenario(server)
+
+    await asyncio.gather(*(run() for _ in range(concurrency)))
+
+
+async def terminals(session: aiohttp.ClientSession, server: Server) -> int:
+    # The health check answers 503 when degraded, with the same body
+    async with session.get(server.url.with_path("/api/v1/ping")) as resp:
+        return (await resp.json())["terminals"]
+
+
+async def sample(
+    session: aiohttp.ClientSession,
+    server: Server,
+    worker: int,
+    sessions: int,
+) -> Sample:
+    # Closing is asynchronous, give the worker time to finish it
+    deadline = time.monotonic() + SETTLE_TIMEOUT
+    while time.monotonic() < deadline:
+        live = await terminals(session, server)
+        if not live and not children(worker):
+            break
+        await asyncio.sleep(0.1)
+    return Sample(
+        sessions=sessions,
+        open_fds=open_fds(worker),
+        threads=threads(worker),
+        zombies=zombies(worker),
+        shells=len(children(worker)) - zombies(worker),
+        terminals=live,
+        rss_kib=rss_kib(worker),
+    )
+
+
+def leaks(samples: list[Sample], args: argparse.Namespace) -> list[str]:
+    first, last = samples[min(args.warmup, len(samples) - 1)], samples[-1]
+    found = []
+    if last.open_fds - first.open_fds > args.max_fd_growth:
+        found.append("open_fds")
+    if last.threads - first.threads > args.max_thread_growth:
+        found.append("threads")
+    if last.rss_kib - first.rss_kib > args.max_rss_growth:
+        found.append("rss_kib")
+    if last.zombies:
+        found.append("zombies")
+    if last.shells:
+        found.append("shells")
+    if last.terminals:
+        found.append("terminals")
+    return found
+
+
+def write_sample(item: Sample) -> None:
+    sys.stdout.write(
+        " ".join(f"{value:>10}" for value in asdict(item).values()) + "\n",
+    )
+
+
+async def main(args: argparse.Namespace) -> int:
+    samples: list[Sample] = []
+    async with (
+        run_server("--forks=1", f"--shell={args.shell}") as server,
+        aiohttp.ClientSession() as session,
+    ):
+        (worker,) = server.workers
+        sys.stdout.write(
+            " ".join(f"{name:>10}" for name in Sample.__annotations__) + "\n",
+        )
+        samples.append(await sample(session, server, worker, 0))
+        write_sample(samples[-1])
+        for done in range(args.batch, args.sessions + 1, args.batch):
+            await churn(server, args.batch, args.concurrency)
+            samples.append(await sample(session, server, worker, done))
+            write_sample(samples[-1])
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump([asdict(item) for item in samples], file, indent=2)
+
+    found = leaks(samples, args)
+    if found:
+        sys.stdout.write(f"Leaking: {', '.join(found)}\n")
+        return 1
+    sys.stdout.write("No leaks found\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parser.parse_args())))
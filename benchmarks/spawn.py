@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import os
+import resource
+import statistics
+import sys
+import time
+from collections.abc import Awaitable, Callable
+
+from aiomisc import entrypoint, threaded
+
+from tty_aiohttp.app.handlers.ws import spawn
+from tty_aiohttp.app.handlers.ws.spawn import (
+    PtyProcess,
+    ShellProcess,
+    shell_environ,
+    spawn_on_pty,
+)
+
+Engine = Callable[[list[str], dict[str, str]], Awaitable[PtyProcess]]
+
+parser = argparse.ArgumentParser(
+    description="Compare PTY shell spawn engines",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument("--command", default="/bin/true")
+parser.add_argument("--count", type=int, default=200)
+parser.add_argument("--concurrency", type=int, default=32)
+parser.add_argument("--pool-size", type=int, default=4)
+
+
+async def spawn_preexec(argv: list[str], env: dict[str, str]) -> PtyProcess:
+    pid, fd, popen = await threaded(spawn_on_pty)(argv, env, preexec=True)
+    return PtyProcess(ShellProcess(pid, popen), fd)
+
+
+async def spawn_posix(argv: list[str], env: dict[str, str]) -> PtyProcess:
+    return await spawn.spawn(argv, env)
+
+
+def cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def run_one(
+    engine: Engine,
+    argv: list[str],
+    env: dict[str, str],
+) -> float:
+    started = time.perf_counter()
+    shell = await engine(argv, env)
+    latency = time.perf_counter() - started
+    await shell.process.wait()
+    os.close(shell.fd)
+    return latency
+
+
+async def measure(
+    name: str,
+    engine: Engine,
+    args: argparse.Namespace,
+) -> None:
+    argv, env = [args.command], shell_environ()
+    await run_one(engine, argv, env)
+
+    latencies = [await run_one(engine, argv, env) for _ in range(args.count)]
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited() -> float:
+        async with semaphore:
+            return await run_one(engine, argv, env)
+
+    cpu, started = cpu_time(), time.perf_counter()
+    await asyncio.gather(*(limited() for _ in range(args.count)))
+    elapsed = time.perf_counter() - started
+    cpu = cpu_time() - cpu
+
+    latencies.sort()
+    sys.stdout.write(
+        f"{name:<12} {statistics.median(latencies) * 1e6:>10.0f} "
+        f"{latencies[int(len(latencies) * 0.99)] * 1e6:>10.0f} "
+        f"{args.count / elapsed:>10.0f} "
+        f"{cpu / args.count * 1e6:>12.0f}\n",
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    sys.stdout.write(
+        f"{'engine':<12} {'p50 us':>10} {'p99 us':>10} "
+        f"{'spawn/s':>10} {'cpu us/spawn':>12}\n",
+    )
+    await measure("preexec_fn", spawn_preexec, args)
+    await measure("posix_spawn", spawn_posix, args)
+    if not spawn.POSIX_SPAWN_SETSID:
+        sys.stdout.write(
+            "posix_spawn lacks setsid here, both rows used preexec_fn\n",
+        )
+
+
+if __name__ == "__main__":
+    arguments = parser.parse_args()
+    with entrypoint(pool_size=arguments.pool_size) as loop:
+        loop.run_until_complete(main(arguments))
@@ -0,0 +1,353 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import secrets
+import string
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import suppress
+from typing import Any
+
+import aiohttp
+from aiohttp import hdrs
+from wsrpc_aiohttp import WSRPCClient
+from yarl import URL
+
+from benchmarks.server import Server, cpu_seconds, rss_kib, run_server
+from tty_aiohttp.app.handlers.ws import CMD_INPUT, CMD_RESIZE
+
+Result = dict[str, float]
+Scenario = Callable[
+    [Server, list["TermClient"], argparse.Namespace],
+    Awaitable[Result],
+]
+
+# Output kept per client to look for markers in
+TAIL_BYTES = 64 * 1024
+WAIT_TIMEOUT = 120.0
+KILL_LINE = b"\x15"
+EOF = b"\x04"
+
+parser = argparse.ArgumentParser(
+    description="Load and latency of WebSocket terminal sessions",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument("--sessions", type=int, default=16)
+parser.add_argument("--duration", type=float, default=5.0)
+parser.add_argument("--shell", default="/bin/sh")
+parser.add_argument("--output-bytes", type=int, default=8 * 1024 * 1024)
+parser.add_argument("--paste-bytes", type=int, default=256 * 1024)
+parser.add_argument(
+    "--scenario",
+    nargs="+",
+    choices=("echo", "yes", "cat", "paste", "churn", "ttfb"),
+    default=["echo", "yes", "cat", "paste", "churn", "ttfb"],
+)
+parser.add_argument("--json", help="Write the results to this file")
+parser.add_argument("--compare", help="Results of an earlier run to diff")
+
+
+class TermClient(WSRPCClient):
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.tail = bytearray()
+        self.received = 0
+        self.first_output: float | None = None
+        self._changed = asyncio.Event()
+
+    async def handle_binary(self, message: aiohttp.WSMessage) -> None:
+        if self.first_output is None:
+            self.first_output = time.perf_counter()
+        self.received += len(message.data)
+        self.tail += message.data
+        if len(self.tail) > 2 * TAIL_BYTES:
+            del self.tail[:-TAIL_BYTES]
+        self._changed.set()
+
+    async def input(self, data: bytes) -> None:
+        await self.socket.send_bytes(bytes([CMD_INPUT]) + data)
+
+    async def resize(self, rows: int, cols: int) -> None:
+        size = struct.pack(">HH", rows, cols)
+        await self.socket.send_bytes(bytes([CMD_RESIZE]) + size)
+
+    def _find(self, needle: bytes, start: int) -> bool:
+        base = self.received - len(self.tail)
+        return self.tail.find(needle, max(start - base, 0)) != -1
+
+    async def wait_for(self, needle: bytes, since: int) -> None:
+        # Only output received after the offset `since` counts
+        start = since
+        async with asyncio.timeout(WAIT_TIMEOUT):
+            while not self._find(needle, start):
+                start = max(self.received - len(needle) + 1, since)
+                self._changed.clear()
+                await self._changed.wait()
+
+    async def run(self, command: str) -> float:
+        # The echoed command line never matches, only the evaluated output
+        tag = "DONE" + secrets.token_hex(4)
+        since, started = self.received, time.perf_counter()
+        await self.input(f"{command}; echo {tag}$((1+1))\n".encode())
+        await self.wait_for(f"{tag}2".encode(), since)
+        return time.perf_counter() - started
+
+
+def create_client(url: URL, **query: str) -> TermClient:
+    return TermClient(
+        url.with_path("ws/").with_scheme("ws").with_query(query),
+        headers={hdrs.ORIGIN: str(url)},
+    )
+
+
+async def open_session(url: URL) -> TermClient:
+    client = create_client(url)
+    await client.connect()
+    await client.proxy.pty.ready(cols=120, rows=40)
+    await client.resize(40, 120)
+    await client.run("true")
+    return client
+
+
+def percentile(values: list[float], share: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+async def echo(
+    server: Server,
+    clients: list[TermClient],
+    args: argparse.Namespace,
+) -> Result:
+    latencies: list[float] = []
+    deadline = time.perf_counter() + args.duration
+
+    async def type_keys(client: TermClient) -> None:
+        for index in range(sys.maxsize):
+            if time.perf_counter() >= deadline:
+                break
+            # Line editing echoes no letters, so every probe is unambiguous
+            if index % 64 == 63:
+                await client.input(KILL_LINE)
+            key = string.ascii_letters[index % 52].encode()
+            since, started = client.received, time.perf_counter()
+            await client.input(key)
+            await client.wait_for(key, since)
+            latencies.append(time.perf_counter() - started)
+        await client.input(KILL_LINE)
+
+    await asyncio.gather(*(type_keys(client) for client in clients))
+    return {
+        "p50_ms": percentile(latencies, 0.5) * 1e3,
+        "p99_ms": percentile(latencies, 0.99) * 1e3,
+        "keys_per_s": len(latencies) / args.duration,
+    }
+
+
+async def bulk(clients: list[TermClient], command: str) -> Result:
+    received = sum(client.received for client in clients)
+    started = time.perf_counter()
+    await asyncio.gather(*(client.run(command) for client in clients))
+    elapsed = time.perf_counter() - started
+    received = sum(client.received for client in clients) - received
+    return {"mib_per_s": received / elapsed / 2**20, "seconds": elapsed}
+
+
+async def yes(
+    server: Server,
+    clients: list[TermClient],
+    args: argparse.Namespace,
+) -> Result:
+    return await bulk(clients, f"yes | head -c {args.output_bytes}")
+
+
+async def cat(
+    server: Server,
+    clients: list[TermClient],
+    args: argparse.Namespace,
+) -> Result:
+    with tempfile.NamedTemporaryFile(suffix=".txt") as file:
+        # Printable lines, the way a log file would be
+        data = base64.encodebytes(os.urandom(args.output_bytes * 3 // 4))
+        file.write(data)
+        file.flush()
+        return await bulk(clients, f"cat {file.name}")
+
+
+async def paste(
+    server: Server,
+    clients: list[TermClient],
+    args: argparse.Namespace,
+) -> Result:
+    line = (string.ascii_letters * 2)[:79].encode() + b"\n"
+    text = line * (args.paste_bytes // len(line))
+
+    async def paste_one(client: TermClient) -> float:
+        await client.input(b"cat > /dev/null\n")
+        started = time.perf_counter()
+        # A browser paste arrives as one input frame
+        await client.input(text + EOF)
+        await client.run("true")
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    durations = await asyncio.gather(*(paste_one(c) for c in clients))
+    elapsed = time.perf_counter() - started
+    return {
+        "p50_ms": percentile(list(durations), 0.5) * 1e3,
+        "p99_ms": percentile(list(durations), 0.99) * 1e3,
+        "mib_per_s": len(text) * len(clients) / elapsed / 2**20,
+    }
+
+
+async def churn(
+    server: Server,
+    clients: list[TermClient],
+    args: argparse.Namespace,
+) -> Result:
+    latencies: list[float] = []
+    deadline = time.perf_counter() + args.duration
+
+    async def reconnect() -> None:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            client = await open_session(server.url)
+            latencies.append(time.perf_counter() - started)
+            await client.close()
+
+    await asyncio.gather(*(reconnect() for _ in clients))
+    return {
+        "p50_ms": percentile(latencies, 0.5) * 1e3,
+        "p99_ms": percentile(latencies, 0.99) * 1e3,
+        "sessions_per_s": len(latencies) / args.duration,
+    }
+
+
+async def first_byte(url: URL, upgrade: bool) -> float:
+    size = {"cols": "120", "rows": "40"}
+    client = create_client(url, **size) if upgrade else create_client(url)
+    started = time.perf_counter()
+    try:
+        await client.connect()
+        if not upgrade:
+            await client.proxy.pty.ready(cols=120, rows=40)
+        async with asyncio.timeout(WAIT_TIMEOUT):
+            while client.first_output is None:
+                client._changed.clear()
+                await client._changed.wait()
+        return client.first_output - started
+    finally:
+        await client.close()
+
+
+async def ttfb(
+    server: Server,
+    clients: list[TermClient],
+    args: argparse.Namespace,
+) -> Result:
+    # From the start of the connection to the first byte of the prompt,
+    # with the size sent by ready() and with it in the upgrade request
+    result: Result = {}
+    for name, upgrade in (("rpc", False), ("upgrade", True)):
+        latencies: list[float] = []
+        deadline = time.perf_counter() + args.duration / 2
+
+        async def reconnect(upgrade: bool = upgrade) -> None:
+            while time.perf_counter() < deadline:
+                latencies.append(await first_byte(server.url, upgrade))
+
+        await asyncio.gather(*(reconnect() for _ in clients))
+        result[f"{name}_p50_ms"] = percentile(latencies, 0.5) * 1e3
+        result[f"{name}_p99_ms"] = percentile(latencies, 0.99) * 1e3
+    return result
+
+
+SCENARIOS: dict[str, Scenario] = {
+    "echo": echo,
+    "yes": yes,
+    "cat": cat,
+    "paste": paste,
+    "churn": churn,
+    "ttfb": ttfb,
+}
+
+
+def git_commit() -> str | None:
+    with suppress(OSError, subprocess.CalledProcessError):
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    return None
+
+
+def write_result(name: str, result: Result) -> None:
+    values = " ".join(f"{key}={value:.2f}" for key, value in result.items())
+    sys.stdout.write(f"{name:<10} {values}\n")
+
+
+def write_comparison(previous: dict[str, Any], current: dict[str, Any]) -> None:
+    sys.stdout.write(f"\nchange against {previous.get('commit')}\n")
+    old = previous.get("scenarios", {})
+    for name, result in current["scenarios"].items():
+        for key, value in result.items():
+            before = old.get(name, {}).get(key)
+            if not before:
+                continue
+            change = (value - before) / before * 100
+            sys.stdout.write(
+                f"{name:<10} {key:<16} {before:>10.2f} {value:>10.2f} "
+                f"{change:>+8.1f}%\n",
+            )
+
+
+async def main(args: argparse.Namespace) -> None:
+    results: dict[str, Any] = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "sessions": args.sessions,
+        "scenarios": {},
+    }
+    async with run_server("--forks=1", f"--shell={args.shell}") as server:
+        (worker,) = server.workers
+        idle = rss_kib(worker)
+        clients = await asyncio.gather(
+            *(open_session(server.url) for _ in range(args.sessions)),
+        )
+        results["rss_per_session_kib"] = (
+            rss_kib(worker) - idle
+        ) / args.sessions
+        sys.stdout.write(
+            f"{'sessions':<10} count={args.sessions} "
+            f"rss_per_session_kib={results['rss_per_session_kib']:.1f}\n",
+        )
+        try:
+            for name in args.scenario:
+                cpu, started = cpu_seconds(worker), time.perf_counter()
+                result = await SCENARIOS[name](server, clients, args)
+                elapsed = time.perf_counter() - started
+                result["worker_cpu"] = (cpu_seconds(worker) - cpu) / elapsed
+                results["scenarios"][name] = result
+                write_result(name, result)
+        finally:
+            for client in clients:
+                await client.close()
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            write_comparison(json.load(file), results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parser.parse_args()))
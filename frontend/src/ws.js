@@ -4,11 +4,52 @@ import { ElLoading as Loading } from "element-plus";
 import 'element-plus/es/components/loading/style/css'
 
 let _binaryHandler = null;
+let _connectParams = () => ({});
+
+const FRAME_DEFLATE = 0x01;
+const CODEC = "DecompressionStream" in window ? "deflate" : null;
+
+let _decoded = Promise.resolve();
+
+function inflate(payload) {
+    const stream = new Blob([payload])
+        .stream()
+        .pipeThrough(new DecompressionStream("deflate-raw"));
+    return new Response(stream).arrayBuffer();
+}
+
+function dispatchBinary(data) {
+    if (!CODEC) {
+        if (_binaryHandler) {
+            _binaryHandler(data);
+        }
+        return;
+    }
+    const frame = new Uint8Array(data);
+    const payload = frame.subarray(1);
+    const decoded = frame[0] === FRAME_DEFLATE ? inflate(payload) : payload;
+    // Inflating is asynchronous, chain frames to keep them in order
+    _decoded = _decoded
+        .then(() => decoded)
+        .then((buf) => {
+            if (_binaryHandler) {
+                _binaryHandler(buf);
+            }
+        })
+        .catch((err) => console.error("Can not decode frame", err));
+}
 
 const OriginalWebSocket = window.WebSocket;
 
 window.WebSocket = function(url, protocols) {
-    const ws = new OriginalWebSocket(url, protocols);
+    // Read on every (re)connect, so the upgrade carries the current state
+    const target = new URL(url, location.href);
+    for (const [key, value] of Object.entries(_connectParams())) {
+        if (value !== null && value !== undefined) {
+            target.searchParams.set(key, value);
+        }
+    }
+    const ws = new OriginalWebSocket(target, protocols);
     ws.binaryType = "arraybuffer";
 
     let _wsrpcOnMessage = null;
@@ -24,9 +65,7 @@ window.WebSocket = function(url, protocols) {
 
     ws.addEventListener("message", function(event) {
         if (event.data instanceof ArrayBuffer) {
-            if (_binaryHandler) {
-                _binaryHandler(event.data);
-            }
+            dispatchBinary(event.data);
         } else if (_wsrpcOnMessage) {
             _wsrpcOnMessage(event);
         }
@@ -40,7 +79,7 @@ window.WebSocket.CLOSING = OriginalWebSocket.CLOSING;
 window.WebSocket.CLOSED = OriginalWebSocket.CLOSED;
 window.WebSocket.prototype = OriginalWebSocket.prototype;
 
-const wsrpc = new WSRPC("/ws/");
+const wsrpc = new WSRPC(CODEC ? `/ws/?codec=${CODEC}` : "/ws/");
 let loading;
 
 wsrpc.addEventListener("onconnect", function () {
@@ -61,8 +100,18 @@ wsrpc.addEventListener("onerror", function () {
     });
 });
 
+wsrpc.addEventListener("onevent", function (event) {
+    if (event.event === "input_dropped") {
+        console.warn(`Terminal input dropped, ${event.bytes} bytes`);
+    }
+});
+
 export function setBinaryHandler(callback) {
     _binaryHandler = callback;
 }
 
+export function setConnectParams(callback) {
+    _connectParams = callback;
+}
+
 export default wsrpc;
@@ -6,7 +6,9 @@ from aiohttp.test_utils import TestClient, TestServer
 from wsrpc_aiohttp import WSRPCClient
 from yarl import URL
 
+from tests.helpers.pty import PtyClient
 from tty_aiohttp.app.__main__ import parser
+from tty_aiohttp.app.handlers.ws.pty import TerminalOptions
 from tty_aiohttp.app.services.rest import REST
 
 
@@ -34,6 +36,9 @@ def arguments(rest_url: URL):
             "--log-level=debug",
             f"--api-address={rest_url.host}",
             f"--api-port={rest_url.port}",
+            "--shell=/bin/sh",
+            "--session-ttl=60",
+            "--shell-pool-size=1",
         ]
     )
 
@@ -45,6 +50,9 @@ async def rest_service(arguments: Namespace):
         port=arguments.api_port,
         debug=arguments.debug,
         env=arguments.sentry_env,
+        shell=arguments.shell,
+        shell_pool_size=arguments.shell_pool_size,
+        terminal_options=TerminalOptions(session_ttl=arguments.session_ttl),
     )
 
 
@@ -70,3 +78,29 @@ async def wsrpc_client(rest_url, services):
         yield client
     finally:
         await client.close()
+
+
+@pytest.fixture
+async def pty_client_factory(rest_url, services):
+    clients: list[PtyClient] = []
+
+    async def factory(
+        url: URL | None = None,
+        client_class: type[PtyClient] = PtyClient,
+        **query: str,
+    ) -> PtyClient:
+        url = url or rest_url
+        client = client_class(
+            url.with_path("ws/").with_scheme("ws").with_query(query),
+            codec=query.get("codec"),
+            headers={hdrs.ORIGIN: str(url)},
+        )
+        clients.append(client)
+        await client.connect()
+        return client
+
+    try:
+        yield factory
+    finally:
+        for client in clients:
+            await client.close()
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from tty_aiohttp.app.handlers.ws.buffers import ReadBuffers
+
+
+@pytest.fixture
+def pipe():
+    read_fd, write_fd = os.pipe()
+    yield read_fd, write_fd
+    os.close(read_fd)
+    os.close(write_fd)
+
+
+def test_read_returns_views_of_the_data(pipe):
+    read_fd, write_fd = pipe
+    buffers = ReadBuffers(arena_size=64, copy_below=0)
+    os.write(write_fd, b"hello")
+    chunk = buffers.read(read_fd, 16)
+    assert isinstance(chunk, memoryview)
+    assert chunk == b"hello"
+
+
+def test_queued_chunks_survive_arena_reuse(pipe):
+    read_fd, write_fd = pipe
+    buffers = ReadBuffers(arena_size=64, max_free=2, copy_below=0)
+    os.write(write_fd, b"kept")
+    kept = buffers.read(read_fd, 16)
+
+    for i in range(100):
+        os.write(write_fd, bytes([i]) * 16)
+        assert buffers.read(read_fd, 16) == bytes([i]) * 16
+
+    assert kept == b"kept"
+    # Only the arena pinned by the kept chunk is never reused
+    assert buffers.arenas_allocated <= 3
+
+
+def test_small_reads_pin_no_arena(pipe):
+    read_fd, write_fd = pipe
+    buffers = ReadBuffers(arena_size=64, copy_below=16)
+    kept = []
+    for i in range(100):
+        os.write(write_fd, bytes([i]) * 8)
+        kept.append(buffers.read(read_fd, 32))
+
+    assert all(type(chunk) is bytes for chunk in kept)
+    assert kept[-1] == bytes([99]) * 8
+    assert buffers.arenas_allocated == 1
+
+    os.write(write_fd, b"x" * 16)
+    assert isinstance(buffers.read(read_fd, 32), memoryview)
+
+
+def test_reads_larger_than_an_arena(pipe):
+    read_fd, write_fd = pipe
+    buffers = ReadBuffers(arena_size=64)
+    os.write(write_fd, b"x" * 100)
+    assert buffers.read(read_fd, 128) == b"x" * 100
@@ -0,0 +1,141 @@
+import asyncio
+
+from tests.helpers.pty import MuxClient
+from tty_aiohttp.app.handlers.ws.pty import PtyHandler, TerminalOptions
+
+
+async def mux_client(pty_client_factory) -> MuxClient:
+    return await pty_client_factory(client_class=MuxClient, mux="1")
+
+
+async def test_channels_share_connection(pty_client_factory):
+    client = await mux_client(pty_client_factory)
+    first = await client.proxy.pty.ready(cols=80, rows=24, channel=1)
+    second = await client.proxy.pty.ready(cols=80, rows=24, channel=2)
+    assert first["session"] != second["session"]
+
+    await client.input(b"echo ONE$((6*7))\n", channel=1)
+    await client.input(b"echo TWO$((6*7))\n", channel=2)
+    await client.channels[1].wait_for(b"ONE42")
+    await client.channels[2].wait_for(b"TWO42")
+    assert b"TWO42" not in client.channels[1].data
+    assert b"ONE42" not in client.channels[2].data
+
+
+async def test_closed_channel_leaves_others_open(pty_client_factory):
+    client = await mux_client(pty_client_factory)
+    await client.proxy.pty.ready(cols=80, rows=24, channel=1)
+    await client.proxy.pty.ready(cols=80, rows=24, channel=2)
+    await client.proxy.pty.close_channel(channel=1)
+
+    await client.input(b"echo GONE$((6*7))\n", channel=1)
+    await client.input(b"echo OPEN$((6*7))\n", channel=2)
+    await client.channels[2].wait_for(b"OPEN42")
+    assert b"GONE42" not in client.channels[1].data
+
+
+async def test_opening_channel_does_not_stall_others(
+    pty_client_factory,
+    monkeypatch,
+):
+    client = await mux_client(pty_client_factory)
+    await client.proxy.pty.ready(cols=80, rows=24, channel=2)
+    gate = asyncio.Event()
+    spawn = PtyHandler._spawn
+
+    async def slow_spawn(self):
+        await gate.wait()
+        return await spawn(self)
+
+    monkeypatch.setattr(PtyHandler, "_spawn", slow_spawn)
+    opening = asyncio.create_task(
+        client.proxy.pty.ready(cols=80, rows=24, channel=1),
+    )
+    await asyncio.sleep(0.1)
+    # Typed while the shell of channel 1 is still starting
+    await client.input(b"echo EARLY$((6*7))\n", channel=1)
+    await client.input(b"echo OTHER$((6*7))\n", channel=2)
+    await client.channels[2].wait_for(b"OTHER42", timeout=2)
+
+    gate.set()
+    await opening
+    await client.channels[1].wait_for(b"EARLY42")
+
+
+async def test_noisy_channel_does_not_stall_others(pty_client_factory):
+    client = await mux_client(pty_client_factory)
+    await client.proxy.pty.ready(cols=80, rows=24, channel=1)
+    await client.proxy.pty.ready(cols=80, rows=24, channel=2)
+    window = 64 * 1024
+    await client.grant(window, channel=1)
+    await client.input(b"yes\n", channel=1)
+
+    for _ in range(10):
+        await client.input(b"echo QUIET$((6*7))\n", channel=2)
+        await client.channels[2].wait_for(b"QUIET42", timeout=1)
+        client.channels[2].frames.clear()
+
+    noisy = len(client.channels[1].data)
+    assert window <= noisy <= window + TerminalOptions().coalesce_bytes
+
+
+async def test_reattach_closes_previous_channel(pty_client_factory):
+    client = await mux_client(pty_client_factory)
+    result = await client.proxy.pty.ready(cols=80, rows=24, channel=1)
+    session = result["session"]
+    await client.input(b"echo MARK$((6*7))\n", channel=1)
+    await client.channels[1].wait_for(b"MARK42")
+
+    other = await mux_client(pty_client_factory)
+    await other.proxy.pty.ready(cols=80, rows=24, session=session, channel=5)
+    await other.channels[5].wait_for(b"MARK42")
+    async with asyncio.timeout(5):
+        while 1 not in client.closed_channels:
+            await asyncio.sleep(0.01)
+    assert client.closed_channels[1] == b"Session attached elsewhere"
+
+
+async def test_stuck_input_does_not_stall_others(pty_client_factory):
+    client = await mux_client(pty_client_factory)
+    await client.proxy.pty.ready(cols=80, rows=24, channel=1)
+    await client.proxy.pty.ready(cols=80, rows=24, channel=2)
+    script = b"stty raw -echo; echo STUCK$((6*7)); sleep 30\n"
+    await client.input(script, channel=1)
+    await client.channels[1].wait_for(b"STUCK42")
+
+    events: list[dict] = []
+    client.add_event_listener(events.append)
+
+    # Input past the backlog waits for the PTY, past twice of it the
+    # client is told it was dropped, a paste waits for drain()
+    for _ in range(16):
+        await client.input(b"x" * 64 * 1024, channel=1)
+    paste = asyncio.create_task(client.paste(b"y" * 1024 * 1024, channel=1))
+    try:
+        for _ in range(3):
+            await client.input(b"echo QUIET$((6*7))\n", channel=2)
+            await client.channels[2].wait_for(b"QUIET42", timeout=2)
+            client.channels[2].frames.clear()
+        assert not paste.done()
+    finally:
+        paste.cancel()
+    assert events
+    assert {event["event"] for event in events} == {"input_dropped"}
+    assert {event["channel"] for event in events} == {1}
+
+
+async def test_input_past_backlog_waits_for_pty(pty_client_factory):
+    client = await mux_client(pty_client_factory)
+    await client.proxy.pty.ready(cols=80, rows=24, channel=1)
+    # The size is only spelled out by wc, not by the echoed command
+    script = b"stty raw -echo; echo HELD$((6*7)); sleep 1; "
+    script += b"head -c $((7*65536)) | wc -c\n"
+    await client.input(script, channel=1)
+    await client.channels[1].wait_for(b"HELD42")
+
+    events: list[dict] = []
+    client.add_event_listener(events.append)
+    for _ in range(7):
+        await client.input(b"x" * 64 * 1024, channel=1)
+    await client.channels[1].wait_for(b"458752")
+    assert not events
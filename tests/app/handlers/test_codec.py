@@ -0,0 +1,47 @@
+import os
+import zlib
+
+from tty_aiohttp.app.handlers.ws.codec import (
+    BACKOFF_FRAMES,
+    FRAME_DEFLATE,
+    FRAME_RAW,
+    CompressionStats,
+    DeflateEncoder,
+)
+
+
+def inflate(frame: bytes) -> bytes:
+    return zlib.decompress(frame, -zlib.MAX_WBITS)
+
+
+def test_small_frames_are_not_compressed():
+    encoder = DeflateEncoder(min_bytes=1024, level=6, stats=CompressionStats())
+    assert encoder.encode(b"a") == FRAME_RAW + b"a"
+    assert encoder.stats.frames_raw == 1
+    assert encoder.stats.cpu_ns == 0
+
+
+def test_large_frames_are_compressed():
+    stats = CompressionStats()
+    encoder = DeflateEncoder(min_bytes=1024, level=6, stats=stats)
+    data = b"\x1b[32mINFO\x1b[0m request handled\r\n" * 2048
+
+    frame = encoder.encode(data)
+    assert frame[:1] == FRAME_DEFLATE
+    assert inflate(frame[1:]) == data
+    assert stats.frames_compressed == 1
+    assert stats.bytes_in == len(data)
+    assert stats.ratio < 0.1
+    assert stats.cpu_ns > 0
+
+
+def test_incompressible_output_backs_off():
+    stats = CompressionStats()
+    encoder = DeflateEncoder(min_bytes=1024, level=6, stats=stats)
+
+    data = os.urandom(32 * 1024)
+    assert encoder.encode(data) == FRAME_RAW + data
+    for _ in range(BACKOFF_FRAMES):
+        assert encoder.encode(b"x" * 4096)[:1] == FRAME_RAW
+    assert stats.bytes_in == len(data)
+    assert encoder.encode(b"x" * 4096)[:1] == FRAME_DEFLATE
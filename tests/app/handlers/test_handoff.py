@@ -0,0 +1,77 @@
+import os
+from argparse import Namespace
+
+import pytest
+from yarl import URL
+
+from tty_aiohttp.app.handlers.ws.pty import SESSIONS_KEY, TerminalOptions
+from tty_aiohttp.app.services.rest import REST
+
+
+@pytest.fixture
+def session_dir(tmp_path) -> str:
+    return str(tmp_path)
+
+
+@pytest.fixture
+def peer_url(aiomisc_unused_port_factory, localhost) -> URL:
+    port = aiomisc_unused_port_factory()
+    return URL.build(scheme="http", host=localhost, port=port)
+
+
+def create_rest(arguments: Namespace, url: URL, session_dir: str) -> REST:
+    return REST(
+        address=url.host,
+        port=url.port,
+        env=arguments.sentry_env,
+        shell=arguments.shell,
+        terminal_options=TerminalOptions(session_ttl=arguments.session_ttl),
+        session_dir=session_dir,
+    )
+
+
+@pytest.fixture
+def services(arguments, rest_url, peer_url, session_dir):
+    return [
+        create_rest(arguments, rest_url, session_dir),
+        create_rest(arguments, peer_url, session_dir),
+    ]
+
+
+async def test_reattach_on_another_worker(
+    pty_client_factory,
+    peer_url,
+    services,
+):
+    client = await pty_client_factory()
+    result = await client.proxy.pty.ready(cols=80, rows=24)
+    await client.input(b"echo MARK$((6*7))\n")
+    await client.output.wait_for(b"MARK42")
+    # Printed while the PTY is moving between workers
+    await client.input(b"sleep 0.5; echo LATE$((2+3))\n")
+    await client.close()
+
+    client = await pty_client_factory(peer_url)
+    session = result["session"]
+    result = await client.proxy.pty.ready(cols=80, rows=24, session=session)
+    assert result["session"] == session
+    await client.output.wait_for(b"MARK42")
+    await client.output.wait_for(b"LATE5")
+
+    await client.input(b"echo MOVED$((1+1))\n")
+    await client.output.wait_for(b"MOVED2")
+
+    owner, peer = (service.runner.app for service in services)
+    assert session not in owner[SESSIONS_KEY]
+    assert session in peer[SESSIONS_KEY]
+    assert not os.get_inheritable(peer[SESSIONS_KEY][session].fd)
+
+
+async def test_watch_on_another_worker(pty_client_factory, peer_url):
+    owner = await pty_client_factory()
+    result = await owner.proxy.pty.ready(cols=80, rows=24)
+
+    viewer = await pty_client_factory(peer_url)
+    await viewer.proxy.pty.watch(session=result["view"])
+    await owner.input(b"echo WATCH$((6*7))\n")
+    await viewer.output.wait_for(b"WATCH42")
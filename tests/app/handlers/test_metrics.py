@@ -0,0 +1,98 @@
+import tracemalloc
+from http import HTTPStatus
+
+from tty_aiohttp.app import metrics
+from tty_aiohttp.app.handlers.ws.codec import CompressionStats, DeflateEncoder
+from tty_aiohttp.app.metrics import Registry
+
+URL = "/api/v1/metrics"
+
+
+def sample(text: str, name: str) -> float:
+    for line in text.splitlines():
+        key, _, value = line.rpartition(" ")
+        if key == name:
+            return float(value)
+    raise LookupError(name)
+
+
+def test_registry_aggregates_workers():
+    registry = Registry()
+    counter = registry.counter("requests", "Requests")
+    gauge = registry.gauge("queue", "Queue")
+    histogram = registry.histogram("latency", "Latency", buckets=(1.0,))
+    registry.allocate(2)
+
+    registry.bind(0)
+    counter.inc(2)
+    gauge.set(5)
+    histogram.observe(0.5)
+    registry.bind(1)
+    counter.inc(3)
+    histogram.observe(2)
+
+    text = registry.render()
+    assert "# TYPE latency histogram" in text
+    assert sample(text, "requests_total") == 5
+    assert sample(text, 'queue{worker="0"}') == 5
+    assert sample(text, 'queue{worker="1"}') == 0
+    assert sample(text, 'latency_bucket{le="1"}') == 1
+    assert sample(text, 'latency_bucket{le="+Inf"}') == 2
+    assert sample(text, "latency_count") == 2
+    assert sample(text, "latency_sum") == 2.5
+
+
+def test_recording_does_not_allocate():
+    registry = Registry()
+    counter = registry.counter("bytes", "Bytes")
+    registry.allocate()
+    counter.inc(4096)
+
+    # Threads left over by other tests allocate too, only count ours
+    only_metrics = [tracemalloc.Filter(True, metrics.__file__)]
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot().filter_traces(only_metrics)
+        for _ in range(10000):
+            counter.inc(4096)
+        after = tracemalloc.take_snapshot().filter_traces(only_metrics)
+    finally:
+        tracemalloc.stop()
+    grown = sum(stat.size_diff for stat in after.compare_to(before, "lineno"))
+    assert grown < 1024
+
+
+async def test_metrics(api_client, pty_client_factory):
+    client = await pty_client_factory()
+    await client.proxy.pty.ready(cols=80, rows=24)
+    await client.input(b"echo METRICS$((6*7))\n")
+    await client.output.wait_for(b"METRICS42")
+
+    resp = await api_client.get(URL)
+    assert resp.status == HTTPStatus.OK
+    assert resp.content_type == "text/plain"
+    text = await resp.text()
+    assert sample(text, "tty_sessions_opened_total") >= 1
+    assert sample(text, "tty_pty_read_bytes_total") > 0
+    assert sample(text, "tty_frames_sent_total") > 0
+    assert sample(text, "tty_spawn_seconds_count") >= 1
+    sessions = sample(text, "tty_pool_hits_total")
+    sessions += sample(text, "tty_pool_misses_total")
+    assert sessions >= 1
+
+
+def test_compression_is_exported():
+    def exported() -> tuple[float, float]:
+        text = metrics.REGISTRY.render()
+        return (
+            sample(text, "tty_compress_bytes_total"),
+            sample(text, "tty_compress_seconds_total"),
+        )
+
+    encoder = DeflateEncoder(min_bytes=1024, level=6, stats=CompressionStats())
+    data = b"\x1b[32mINFO\x1b[0m request handled\r\n" * 2048
+    before = exported()
+    encoder.encode(data)
+    after = exported()
+    assert after[0] - before[0] == len(data)
+    assert after[1] > before[1]
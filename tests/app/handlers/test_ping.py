@@ -1,7 +1,14 @@
+import asyncio
 from http import HTTPStatus
 
 from tty_aiohttp import __version__
 from tty_aiohttp.app.handlers.v1.ping import X_VERSION
+from tty_aiohttp.app.health import (
+    HEALTH_KEY,
+    SAMPLE_INTERVAL,
+    HealthOptions,
+    HealthSample,
+)
 
 URL = "/api/v1/ping"
 
@@ -10,3 +17,31 @@ async def test_version(api_client):
     resp = await api_client.get(URL)
     assert resp.status == HTTPStatus.OK
     assert resp.headers[X_VERSION] == __version__
+
+
+async def test_terminal_limit(api_client, pty_client_factory, rest_service):
+    health = rest_service.runner.app[HEALTH_KEY]
+    health.options = HealthOptions(max_terminals=1)
+
+    client = await pty_client_factory()
+    await client.proxy.pty.ready(cols=80, rows=24)
+    await asyncio.sleep(SAMPLE_INTERVAL * 3)
+
+    resp = await api_client.get(URL)
+    assert resp.status == HTTPStatus.SERVICE_UNAVAILABLE
+    data = await resp.json()
+    assert data["status"] is False
+    assert data["failed"] == ["terminals"]
+    assert data["terminals"] == 1
+
+
+def test_failures():
+    options = HealthOptions(max_loop_lag=0.5, min_free_fds=10)
+    assert HealthSample(loop_lag=0.1).failures(options) == []
+    sample = HealthSample(
+        loop_lag=2,
+        pool_backlog=1000,
+        open_fds=95,
+        fd_limit=100,
+    )
+    assert sample.failures(options) == ["loop_lag", "pool_backlog", "fds"]
@@ -0,0 +1,57 @@
+import asyncio
+import os
+
+from tty_aiohttp.app.handlers.ws.pool import ShellPool
+
+
+async def wait_idle(pool: ShellPool, size: int) -> None:
+    async with asyncio.timeout(5):
+        while len(pool) < size:
+            await asyncio.sleep(0.01)
+
+
+async def test_pool_serves_ready_shell():
+    pool = ShellPool("/bin/sh", max_idle=2, min_idle=1)
+    pool.start()
+    try:
+        await wait_idle(pool, 1)
+        shell = pool.acquire()
+        assert shell is not None and shell.alive
+        assert pool.stats.hits == 1
+
+        os.set_blocking(shell.fd, False)
+        os.write(shell.fd, b"echo POOL$((6*7))\n")
+        output = b""
+        async with asyncio.timeout(5):
+            while b"POOL42" not in output:
+                await asyncio.sleep(0.01)
+                try:
+                    output += os.read(shell.fd, 1024)
+                except BlockingIOError:
+                    pass
+        shell.kill()
+
+        # The taken shell is replaced in the background
+        await wait_idle(pool, 1)
+    finally:
+        await pool.close()
+    assert not len(pool)
+
+
+async def test_pool_miss_and_dead_shells():
+    pool = ShellPool("/bin/sh", max_idle=1, min_idle=1)
+    assert pool.acquire() is None
+    assert pool.stats.misses == 1
+
+    pool.start()
+    try:
+        await wait_idle(pool, 1)
+        idle = pool._idle[0]
+        idle.process.kill()
+        await idle.process.wait()
+
+        assert pool.acquire() is None
+        assert pool.stats.misses == 2
+        assert pool.stats.discarded == 1
+    finally:
+        await pool.close()
@@ -0,0 +1,28 @@
+import asyncio
+import threading
+
+from tty_aiohttp.app.handlers.ws.reaper import get_reaper
+from tty_aiohttp.app.handlers.ws.spawn import spawn
+
+
+async def test_exit_codes_without_waiter_threads():
+    reaper = get_reaper()
+    threads = threading.active_count()
+    shells = [await spawn(["sh", "-c", f"exit {i}"]) for i in range(32)]
+    assert threading.active_count() <= threads + 1
+
+    async with asyncio.timeout(5):
+        codes = await asyncio.gather(*(s.process.wait() for s in shells))
+    for shell in shells:
+        shell.kill()
+
+    assert codes == list(range(32))
+    assert not any(shell.process.pid in reaper for shell in shells)
+
+
+async def test_killed_child_reports_signal():
+    shell = await spawn(["sleep", "60"])
+    shell.process.kill()
+    async with asyncio.timeout(5):
+        assert await shell.process.wait() == -9
+    shell.kill()
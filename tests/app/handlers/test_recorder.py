@@ -0,0 +1,97 @@
+import gzip
+import json
+import os
+import typing as t
+from pathlib import Path
+
+from tests.helpers.pty import FakeWebSocket
+from tty_aiohttp.app.handlers.ws.pty import Terminal
+from tty_aiohttp.app.handlers.ws.recorder import (
+    BATCH_BYTES,
+    Recorder,
+    RecordingOptions,
+)
+from tty_aiohttp.app.handlers.ws.spawn import spawn
+
+
+def read_casts(directory: Path) -> list[list[t.Any]]:
+    casts = []
+    for path in sorted(directory.glob("*.cast.gz")):
+        assert path.stat().st_mode & 0o777 == 0o600
+        with gzip.open(path, "rt") as stream:
+            casts.append([json.loads(line) for line in stream])
+    return casts
+
+
+async def test_session_is_recorded(tmp_path):
+    recorder = Recorder(RecordingOptions(directory=str(tmp_path)))
+    recorder.start()
+    shell = await spawn(["sh", "-c", "read line; echo GOT$line; exec cat"])
+    terminal = Terminal(
+        shell.process,
+        shell.fd,
+        FakeWebSocket(),  # type: ignore[arg-type]
+        recording=recorder.record(shell.process.pid),
+    )
+    ws: FakeWebSocket = terminal.ws  # type: ignore[assignment]
+    try:
+        terminal.resize(rows=30, cols=100)
+        await terminal.write("ЖЖ\n".encode())
+        await ws.wait_for("GOTЖЖ".encode())
+        terminal.resize(rows=40, cols=120)
+    finally:
+        await terminal.close()
+        await recorder.close()
+
+    [cast] = read_casts(tmp_path)
+    header, *events = cast
+    assert header["version"] == 2
+    assert header["width"] == 100
+    assert header["height"] == 30
+    output = "".join(data for _, kind, data in events if kind == "o")
+    assert "GOTЖЖ" in output
+    assert events[-1][1:] == ["r", "120x40"]
+    times = [event[0] for event in events]
+    assert times == sorted(times)
+    assert recorder.stats.dropped == 0
+
+
+async def test_recordings_rotate(tmp_path):
+    options = RecordingOptions(directory=str(tmp_path), rotate_bytes=1024)
+    recorder = Recorder(options)
+    recorder.start()
+    recording = recorder.record(os.getpid())
+    try:
+        for _ in range(4):
+            recording.output(b"x" * BATCH_BYTES)
+        recording.close()
+    finally:
+        await recorder.close()
+
+    casts = read_casts(tmp_path)
+    assert len(casts) == 4
+    for header, event in casts:
+        assert header["version"] == 2
+        assert event[1:] == ["o", "x" * BATCH_BYTES]
+
+
+async def test_overload_drops_output(tmp_path):
+    options = RecordingOptions(directory=str(tmp_path), queue_bytes=1024)
+    recorder = Recorder(options)
+    recorder.start()
+    recording = recorder.record(os.getpid())
+    try:
+        recording.output(b"x" * 2048)
+        recording.flush()
+        recording.output(b"kept")
+        recording.close()
+    finally:
+        await recorder.close()
+
+    assert recorder.stats.dropped == 2048
+    assert recorder.stats.recorded == 4
+    [[_, *events]] = read_casts(tmp_path)
+    assert [event[1:] for event in events] == [
+        ["m", "output dropped"],
+        ["o", "kept"],
+    ]
@@ -0,0 +1,39 @@
+import pytest
+
+from tty_aiohttp.app.handlers.ws.screen import VirtualScreen
+
+pyte = pytest.importorskip("pyte")
+
+
+def cells(screen) -> list[list[tuple]]:
+    return [
+        [tuple(screen.buffer[y][x]) for x in range(screen.columns)]
+        for y in range(screen.lines)
+    ]
+
+
+def test_snapshot_reproduces_screen():
+    source = VirtualScreen(rows=5, cols=20)
+    source.feed(
+        b"plain\r\n\x1b[1;31mbold red\x1b[0m\r\n"
+        b"\x1b[38;5;208;44mindexed\x1b[0m \xe4\xb8\xad\x1b[3;4H\x1b[7m",
+    )
+    frame, _ = source.render(None)
+
+    copy = pyte.Screen(20, 5)
+    pyte.ByteStream(copy).feed(frame)
+    assert cells(copy) == cells(source._screen)
+    assert (copy.cursor.y, copy.cursor.x) == (2, 3)
+    assert copy.cursor.attrs == source._screen.cursor.attrs
+
+
+def test_update_redraws_changed_lines_only():
+    screen = VirtualScreen(rows=5, cols=20)
+    screen.feed(b"one\r\ntwo\r\nthree")
+    _, lines = screen.render(None)
+
+    screen.feed(b"\x1b[2;1Htwo!")
+    frame, _ = screen.render(lines)
+    assert b"two!" in frame
+    assert b"one" not in frame
+    assert b"three" not in frame
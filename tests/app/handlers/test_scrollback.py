@@ -0,0 +1,73 @@
+import pytest
+
+from tty_aiohttp.app.handlers.ws.scrollback import RingBuffer
+
+
+@pytest.mark.parametrize("capacity", [0, 1, 7, 64])
+def test_ring_buffer_keeps_tail(capacity):
+    ring = RingBuffer(capacity)
+    written = b""
+    for i in range(100):
+        chunk = bytes([i]) * (i % 13)
+        ring.append(chunk)
+        written += chunk
+        expected = written[-capacity:] if capacity else b""
+        assert ring.tail() == expected
+        assert len(ring) == len(expected)
+
+
+@pytest.mark.parametrize("capacity", [0, 1, 7, 64])
+def test_ring_buffer_last(capacity):
+    ring = RingBuffer(capacity)
+    written = b""
+    for i in range(100):
+        chunk = bytes([i]) * (i % 13)
+        ring.append(chunk)
+        written += chunk
+        for size in (0, 1, 5, capacity, capacity + 1):
+            expected = written[len(written) - min(size, len(ring)) :]
+            assert ring.last(size) == expected
+
+
+def test_ring_buffer_counts_large_appends():
+    ring = RingBuffer(8)
+    ring.append(b"0123456789")
+    ring.append(b"abcdefghijkl")
+    assert ring.written == 22
+    assert ring.tail() == b"efghijkl"
+    ring.append(b"xy")
+    assert ring.written == 24
+    assert ring.tail() == b"ghijklxy"
+    assert ring.last(3) == b"lxy"
+
+
+def test_ring_buffer_clear():
+    ring = RingBuffer(8)
+    ring.append(b"0123456789")
+    ring.clear()
+    assert ring.tail() == b""
+    ring.append(b"ab")
+    assert ring.tail() == b"ab"
+
+
+@pytest.mark.parametrize("written", [5, 20])
+def test_ring_buffer_spill_and_restore(tmp_path, written):
+    ring = RingBuffer(8)
+    data = bytes(range(written))
+    ring.append(data)
+    ring.spill(str(tmp_path))
+    assert ring.spilled
+    # The file is unlinked, only the mapping keeps it
+    assert not list(tmp_path.iterdir())
+    assert ring.tail(b">") == b">" + data[-8:]
+
+    ring.append(b"ab")
+    data += b"ab"
+    assert ring.tail() == data[-8:]
+    assert ring.last(3) == data[-3:]
+
+    ring.restore()
+    assert not ring.spilled
+    assert ring.tail() == data[-8:]
+    ring.append(b"c")
+    assert ring.tail() == (data + b"c")[-8:]
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from tty_aiohttp.app.handlers.ws import spawn as spawn_module
+from tty_aiohttp.app.handlers.ws.spawn import spawn, spawn_on_pty
+
+
+async def read_until_exit(fd: int, process) -> bytes:
+    await asyncio.wait_for(process.wait(), timeout=5)
+    os.set_blocking(fd, False)
+    output = b""
+    try:
+        while chunk := os.read(fd, 1024):
+            output += chunk
+    except (BlockingIOError, OSError):
+        pass
+    return output
+
+
+async def test_spawned_shell_owns_terminal():
+    script = "(: </dev/tty) && echo CTTY; ps -o sid=,pgid= -p $$; exit 3"
+    shell = await spawn(["sh", "-c", script])
+    try:
+        output = await read_until_exit(shell.fd, shell.process)
+    finally:
+        os.close(shell.fd)
+
+    assert shell.process.returncode == 3
+    lines = output.decode().split()
+    assert lines[0] == "CTTY"
+    assert lines[1:] == [str(shell.process.pid)] * 2
+
+
+async def test_spawned_shell_inherits_no_descriptors():
+    read_fd, write_fd = os.pipe()
+    leaked = os.dup2(read_fd, 200)
+    os.set_inheritable(leaked, True)
+    try:
+        shell = await spawn(["sh", "-c", "ls /proc/$$/fd"])
+        try:
+            output = await read_until_exit(shell.fd, shell.process)
+        finally:
+            os.close(shell.fd)
+    finally:
+        for fd in (read_fd, write_fd, leaked):
+            os.close(fd)
+
+    fds = {int(fd) for fd in output.split()}
+    assert {0, 1, 2} <= fds
+    assert not fds & {read_fd, write_fd, leaked}
+
+
+def test_inheritable_descriptors_are_closed_on_exec():
+    read_fd, write_fd = os.pipe()
+    os.set_inheritable(read_fd, True)
+    try:
+        # posix_spawn keeps whatever is inheritable, where it can not
+        # start a session the fallback closes descriptors itself
+        spawn_module._close_on_exec()
+        assert not os.get_inheritable(read_fd)
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+async def test_cancelled_spawn_kills_shell(monkeypatch):
+    spawned = []
+
+    def slow_spawn_on_pty(*args):
+        time.sleep(0.2)
+        spawned.append(spawn_on_pty(*args))
+        return spawned[-1]
+
+    monkeypatch.setattr(spawn_module, "spawn_on_pty", slow_spawn_on_pty)
+    task = asyncio.create_task(spawn(["sh", "-c", "sleep 30"]))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    async with asyncio.timeout(5):
+        while not spawned:
+            await asyncio.sleep(0.01)
+        pid, fd, _ = spawned[0]
+        # Gone once killed and reaped
+        while True:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                break
+            await asyncio.sleep(0.01)
+    with pytest.raises(OSError):
+        os.fstat(fd)
@@ -0,0 +1,541 @@
+import asyncio
+import hashlib
+import os
+import signal
+from collections.abc import AsyncIterator, Awaitable, Callable
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from tests.helpers.pty import FakeWebSocket
+from tty_aiohttp.app.handlers.ws.codec import FRAME_DEFLATE, FRAME_RAW
+from tty_aiohttp.app.handlers.ws.pty import (
+    MIN_READ_SIZE,
+    REPLAY_PREFIX,
+    SESSIONS_KEY,
+    TERMINAL_OPTIONS_KEY,
+    TERMINALS_KEY,
+    Terminal,
+    TerminalOptions,
+    close_all_terminals,
+)
+from tty_aiohttp.app.handlers.ws.screen import HIDE_CURSOR, screen_supported
+from tty_aiohttp.app.handlers.ws.spawn import spawn
+
+TerminalFactory = Callable[..., Awaitable[Terminal]]
+
+needs_screen = pytest.mark.skipif(
+    not screen_supported(),
+    reason="pyte is not installed",
+)
+
+
+@pytest.fixture
+async def make_terminal() -> AsyncIterator[TerminalFactory]:
+    terminals: list[Terminal] = []
+
+    async def factory(
+        *argv: str,
+        options: TerminalOptions | None = None,
+    ) -> Terminal:
+        shell = await spawn(argv)
+        terminal = Terminal(
+            shell.process,
+            shell.fd,
+            FakeWebSocket(),  # type: ignore[arg-type]
+            options or TerminalOptions(),
+        )
+        terminals.append(terminal)
+        return terminal
+
+    try:
+        yield factory
+    finally:
+        for terminal in terminals:
+            await terminal.close()
+
+
+async def test_bulk_output_is_coalesced(make_terminal):
+    size = 512 * 1024
+    script = f"head -c {size} /dev/zero | tr '\\0' x; echo END; exec cat"
+    terminal = await make_terminal("sh", "-c", script)
+    ws: FakeWebSocket = terminal.ws  # type: ignore[assignment]
+    await ws.wait_for(b"END")
+
+    assert ws.data.count(b"x") == size
+    # Raw PTY reads are at most a few KiB each
+    assert len(ws.frames) < size // 4096
+
+
+async def test_echo_is_not_delayed(make_terminal):
+    terminal = await make_terminal(
+        "cat",
+        options=TerminalOptions(coalesce_delay=10),
+    )
+    ws: FakeWebSocket = terminal.ws  # type: ignore[assignment]
+
+    await terminal.write(b"a")
+    await ws.wait_for(b"a", timeout=1)
+
+
+async def test_backpressure_is_bounded_by_bytes(make_terminal):
+    options = TerminalOptions(high_watermark=64 * 1024, low_watermark=1024)
+    terminal = await make_terminal("yes", options=options)
+    ws: FakeWebSocket = terminal.ws  # type: ignore[assignment]
+
+    gate = asyncio.Event()
+    send_bytes = ws.send_bytes
+
+    async def slow_send_bytes(data: bytes) -> None:
+        await gate.wait()
+        await send_bytes(data)
+
+    ws.send_bytes = slow_send_bytes  # type: ignore[method-assign]
+
+    await asyncio.sleep(0.5)
+    assert terminal._reader_paused
+    ceiling = options.high_watermark + options.read_size
+    assert terminal.buffered_bytes <= ceiling
+
+    gate.set()
+    async with asyncio.timeout(5):
+        while terminal._reader_paused or len(ws.data) < ceiling:
+            await asyncio.sleep(0.01)
+
+
+async def test_viewer_out_of_credit_waits_without_polling(make_terminal):
+    terminal = await make_terminal("yes")
+    ws: FakeWebSocket = terminal.ws  # type: ignore[assignment]
+    terminal.grant(ws, 32 * 1024)
+    await asyncio.sleep(0.2)
+    assert terminal._reader_paused
+
+    checks = 0
+    maybe_resume_reader = terminal._maybe_resume_reader
+
+    def counting_resume() -> bool:
+        nonlocal checks
+        checks += 1
+        return maybe_resume_reader()
+
+    terminal._maybe_resume_reader = counting_resume  # type: ignore[method-assign]
+    await asyncio.sleep(0.3)
+    assert checks == 0
+
+    sent = len(ws.data)
+    terminal.grant(ws, sent)
+    async with asyncio.timeout(5):
+        while len(ws.data) <= sent:
+            await asyncio.sleep(0.01)
+
+
+async def test_credit_bounds_unacknowledged_output(make_terminal):
+    options = TerminalOptions()
+    terminal = await make_terminal("yes", options=options)
+    ws: FakeWebSocket = terminal.ws  # type: ignore[assignment]
+    window = 32 * 1024
+    terminal.grant(ws, window)
+
+    await asyncio.sleep(0.5)
+    assert terminal._reader_paused
+    assert window <= len(ws.data) <= window + options.coalesce_bytes
+    assert terminal.buffered_bytes < options.high_watermark
+
+    sent = len(ws.data)
+    terminal.grant(ws, sent)
+    async with asyncio.timeout(5):
+        while len(ws.data) < window + sent:
+            await asyncio.sleep(0.01)
+    assert len(ws.data) <= window + sent + options.coalesce_bytes
+
+
+async def test_read_size_follows_output(make_terminal):
+    options = TerminalOptions()
+    script = "yes | head -c 1000000; echo DONE; exec cat"
+    terminal = await make_terminal("sh", "-c", script, options=options)
+    ws: FakeWebSocket = terminal.ws  # type: ignore[assignment]
+    await ws.wait_for(b"DONE")
+    assert terminal._read_size > MIN_READ_SIZE
+
+    for key in b"abcdefghijklmnopqrstuvwxyz":
+        line = bytes([key]) + b"\n"
+        await terminal.write(line)
+        await ws.wait_for(line.replace(b"\n", b"\r\n") * 2)
+    assert terminal._read_size == MIN_READ_SIZE
+
+
+async def test_large_paste_is_written_without_loss(make_terminal):
+    size = 1024 * 1024
+    script = f"stty raw -echo; echo READY; head -c {size} | wc -c; exec cat"
+    terminal = await make_terminal("sh", "-c", script)
+    ws: FakeWebSocket = terminal.ws  # type: ignore[assignment]
+    await ws.wait_for(b"READY")
+
+    await terminal.write(b"x" * size)
+    assert terminal._write_buffer
+
+    await ws.wait_for(str(size).encode())
+    assert not terminal._write_buffer
+
+
+async def test_drain_waits_for_the_pty(make_terminal):
+    options = TerminalOptions(input_buffer_bytes=64 * 1024)
+    size = 1024 * 1024
+    script = f"stty raw -echo; echo READY; head -c {size} | wc -c; exec cat"
+    terminal = await make_terminal("sh", "-c", script, options=options)
+    ws: FakeWebSocket = terminal.ws  # type: ignore[assignment]
+    await ws.wait_for(b"READY")
+
+    await terminal.write(b"x" * size)
+    assert terminal.input_backlog
+    await terminal.drain()
+    assert not terminal._write_buffer
+    await ws.wait_for(str(size).encode())
+
+
+async def test_detached_terminal_keeps_scrollback(make_terminal):
+    terminal = await make_terminal("cat")
+    ws: FakeWebSocket = terminal.ws  # type: ignore[assignment]
+    await terminal.write(b"before\n")
+    await ws.wait_for(b"before")
+
+    terminal.detach(ws)
+    await terminal.write(b"detached\n")
+    async with asyncio.timeout(5):
+        while b"detached" not in terminal.scrollback.tail():
+            await asyncio.sleep(0.01)
+    assert b"detached" not in ws.data
+
+    other = FakeWebSocket()
+    terminal.attach(other)  # type: ignore[arg-type]
+    await other.wait_for(b"detached")
+    assert other.frames[0].startswith(REPLAY_PREFIX)
+    assert b"before" in other.frames[0]
+
+
+async def test_detached_scrollback_is_spilled(make_terminal, tmp_path):
+    options = TerminalOptions(session_ttl=60, scrollback_dir=str(tmp_path))
+    terminal = await make_terminal("cat", options=options)
+    ws: FakeWebSocket = terminal.ws  # type: ignore[assignment]
+    await terminal.write(b"before\n")
+    await ws.wait_for(b"before")
+
+    terminal.detach(ws)
+    terminal.spill_scrollback()
+    assert terminal.scrollback.spilled
+    await terminal.write(b"detached\n")
+    async with asyncio.timeout(5):
+        while b"detached" not in terminal.scrollback.tail():
+            await asyncio.sleep(0.01)
+
+    other = FakeWebSocket()
+    terminal.attach(other)  # type: ignore[arg-type]
+    assert not terminal.scrollback.spilled
+    await other.wait_for(b"detached")
+    assert other.frames[0].startswith(REPLAY_PREFIX)
+    assert b"before" in other.frames[0]
+
+
+async def test_output_fans_out_to_viewers(make_terminal):
+    terminal = await make_terminal("cat")
+    viewers = [FakeWebSocket(), FakeWebSocket()]
+    for viewer in viewers:
+        terminal.add_viewer(viewer)  # type: ignore[arg-type]
+
+    await terminal.write(b"shared\n")
+    for ws in [terminal.ws, *viewers]:
+        await ws.wait_for(b"shared")  # type: ignore[union-attr]
+
+
+async def test_slow_viewer_does_not_stall_terminal(make_terminal):
+    options = TerminalOptions(
+        high_watermark=64 * 1024,
+        low_watermark=16 * 1024,
+        scrollback_bytes=16 * 1024,
+        viewer_backlog=128 * 1024,
+    )
+    script = "yes | head -c 4000000; echo END; exec cat"
+    terminal = await make_terminal("sh", "-c", script, options=options)
+    slow, fast = FakeWebSocket(), FakeWebSocket()
+
+    async def stuck(data: bytes) -> None:
+        await asyncio.Future()
+
+    slow.send_bytes = stuck  # type: ignore[method-assign]
+    terminal.add_viewer(slow)  # type: ignore[arg-type]
+    terminal.add_viewer(fast)  # type: ignore[arg-type]
+
+    await terminal.ws.wait_for(b"END")  # type: ignore[union-attr]
+    await fast.wait_for(b"END")
+    assert slow.closed
+    assert all(v.ws is not slow for v in terminal._viewers)
+
+
+async def test_viewer_resync_outlives_frame_in_flight(make_terminal):
+    terminal = await make_terminal("cat")
+    ws = FakeWebSocket()
+    sent = asyncio.Semaphore(0)
+    send_bytes = ws.send_bytes
+
+    async def gated_send_bytes(data: bytes) -> None:
+        await sent.acquire()
+        await send_bytes(data)
+
+    ws.send_bytes = gated_send_bytes  # type: ignore[method-assign]
+    terminal.add_viewer(ws)  # type: ignore[arg-type]
+    viewer = terminal._viewers[-1]
+
+    viewer.push(b"in flight")
+    await asyncio.sleep(0)
+    # Skips ahead while the first frame is still being sent
+    viewer.push(b"x" * (terminal.options.viewer_backlog + 1))
+    replay = len(terminal.replay_frame())
+    assert viewer._resyncing
+
+    sent.release()
+    await ws.wait_for(b"in flight")
+    await asyncio.sleep(0)
+    assert viewer._resyncing
+    assert viewer._pending_bytes == replay
+
+    sent.release()
+    await ws.wait_for(REPLAY_PREFIX)
+    await asyncio.sleep(0)
+    assert not viewer._resyncing
+    assert viewer._pending_bytes == 0
+
+
+@needs_screen
+async def test_going_stale_drops_frame_being_coalesced(make_terminal):
+    options = TerminalOptions(virtual_screen=True, coalesce_delay=0.5)
+    terminal = await make_terminal("cat", options=options)
+    ws: FakeWebSocket = terminal.ws  # type: ignore[assignment]
+    viewer = terminal._viewers[0]
+
+    viewer.push(b"first")
+    await ws.wait_for(b"first")
+    # Right after a flush, so this waits for more output to join it
+    viewer.push(b"A" * 8)
+    await asyncio.sleep(0.05)
+    viewer._go_stale()
+    await ws.wait_for(HIDE_CURSOR.encode())
+    await asyncio.sleep(0)
+    assert b"AAAAAAAA" not in ws.data
+    assert viewer._pending_bytes == 0
+
+
+@needs_screen
+async def test_slow_client_gets_screen_instead_of_backlog(make_terminal):
+    options = TerminalOptions(
+        high_watermark=64 * 1024,
+        low_watermark=16 * 1024,
+        virtual_screen=True,
+    )
+    size = 4000000
+    script = f"yes | head -c {size}; echo END; exec cat"
+    terminal = await make_terminal("sh", "-c", script, options=options)
+    ws: FakeWebSocket = terminal.ws  # type: ignore[assignment]
+
+    gate = asyncio.Event()
+    send_bytes = ws.send_bytes
+
+    async def slow_send_bytes(data: bytes) -> None:
+        await gate.wait()
+        await send_bytes(data)
+
+    ws.send_bytes = slow_send_bytes  # type: ignore[method-assign]
+
+    # The shell gets through all of its output while nothing is sent
+    async with asyncio.timeout(10):
+        while b"END" not in terminal.scrollback.tail():
+            await asyncio.sleep(0.01)
+    assert not terminal._reader_paused
+
+    gate.set()
+    await ws.wait_for(b"END")
+    assert HIDE_CURSOR.encode() in ws.data
+    assert len(ws.data) < size
+
+
+@needs_screen
+async def test_screen_is_parsed_off_the_loop(make_terminal):
+    options = TerminalOptions(virtual_screen=True)
+    script = "yes '\x1b[31mred\x1b[0m' | head -c 60000; echo END; exec cat"
+    terminal = await make_terminal("sh", "-c", script, options=options)
+    async with asyncio.timeout(10):
+        while b"END" not in terminal.scrollback.tail():
+            await asyncio.sleep(0.01)
+
+    ticks = 0
+
+    async def tick() -> None:
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0)
+            ticks += 1
+
+    ticker = asyncio.create_task(tick())
+    await asyncio.sleep(0)
+    ticks = 0
+    first = terminal.render_screen(None)
+    terminal.resize(rows=10, cols=40)
+    second = terminal.render_screen(None)
+    (frame, _), (resized, lines) = await asyncio.gather(first, second)
+    ticker.cancel()
+    assert ticks > 0
+    assert b"END" in frame
+    assert len(lines) == 10
+    assert b"\x1b[10;1H" in resized
+
+
+@needs_screen
+def test_virtual_screen_needs_scrollback():
+    with pytest.raises(ValueError):
+        TerminalOptions(virtual_screen=True, scrollback_bytes=0)
+
+
+@needs_screen
+async def test_hidden_client_gets_screen_updates(make_terminal):
+    options = TerminalOptions(virtual_screen=True, hidden_interval=0.1)
+    terminal = await make_terminal("cat", options=options)
+    ws: FakeWebSocket = terminal.ws  # type: ignore[assignment]
+
+    terminal.set_hidden(ws, True)
+    await terminal.write(b"hidden\n")
+    await ws.wait_for(b"hidden")
+    assert all(f.startswith(HIDE_CURSOR.encode()) for f in ws.frames)
+
+    terminal.set_hidden(ws, False)
+    await terminal.write(b"visible\n")
+    await ws.wait_for(b"visible\r\n")
+    assert not ws.frames[-1].startswith(HIDE_CURSOR.encode())
+
+
+async def test_close_escalates_signals(make_terminal):
+    options = TerminalOptions(close_timeout=0.5)
+    polite = await make_terminal("cat", options=options)
+    script = "trap '' HUP TERM; echo READY; exec sleep 60"
+    stubborn = await make_terminal("sh", "-c", script, options=options)
+    await stubborn.ws.wait_for(b"READY")  # type: ignore[union-attr]
+
+    assert await polite.close() is True
+    assert polite.process.returncode == -signal.SIGHUP
+    assert await stubborn.close() is False
+    assert stubborn.process.returncode == -signal.SIGKILL
+
+
+async def test_close_all_terminals_shares_deadline(make_terminal):
+    script = "trap '' HUP TERM; echo READY; exec sleep 60"
+    terminals = [await make_terminal("sh", "-c", script) for _ in range(8)]
+    for terminal in terminals:
+        await terminal.ws.wait_for(b"READY")  # type: ignore[union-attr]
+
+    app = web.Application()
+    app[TERMINALS_KEY] = set(terminals)
+    app[SESSIONS_KEY] = {}
+    app[TERMINAL_OPTIONS_KEY] = TerminalOptions(close_timeout=0.5)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await close_all_terminals(app)
+    assert loop.time() - started < 2
+    assert all(t.process.returncode == -signal.SIGKILL for t in terminals)
+
+
+async def test_session_reattach(pty_client_factory):
+    client = await pty_client_factory()
+    result = await client.proxy.pty.ready(cols=80, rows=24)
+    session = result["session"]
+    await client.input(b"echo MARK$((6*7))\n")
+    await client.output.wait_for(b"MARK42")
+    await client.close()
+
+    client = await pty_client_factory()
+    result = await client.proxy.pty.ready(cols=80, rows=24, session=session)
+    assert result["session"] == session
+    await client.output.wait_for(b"MARK42")
+    assert client.output.frames[0].startswith(REPLAY_PREFIX)
+
+
+async def test_terminal_opens_on_upgrade(pty_client_factory):
+    client = await pty_client_factory(cols="100", rows="30")
+    # The prompt arrives without any request
+    async with asyncio.timeout(5):
+        await client.output.received.wait()
+
+    await client.input(b"X=41; stty size\n")
+    await client.output.wait_for(b"30 100")
+    result = await client.proxy.pty.ready(cols=100, rows=30)
+    assert result["session"]
+    await client.input(b"echo MARK$((X+1))\n")
+    await client.output.wait_for(b"MARK42")
+
+
+async def test_credit_granted_before_reattach(pty_client_factory):
+    client = await pty_client_factory()
+    result = await client.proxy.pty.ready(cols=80, rows=24)
+    await client.close()
+
+    options = TerminalOptions()
+    window = 32 * 1024
+    client = await pty_client_factory()
+    await client.grant(window)
+    await client.proxy.pty.ready(cols=80, rows=24, session=result["session"])
+    await client.input(b"yes | head -c 4000000; echo END$((6*7))\n")
+    await asyncio.sleep(0.5)
+    assert b"END42" not in client.output.data
+    assert len(client.output.data) <= window + options.coalesce_bytes
+
+
+async def test_session_token_is_not_taken_from_url(pty_client_factory):
+    client = await pty_client_factory()
+    result = await client.proxy.pty.ready(cols=80, rows=24)
+    await client.close()
+
+    session = result["session"]
+    client = await pty_client_factory(cols="80", rows="24", session=session)
+    fresh = await client.proxy.pty.ready(cols=80, rows=24, session=session)
+    assert fresh["session"] != session
+
+
+async def test_invalid_size_on_upgrade(pty_client_factory):
+    with pytest.raises(aiohttp.WSServerHandshakeError):
+        await pty_client_factory(cols="wide", rows="24")
+
+
+async def test_paste_over_many_frames_arrives_in_order(pty_client_factory):
+    client = await pty_client_factory()
+    await client.proxy.pty.ready(cols=80, rows=24)
+    size = 4 * 1024 * 1024
+    data = os.urandom(size // 2).hex().encode()
+    await client.input(f"stty raw -echo; head -c {size} | md5sum\n".encode())
+    await client.paste(data)
+    await client.output.wait_for(hashlib.md5(data).hexdigest().encode(), 30)
+
+
+async def test_watch_session(pty_client_factory):
+    owner = await pty_client_factory()
+    result = await owner.proxy.pty.ready(cols=80, rows=24)
+
+    viewer = await pty_client_factory()
+    await viewer.proxy.pty.watch(session=result["view"])
+    await viewer.input(b"echo IGNORED\n")
+    await owner.input(b"echo WATCH$((6*7))\n")
+    await viewer.output.wait_for(b"WATCH42")
+    assert b"IGNORED" not in owner.output.data
+
+
+async def test_compressed_output(pty_client_factory):
+    client = await pty_client_factory(codec="deflate")
+    await client.proxy.pty.ready(cols=80, rows=24)
+    # Arrives well before the bulk output, which would otherwise join it
+    await client.input(b"echo INTERACTIVE$((6*7))\n")
+    await client.output.wait_for(b"INTERACTIVE42")
+    await client.input(b"seq 1 20000; echo DONE\n")
+    await client.output.wait_for(b"\nDONE")
+
+    assert b"19999\r\n20000" in client.output.data
+    headers = {frame[:1] for frame in client.raw.frames}
+    assert headers == {FRAME_RAW, FRAME_DEFLATE}
+    assert len(client.raw.data) < len(client.output.data) / 2
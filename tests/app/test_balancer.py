@@ -0,0 +1,58 @@
+import select
+import socket
+import time
+from contextlib import ExitStack
+
+import pytest
+
+from tty_aiohttp.app.balancer import (
+    REPORT_TIMEOUT,
+    LoadBoard,
+    listen_sockets,
+    steer,
+    steering_supported,
+)
+
+
+def test_weights():
+    board = LoadBoard(3)
+    board.report(0, sessions=5, lag=0)
+    board.report(1, sessions=2, lag=0.02)
+    board.report(2, sessions=3, lag=0)
+    assert board.weights() == pytest.approx([2.0, 1.0, 4.0])
+
+    board.retire(2)
+    assert board.weights() == pytest.approx([2.0, 1.0, 0.0])
+
+
+def test_stale_workers_are_retired():
+    board = LoadBoard(3)
+    board.retire(2)
+    later = time.monotonic() + REPORT_TIMEOUT + 1
+    assert board.retire_stale(time.monotonic()) == []
+    assert board.retire_stale(later) == [0, 1]
+    assert board.weights() == [1.0, 1.0, 1.0]
+
+    # A worker that reports again is back in the group
+    board.report(1, sessions=3, lag=0)
+    assert board.weights() == pytest.approx([0.0, 1.0, 0.0])
+
+
+@pytest.mark.skipif(not steering_supported(), reason="Linux only")
+def test_steer(localhost):
+    sockets = listen_sockets(localhost, 0, 3)
+    address = sockets[0].getsockname()
+    with ExitStack() as stack:
+        for sock in sockets:
+            stack.enter_context(sock)
+        for target in (2, 0, 1):
+            weights = [0.0] * len(sockets)
+            weights[target] = 1.0
+            steer(sockets[0], weights)
+            for _ in range(4):
+                stack.enter_context(socket.create_connection(address))
+            ready, _, _ = select.select(sockets, [], [], 1)
+            assert ready == [sockets[target]]
+            while select.select([sockets[target]], [], [], 0)[0]:
+                conn, _ = sockets[target].accept()
+                conn.close()
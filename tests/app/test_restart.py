@@ -0,0 +1,127 @@
+import asyncio
+import os
+import signal
+import sys
+import time
+from contextlib import suppress
+
+import aiohttp
+import pytest
+from aiohttp import hdrs
+from yarl import URL
+
+from tests.helpers.pty import PtyClient
+
+SESSIONS = 6
+FORKS = 2
+
+
+async def wait_ready(url: URL, timeout: float = 30) -> None:
+    async with aiohttp.ClientSession() as session:
+        async with asyncio.timeout(timeout):
+            while True:
+                with suppress(aiohttp.ClientError):
+                    async with session.get(url.with_path("/api/v1/ping")):
+                        return
+                await asyncio.sleep(0.1)
+
+
+async def stop_group(pgid: int, timeout: float = 10) -> None:
+    # Later generations are not our children, the group reaches them all
+    with suppress(ProcessLookupError):
+        os.killpg(pgid, signal.SIGTERM)
+        with suppress(TimeoutError):
+            async with asyncio.timeout(timeout):
+                while True:
+                    os.killpg(pgid, 0)
+                    await asyncio.sleep(0.1)
+        os.killpg(pgid, signal.SIGKILL)
+
+
+@pytest.fixture
+async def server(aiomisc_unused_port_factory, localhost, tmp_path):
+    url = URL.build(
+        scheme="http",
+        host=localhost,
+        port=aiomisc_unused_port_factory(),
+    )
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-m",
+        "tty_aiohttp.app",
+        f"--forks={FORKS}",
+        f"--api-address={url.host}",
+        f"--api-port={url.port}",
+        f"--session-dir={tmp_path}",
+        "--shell=/bin/sh",
+        "--session-ttl=60",
+        start_new_session=True,
+    )
+    try:
+        await wait_ready(url)
+        yield process, url
+    finally:
+        await stop_group(process.pid)
+        await process.wait()
+
+
+async def connect(url: URL) -> PtyClient:
+    client = PtyClient(
+        url.with_path("ws/").with_scheme("ws"),
+        headers={hdrs.ORIGIN: str(url)},
+    )
+    await client.connect()
+    return client
+
+
+async def test_hot_restart_keeps_sessions(server):
+    process, url = server
+    sessions = []
+    for number in range(SESSIONS):
+        client = await connect(url)
+        result = await client.proxy.pty.ready(cols=80, rows=24)
+        await client.input(f"echo BEFORE$(({number}*11))\n".encode())
+        await client.output.wait_for(f"BEFORE{number * 11}".encode())
+        await client.close()
+        sessions.append(result["session"])
+
+    started = time.monotonic()
+    process.send_signal(signal.SIGHUP)
+    async with asyncio.timeout(60):
+        await process.wait()
+    restart_time = time.monotonic() - started
+
+    survived = 0
+    for number, session in enumerate(sessions):
+        client = await connect(url)
+        try:
+            result = await client.proxy.pty.ready(
+                cols=80,
+                rows=24,
+                session=session,
+            )
+            if result["session"] != session:
+                continue
+            await client.output.wait_for(f"BEFORE{number * 11}".encode())
+            await client.input(f"echo AFTER$(({number}*11))\n".encode())
+            await client.output.wait_for(f"AFTER{number * 11}".encode())
+            survived += 1
+        finally:
+            await client.close()
+
+    sys.stderr.write(
+        f"hot restart took {restart_time:.2f}s, "
+        f"{survived}/{SESSIONS} sessions survived\n",
+    )
+    assert survived == SESSIONS
+    assert restart_time < 30
+
+    # Shells of the new generation hold none of the inherited sockets
+    client = await connect(url)
+    try:
+        await client.proxy.pty.ready(cols=80, rows=24)
+        await client.input(b"ls -l /proc/$$/fd; echo DONE$((6*7))\n")
+        await client.output.wait_for(b"DONE42")
+    finally:
+        await client.close()
+    assert b"socket:" not in client.output.data
@@ -0,0 +1,108 @@
+import asyncio
+import zlib
+from collections import defaultdict
+
+from wsrpc_aiohttp import WSRPCClient
+
+from tty_aiohttp.app.handlers.ws import CMD_CREDIT, CMD_INPUT
+from tty_aiohttp.app.handlers.ws.channels import (
+    CHANNEL,
+    CHANNEL_EVENT,
+    EVENT_CLOSED,
+)
+from tty_aiohttp.app.handlers.ws.codec import FRAME_DEFLATE, FRAME_RAW
+
+# Pastes are split and drained the way the browser does it
+INPUT_FRAME = 64 * 1024
+INPUT_WINDOW = 128 * 1024
+
+
+class FakeWebSocket:
+    def __init__(self) -> None:
+        self.frames: list[bytes] = []
+        self.received = asyncio.Event()
+        self.closed = False
+
+    async def send_bytes(self, data: bytes) -> None:
+        self.frames.append(bytes(data))
+        self.received.set()
+
+    async def close(self, **kwargs) -> bool:
+        self.closed = True
+        return True
+
+    @property
+    def data(self) -> bytes:
+        return b"".join(self.frames)
+
+    async def wait_for(self, needle: bytes, timeout: float = 5) -> None:
+        async with asyncio.timeout(timeout):
+            while needle not in self.data:
+                self.received.clear()
+                await self.received.wait()
+
+
+class PtyClient(WSRPCClient):
+    def __init__(self, *args, codec: str | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.codec = codec
+        self.output = FakeWebSocket()
+        self.raw = FakeWebSocket()
+
+    async def handle_binary(self, message):
+        await self.raw.send_bytes(message.data)
+        await self.output.send_bytes(self.decode(message.data))
+
+    def decode(self, data: bytes) -> bytes:
+        if self.codec is not None:
+            header, data = data[:1], data[1:]
+            if header == FRAME_DEFLATE:
+                data = zlib.decompress(data, -zlib.MAX_WBITS)
+            else:
+                assert header == FRAME_RAW
+        return data
+
+    async def input(self, data: bytes) -> None:
+        await self.socket.send_bytes(bytes([CMD_INPUT]) + data)
+
+    async def grant(self, size: int) -> None:
+        await self.socket.send_bytes(
+            bytes([CMD_CREDIT]) + size.to_bytes(4, "big")
+        )
+
+    async def paste(self, data: bytes, **kwargs) -> None:
+        unacknowledged = 0
+        for offset in range(0, len(data), INPUT_FRAME):
+            part = data[offset : offset + INPUT_FRAME]
+            if unacknowledged + len(part) > INPUT_WINDOW:
+                await self.proxy.pty.drain(**kwargs)
+                unacknowledged = 0
+            await self.input(part, **kwargs)
+            unacknowledged += len(part)
+
+
+class MuxClient(PtyClient):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.channels: defaultdict[int, FakeWebSocket] = defaultdict(
+            FakeWebSocket,
+        )
+        self.closed_channels: dict[int, bytes] = {}
+
+    async def handle_binary(self, message):
+        channel, event = CHANNEL_EVENT.unpack_from(message.data)
+        payload = message.data[CHANNEL_EVENT.size :]
+        if event == EVENT_CLOSED:
+            self.closed_channels[channel] = payload
+            return
+        await self.channels[channel].send_bytes(self.decode(payload))
+
+    async def send(self, cmd: int, channel: int, payload: bytes) -> None:
+        frame = bytes([cmd]) + CHANNEL.pack(channel) + payload
+        await self.socket.send_bytes(frame)
+
+    async def input(self, data: bytes, channel: int = 0) -> None:
+        await self.send(CMD_INPUT, channel, data)
+
+    async def grant(self, size: int, channel: int = 0) -> None:
+        await self.send(CMD_CREDIT, channel, size.to_bytes(4, "big"))
@@ -1,37 +1,209 @@
 import logging
 import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 from socket import socket
 from sys import argv
 
 import configargparse
 import forklib
-from aiomisc import Service, bind_socket, entrypoint
+from aiomisc import Service, entrypoint
 from aiomisc.log import basic_config
 from aiomisc.service.raven import RavenSender
 from setproctitle import setproctitle
 
 from tty_aiohttp import __version__
 from tty_aiohttp.app.arguments import parser
+from tty_aiohttp.app.balancer import (
+    LoadBoard,
+    WorkerSlot,
+    balance,
+    listen_sockets,
+    steering_supported,
+)
+from tty_aiohttp.app.handlers.ws.handoff import list_workers
+from tty_aiohttp.app.handlers.ws.pty import TerminalOptions
+from tty_aiohttp.app.handlers.ws.recorder import RecordingOptions
+from tty_aiohttp.app.health import HealthOptions
+from tty_aiohttp.app.metrics import REGISTRY
 from tty_aiohttp.app.services.rest import REST
 from tty_aiohttp.app.utils.serializers import config_serializers
 from tty_aiohttp.utils.http.filters import config_filters
 
 log = logging.getLogger(__name__)
 
+# Passed to the generation started by a hot restart
+LISTEN_FD_ENV = "TTY_AIOHTTP_LISTEN_FD"
+GENERATION_ENV = "TTY_AIOHTTP_GENERATION"
+TEMP_SESSION_DIR_ENV = "TTY_AIOHTTP_TEMP_SESSION_DIR"
+# How long the next generation may take to bring all its workers up
+RESTART_TIMEOUT = 30.0
+
+
+def _terminal_options(args: configargparse.Namespace) -> TerminalOptions:
+    return TerminalOptions(
+        high_watermark=args.terminal_high_watermark,
+        low_watermark=args.terminal_low_watermark,
+        input_buffer_bytes=args.terminal_input_buffer,
+        scrollback_bytes=args.terminal_scrollback,
+        scrollback_dir=args.scrollback_dir,
+        session_ttl=args.session_ttl,
+        close_timeout=args.terminal_close_timeout,
+        viewer_backlog=args.viewer_backlog,
+        compression_level=args.compression_level,
+        compression_min_bytes=args.compression_min_bytes,
+        virtual_screen=args.virtual_screen,
+        hidden_interval=args.hidden_screen_interval,
+    )
+
+
+class HotRestart:
+    def __init__(
+        self,
+        args: configargparse.Namespace,
+        sockets: list[socket],
+        generation: int,
+        temporary: bool,
+    ) -> None:
+        self.args = args
+        self.sockets = sockets
+        self.generation = generation
+        self.temporary = temporary
+        self.handed_over = False
+        self._lock = threading.Lock()
+
+    def install(self) -> None:
+        signal.signal(signal.SIGHUP, self._on_signal)
+
+    def _on_signal(self, *_: object) -> None:
+        if self._lock.locked():
+            return
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self) -> None:
+        with self._lock:
+            if not self._start_next():
+                return
+            self.handed_over = True
+            log.info("Next generation is up, stopping workers")
+            # The forked workers hand their terminals over while stopping
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    def _start_next(self) -> bool:
+        generation = self.generation + 1
+        env = dict(os.environ)
+        env["APP_SESSION_DIR"] = self.args.session_dir
+        fds = [sock.fileno() for sock in self.sockets]
+        env[LISTEN_FD_ENV] = ",".join(map(str, fds))
+        env[GENERATION_ENV] = str(generation)
+        if self.temporary:
+            env[TEMP_SESSION_DIR_ENV] = "1"
+        log.info("Starting generation %d", generation)
+        process = subprocess.Popen(
+            sys.orig_argv,
+            env=env,
+            pass_fds=fds,
+        )
+        deadline = time.monotonic() + RESTART_TIMEOUT
+        while time.monotonic() < deadline:
+            workers = list_workers(self.args.session_dir).values()
+            if sum(g == generation for g in workers) >= self.args.forks:
+                return True
+            if process.poll() is not None:
+                log.error("Generation %d failed to start", generation)
+                return False
+            time.sleep(0.1)
+        log.error("Generation %d did not start in time", generation)
+        process.terminate()
+        return False
+
+
+def _listen_sockets(args: configargparse.Namespace) -> list[socket]:
+    count = 1
+    if args.forks > 1 and args.balancer == "least-loaded":
+        count = args.forks if steering_supported() else 1
+    fds = os.environ.pop(LISTEN_FD_ENV, None)
+    if fds is None:
+        return listen_sockets(args.api_address, args.api_port, count)
+    # Inherited from the previous generation, which keeps accepting on them
+    # until its workers stop
+    sockets = [socket(fileno=int(fd)) for fd in fds.split(",")]
+    # pass_fds made them inheritable, shells must not hold them
+    for sock in sockets:
+        sock.set_inheritable(False)
+    for sock in sockets[count:]:
+        sock.close()
+    del sockets[count:]
+    if len(sockets) < count:
+        sockets.extend(
+            listen_sockets(
+                args.api_address,
+                sockets[0].getsockname()[1],
+                count - len(sockets),
+            ),
+        )
+    for sock in sockets:
+        sock.setblocking(False)
+    return sockets
+
+
+def _health_options(args: configargparse.Namespace) -> HealthOptions:
+    return HealthOptions(
+        max_loop_lag=args.health_max_loop_lag,
+        max_pool_backlog=args.health_max_pool_backlog,
+        max_terminals=args.health_max_terminals,
+        min_free_fds=args.health_min_free_fds,
+    )
+
+
+def _recording_options(args: configargparse.Namespace) -> RecordingOptions:
+    return RecordingOptions(
+        directory=args.recording_dir,
+        queue_bytes=args.recording_queue,
+        rotate_bytes=args.recording_rotate,
+        compression_level=args.recording_compression_level,
+    )
+
 
 def _run_worker(
     name: str,
     args: configargparse.Namespace,
-    rest_sock: socket,
+    sockets: list[socket],
+    board: LoadBoard | None,
+    generation: int,
 ) -> None:
+    # Hot restart is driven by the master only
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
     log.info("Worker with PID %s started", os.getpid())
+    worker = forklib.get_id()
+    REGISTRY.bind(worker)
+    slot = WorkerSlot(board, worker) if board is not None else None
+    if slot is not None:
+        # Only the master keeps the whole reuseport group, for the next
+        # generation. A socket held here would outlive the worker owning it
+        for index, sock in enumerate(sockets):
+            if index != worker:
+                sock.close()
     setproctitle(f"[Worker] {name}")
     services: list[Service] = [
         REST(
-            sock=rest_sock,
+            sock=sockets[worker] if slot is not None else sockets[0],
             debug=args.debug,
             env=args.sentry_env,
             shell=args.shell,
+            shell_pool_size=args.shell_pool_size,
+            shell_pool_min=args.shell_pool_min,
+            session_dir=args.session_dir,
+            generation=generation,
+            worker_slot=slot,
+            terminal_options=_terminal_options(args),
+            health_options=_health_options(args),
+            recording_options=_recording_options(args),
         ),
     ]
     if args.sentry_dsn:
@@ -57,6 +229,10 @@ def _run_worker(
 
 def main() -> None:
     args = parser.parse_args()
+    try:
+        _terminal_options(args)
+    except ValueError as e:
+        parser.error(str(e))
     import asyncio
     asyncio.set_event_loop(asyncio.new_event_loop())
     basic_config(
@@ -64,11 +240,7 @@ def main() -> None:
         log_format=args.log_format,
         buffered=False,
     )
-    sock = bind_socket(
-        address=args.api_address,
-        port=args.api_port,
-        proto_name="http",
-    )
+    sockets = _listen_sockets(args)
     if args.user is not None:
         logging.info("Changing user to %r", args.user.pw_name)
         os.setgid(args.user.pw_gid)
@@ -79,10 +251,38 @@ def main() -> None:
     config_filters()
     logging.getLogger("wsrpc_aiohttp.websocket.common").setLevel(logging.ERROR)
 
-    forklib.fork(
-        args.forks,
-        entrypoint=lambda: _run_worker(app_name, args, sock),
-    )
+    generation = int(os.environ.pop(GENERATION_ENV, "0"))
+    # A directory created by an earlier generation is owned by this one now
+    temporary = bool(os.environ.pop(TEMP_SESSION_DIR_ENV, ""))
+    if not args.session_dir:
+        args.session_dir = tempfile.mkdtemp(prefix="tty_aiohttp-")
+        temporary = True
+    if args.scrollback_dir:
+        os.makedirs(args.scrollback_dir, mode=0o700, exist_ok=True)
+
+    board = LoadBoard(args.forks) if len(sockets) > 1 else None
+    REGISTRY.allocate(args.forks)
+    restart = HotRestart(args, sockets, generation, temporary)
+    restart.install()
+    master_pid = os.getpid()
+    try:
+        forklib.fork(
+            args.forks,
+            entrypoint=lambda: _run_worker(
+                app_name,
+                args,
+                sockets,
+                board,
+                generation,
+            ),
+            thread_callback=(
+                (lambda: balance(board, sockets[0])) if board else None
+            ),
+        )
+    finally:
+        # Workers leave through here as well
+        if temporary and not restart.handed_over and os.getpid() == master_pid:
+            shutil.rmtree(args.session_dir, ignore_errors=True)
 
 
 if __name__ == "__main__":
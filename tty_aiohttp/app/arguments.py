@@ -6,7 +6,12 @@ import configargparse
 from aiomisc.log import LogFormat, LogLevel
 from yarl import URL
 
-from tty_aiohttp.utils.argparse import Environment, positive_int
+from tty_aiohttp.utils.argparse import (
+    Environment,
+    positive_float,
+    positive_int,
+    uint,
+)
 
 parser = configargparse.ArgumentParser(
     allow_abbrev=False,
@@ -55,3 +60,163 @@ group = parser.add_argument_group("API Options")
 group.add_argument("--api-address", default="127.0.0.1")
 group.add_argument("--api-port", type=positive_int, default=9090)
 group.add_argument("--shell", type=str, default="/usr/bin/zsh")
+group.add_argument(
+    "--shell-pool-size",
+    type=uint,
+    default=0,
+    help="Most pre-spawned idle shells kept per worker, 0 disables the pool",
+)
+group.add_argument(
+    "--shell-pool-min",
+    type=uint,
+    default=1,
+    help="Idle shells kept ready per worker even without recent demand",
+)
+group.add_argument(
+    "--balancer",
+    choices=("least-loaded", "shared"),
+    default="least-loaded",
+    help="Steer new connections to the worker with the fewest sessions "
+    "and least event loop lag, or let all workers accept from one socket",
+)
+
+group = parser.add_argument_group("Health check options")
+group.add_argument(
+    "--health-max-loop-lag",
+    type=positive_float,
+    default=1.0,
+    help="Report the worker unavailable when its event loop lags behind "
+    "by more seconds",
+)
+group.add_argument(
+    "--health-max-pool-backlog",
+    type=uint,
+    default=100,
+    help="Report the worker unavailable with more thread pool work queued",
+)
+group.add_argument(
+    "--health-max-terminals",
+    type=uint,
+    default=0,
+    help="Report the worker unavailable once it runs this many terminals, "
+    "0 disables the limit",
+)
+group.add_argument(
+    "--health-min-free-fds",
+    type=uint,
+    default=64,
+    help="Report the worker unavailable with fewer free file descriptors",
+)
+
+group = parser.add_argument_group("Recording options")
+group.add_argument(
+    "--recording-dir",
+    help="Record every session as gzipped asciicast files in this "
+    "directory, sessions are not recorded when unset",
+)
+group.add_argument(
+    "--recording-queue",
+    type=positive_int,
+    default=4 * 1024 * 1024,
+    help="Output bytes waiting to be written before further output is "
+    "left out of the recordings",
+)
+group.add_argument(
+    "--recording-rotate",
+    type=positive_int,
+    default=64 * 1024 * 1024,
+    help="Uncompressed size of a recording file before the next one "
+    "is started",
+)
+group.add_argument(
+    "--recording-compression-level",
+    type=int,
+    choices=range(10),
+    default=6,
+    help="gzip level of the recording files",
+)
+
+group = parser.add_argument_group("Terminal options")
+group.add_argument(
+    "--session-dir",
+    help="Directory where workers expose their sessions to each other, "
+    "a private temporary one is created when unset",
+)
+group.add_argument(
+    "--terminal-high-watermark",
+    type=positive_int,
+    default=256 * 1024,
+    help="Pause reading the PTY when this many output bytes are pending",
+)
+group.add_argument(
+    "--terminal-low-watermark",
+    type=uint,
+    default=64 * 1024,
+    help="Resume reading the PTY when pending output drops to this size",
+)
+group.add_argument(
+    "--terminal-input-buffer",
+    type=positive_int,
+    default=256 * 1024,
+    help="Input bytes held for a PTY that is not reading before further "
+    "input is dropped, the browser waits for it to drain every 128 KiB "
+    "of a paste",
+)
+group.add_argument(
+    "--terminal-scrollback",
+    type=uint,
+    default=256 * 1024,
+    help="Bytes of recent output replayed when a client reattaches",
+)
+group.add_argument(
+    "--scrollback-dir",
+    help="Keep the scrollback of detached sessions in memory mapped "
+    "files in this directory instead of memory, used with --session-ttl",
+)
+group.add_argument(
+    "--session-ttl",
+    type=uint,
+    default=0,
+    help="Seconds a disconnected session is kept for reattach, "
+    "0 closes the shell on disconnect",
+)
+group.add_argument(
+    "--terminal-close-timeout",
+    type=positive_float,
+    default=5.0,
+    help="Seconds a closing shell gets to exit while SIGHUP, SIGTERM "
+    "and SIGKILL are sent in turn",
+)
+group.add_argument(
+    "--viewer-backlog",
+    type=positive_int,
+    default=1024 * 1024,
+    help="Output bytes a read-only viewer may lag behind before it "
+    "skips ahead to the scrollback",
+)
+group.add_argument(
+    "--virtual-screen",
+    action="store_true",
+    help="Keep a server-side screen of every session and send it to "
+    "clients that fall behind or are hidden instead of the raw output, "
+    "needs the screen extra",
+)
+group.add_argument(
+    "--hidden-screen-interval",
+    type=positive_float,
+    default=1.0,
+    help="Seconds between screen updates of a hidden client",
+)
+group.add_argument(
+    "--compression-level",
+    type=int,
+    choices=range(10),
+    default=6,
+    help="zlib level for large output frames, 0 disables compression",
+)
+group.add_argument(
+    "--compression-min-bytes",
+    type=uint,
+    default=1024,
+    help="Output frames smaller than this are never compressed",
+)
@@ -0,0 +1,197 @@
+import asyncio
+import ctypes
+import mmap
+import socket
+import struct
+import sys
+import time
+from collections.abc import AsyncIterator
+from contextlib import suppress
+from dataclasses import dataclass
+from logging import getLogger
+
+from aiohttp import web
+from aiomisc import bind_socket
+
+from tty_aiohttp.app.health import HEALTH_KEY
+
+log = getLogger(__name__)
+
+# Live sessions, event loop lag and the time of the report in
+# microseconds, one slot per worker
+SLOT = struct.Struct("=QQQ")
+RETIRED = (2**63, 0, 0)
+REPORT_INTERVAL = 0.05
+# A worker that has not reported for this long is gone or stuck, so the
+# master retires its slot until it reports again
+REPORT_TIMEOUT = 1.0
+BALANCE_INTERVAL = 0.05
+# Event loop lag that weighs as much as one more session
+LAG_PER_SESSION = 0.005
+
+# Weight of the busiest live worker, in sessions
+SPARE_FLOOR = 1.0
+
+SO_ATTACH_REUSEPORT_CBPF = getattr(socket, "SO_ATTACH_REUSEPORT_CBPF", 51)
+SKF_AD_RANDOM = -0x1000 + 56
+SOCK_FILTER = struct.Struct("=HBBI")
+BPF_LD_W_ABS = 0x20
+BPF_JGE_K = 0x35
+BPF_RET_K = 0x06
+
+
+class SockFprog(ctypes.Structure):
+    _fields_ = [("len", ctypes.c_ushort), ("filter", ctypes.c_void_p)]
+
+
+@dataclass(frozen=True)
+class WorkerLoad:
+    sessions: int
+    lag: float
+    reported: float
+
+    @property
+    def retired(self) -> bool:
+        return self.sessions >= RETIRED[0]
+
+    @property
+    def score(self) -> float:
+        return self.sessions + self.lag / LAG_PER_SESSION
+
+
+class LoadBoard:
+    def __init__(self, workers: int) -> None:
+        self.workers = workers
+        # Anonymous shared mapping, the forked workers write to the same pages
+        self._map = mmap.mmap(-1, SLOT.size * workers)
+        # Workers that never come up are retired like the ones that die
+        for worker in range(workers):
+            self.report(worker, sessions=0, lag=0)
+
+    def report(self, worker: int, sessions: int, lag: float) -> None:
+        # CLOCK_MONOTONIC is the same clock in every process
+        SLOT.pack_into(
+            self._map,
+            SLOT.size * worker,
+            sessions,
+            round(lag * 1e6),
+            round(time.monotonic() * 1e6),
+        )
+
+    def retire(self, worker: int) -> None:
+        SLOT.pack_into(self._map, SLOT.size * worker, *RETIRED)
+
+    def retire_stale(self, now: float) -> list[int]:
+        stale = [
+            worker
+            for worker, load in enumerate(self.read())
+            if not load.retired and now - load.reported > REPORT_TIMEOUT
+        ]
+        for worker in stale:
+            self.retire(worker)
+        return stale
+
+    def read(self) -> list[WorkerLoad]:
+        return [
+            WorkerLoad(sessions, lag / 1e6, reported / 1e6)
+            for sessions, lag, reported in SLOT.iter_unpack(self._map)
+        ]
+
+    def weights(self) -> list[float]:
+        # Spare capacity relative to the busiest worker, so new connections
+        # mostly land on the least loaded ones until the workers even out
+        loads = self.read()
+        live = [load.score for load in loads if not load.retired]
+        if not live:
+            return [1.0] * len(loads)
+        busiest = max(live)
+        return [
+            0.0 if load.retired else busiest - load.score + SPARE_FLOOR
+            for load in loads
+        ]
+
+
+@dataclass(frozen=True)
+class WorkerSlot:
+    board: LoadBoard
+    index: int
+
+
+WORKER_SLOT_KEY: web.AppKey[WorkerSlot | None] = web.AppKey("worker_slot")
+
+
+def steering_supported() -> bool:
+    return sys.platform == "linux"
+
+
+def listen_sockets(address: str, port: int, count: int) -> list[socket.socket]:
+    sockets = [bind_socket(address=address, port=port, proto_name="http")]
+    port = sockets[0].getsockname()[1]
+    sockets.extend(
+        bind_socket(address=address, port=port, proto_name="http")
+        for _ in range(count - 1)
+    )
+    # The reuseport group is ordered by listen(), so socket N is index N
+    for sock in sockets:
+        sock.listen(socket.SOMAXCONN)
+    return sockets
+
+
+def steer(sock: socket.socket, weights: list[float]) -> None:
+    # Picks a socket of the reuseport group at random, proportionally to
+    # the weights: A = random u32, then a threshold check per socket
+    total = sum(weights)
+    program = [(BPF_LD_W_ABS, 0, 0, SKF_AD_RANDOM & 0xFFFFFFFF)]
+    threshold = 0.0
+    for index, weight in enumerate(weights[:-1]):
+        threshold += weight
+        limit = min(int(threshold / total * 2**32), 2**32 - 1)
+        program.append((BPF_JGE_K, 1, 0, limit))
+        program.append((BPF_RET_K, 0, 0, index))
+    program.append((BPF_RET_K, 0, 0, len(weights) - 1))
+    buffer = ctypes.create_string_buffer(
+        b"".join(SOCK_FILTER.pack(*insn) for insn in program),
+    )
+    fprog = SockFprog(len(program), ctypes.addressof(buffer))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, bytes(fprog))
+
+
+def balance(board: LoadBoard, sock: socket.socket) -> None:
+    current: list[float] = []
+    while True:
+        time.sleep(BALANCE_INTERVAL)
+        # A crashed worker never retires its slot itself, and nobody
+        # accepts what the kernel queues on its socket
+        for worker in board.retire_stale(time.monotonic()):
+            log.warning("Worker %d stopped reporting, retiring it", worker)
+        weights = board.weights()
+        # Attached every time, another generation may share the group
+        try:
+            steer(sock, weights)
+        except OSError:
+            log.warning("Connection steering failed, kernel hashing is used")
+            return
+        if weights != current:
+            log.debug("Worker weights: %r", weights)
+            current = weights
+
+
+async def _report_load(app: web.Application, slot: WorkerSlot) -> None:
+    health = app[HEALTH_KEY]
+    while True:
+        await asyncio.sleep(REPORT_INTERVAL)
+        sample = health.sample
+        slot.board.report(slot.index, sample.terminals, sample.loop_lag)
+
+
+async def load_reporter(app: web.Application) -> AsyncIterator[None]:
+    slot = app[WORKER_SLOT_KEY]
+    if slot is None:
+        yield
+        return
+    task = asyncio.create_task(_report_load(app, slot))
+    yield
+    task.cancel()
+    with suppress(asyncio.CancelledError):
+        await task
+    slot.board.retire(slot.index)
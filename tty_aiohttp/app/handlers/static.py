@@ -2,12 +2,19 @@ import hashlib
 import logging
 import mimetypes
 import os
+import time
 from functools import lru_cache
 from pathlib import Path
 
 from aiohttp import hdrs, web
 from aiomisc import threaded
 
+from tty_aiohttp.app.metrics import (
+    STATIC_NOT_MODIFIED,
+    STATIC_REQUESTS,
+    STATIC_SECONDS,
+)
+
 log = logging.getLogger(__name__)
 
 
@@ -44,6 +51,14 @@ class StaticResource(web.StaticResource):
         return os.stat(fname)
 
     async def _handle(self, request: web.Request) -> web.StreamResponse:
+        STATIC_REQUESTS.inc()
+        started = time.perf_counter()
+        try:
+            return await self._respond(request)
+        finally:
+            STATIC_SECONDS.observe(time.perf_counter() - started)
+
+    async def _respond(self, request: web.Request) -> web.StreamResponse:
         directory = Path(self._directory)
         filename = request.match_info["filename"]
         file_path = (directory / filename).resolve()
@@ -82,6 +97,7 @@ class StaticResource(web.StaticResource):
         etag = f'W/"{etag}"'
 
         if request.headers.get(hdrs.IF_NONE_MATCH, "") == etag:
+            STATIC_NOT_MODIFIED.inc()
             raise web.HTTPNotModified
 
         response = web.FileResponse(file_path)
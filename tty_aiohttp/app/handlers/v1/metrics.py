@@ -0,0 +1,14 @@
+from aiohttp import hdrs, web
+
+from tty_aiohttp.app.handlers import BaseHandler
+from tty_aiohttp.app.metrics import REGISTRY
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsHandler(BaseHandler):
+    async def get(self) -> web.Response:
+        return web.Response(
+            text=REGISTRY.render(),
+            headers={hdrs.CONTENT_TYPE: CONTENT_TYPE},
+        )
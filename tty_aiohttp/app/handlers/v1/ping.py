@@ -2,11 +2,12 @@ import json
 import logging
 from http import HTTPStatus
 
-from aiohttp import web, web_exceptions
+from aiohttp import web
 from aiomisc import timeout
 
 from tty_aiohttp import __version__
 from tty_aiohttp.app.handlers import BaseHandler
+from tty_aiohttp.app.health import HEALTH_KEY
 
 X_VERSION = "X-VERSION"
 
@@ -17,14 +18,25 @@ log = logging.getLogger(__name__)
 class PingHandler(BaseHandler):
     @timeout(5)
     async def get(self) -> web.Response:
-        status = True
+        # Sampled in the background, a probe only reads the last values
+        health = self.request.app[HEALTH_KEY]
+        sample = health.sample
+        failed = sample.failures(health.options)
 
         status_code = HTTPStatus.OK
-        if not status:
-            raise web_exceptions.HTTPInternalServerError
+        if failed:
+            status_code = HTTPStatus.SERVICE_UNAVAILABLE
 
         return web.json_response(
-            data={"status": status},
+            data={
+                "status": not failed,
+                "failed": failed,
+                "loop_lag": sample.loop_lag,
+                "pool_backlog": sample.pool_backlog,
+                "terminals": sample.terminals,
+                "open_fds": sample.open_fds,
+                "fd_limit": sample.fd_limit,
+            },
             status=status_code,
             headers={X_VERSION: __version__},
             dumps=json.dumps,
@@ -1,17 +1,78 @@
 import logging
+from collections.abc import Mapping
 
-from aiohttp import WSMessage
+from aiohttp import WSMessage, WSMsgType, web
 from wsrpc_aiohttp import WebSocketAsync
 
+from tty_aiohttp.app.handlers.ws.channels import CHANNEL
 from tty_aiohttp.app.handlers.ws.pty import PtyHandler
 
 log = logging.getLogger(__name__)
 
 CMD_INPUT = 0x00
 CMD_RESIZE = 0x01
+# Output bytes the client accepts on top of what it granted before
+CMD_CREDIT = 0x02
+
+
+def initial_size(query: Mapping[str, str]) -> tuple[int, int] | None:
+    if "cols" not in query and "rows" not in query:
+        return None
+    try:
+        cols, rows = int(query["cols"]), int(query["rows"])
+    except (KeyError, ValueError):
+        raise web.HTTPBadRequest(text="Invalid terminal size") from None
+    if not (0 < cols <= 0xFFFF and 0 < rows <= 0xFFFF):
+        raise web.HTTPBadRequest(text="Invalid terminal size")
+    return cols, rows
 
 
 class PtyWebSocket(WebSocketAsync):
+    async def _on_message(self, msg: WSMessage) -> None:
+        if msg.type != WSMsgType.BINARY:
+            await super()._on_message(msg)
+            return
+        # Handled in order and before the next frame is read, so input
+        # reaches the PTY ahead of a drain() call sent after it. Nothing
+        # here waits for a PTY, that would hold up every channel
+        try:
+            await self.handle_binary(msg)
+        except Exception:
+            log.exception("Error handling binary frame")
+
+    async def authorize(self) -> bool:
+        # A size in the upgrade request opens the terminal without waiting
+        # for ready(), the shell starts while the handshake is in flight.
+        # Session tokens only come with ready(), URLs end up in logs
+        size = initial_size(self.request.query)
+        # Registered up front, so credit granted ahead of ready() has a
+        # channel to wait on
+        route = PtyHandler(self)
+        self._handlers["pty"] = route
+        if size is None:
+            return True
+        route.prespawn()
+        try:
+            # Upgraded here so the terminal is attached right after, later
+            # prepare() calls return the same writer
+            await self.socket.prepare(self.request)
+        except Exception:
+            await route._onclose()
+            raise
+        self._create_task(self._open(route, *size))
+        return True
+
+    async def _open(
+        self,
+        route: PtyHandler,
+        cols: int,
+        rows: int,
+    ) -> None:
+        try:
+            await route.open(cols, rows)
+        except Exception:
+            log.exception("Failed to open the terminal on upgrade")
+
     async def handle_binary(self, message: WSMessage) -> None:
         route = self._handlers.get("pty")
         if not isinstance(route, PtyHandler):
@@ -24,13 +85,35 @@ class PtyWebSocket(WebSocketAsync):
 
         cmd = data[0]
         payload = data[1:]
+        channel = 0
+        if route.multiplexed:
+            if len(payload) < CHANNEL.size:
+                return
+            (channel,) = CHANNEL.unpack_from(payload)
+            payload = payload[CHANNEL.size :]
+            # Channels are opened with ready() or watch() first
+            if not route.is_open(channel):
+                return
+        await self.handle_command(route, cmd, channel, payload)
+
+    async def handle_command(
+        self,
+        route: PtyHandler,
+        cmd: int,
+        channel: int,
+        payload: bytes,
+    ) -> None:
+        if cmd == CMD_CREDIT:
+            if len(payload) == 4:
+                route.grant(int.from_bytes(payload, "big"), channel)
+            return
+        if route.read_only(channel):
+            return
 
         if cmd == CMD_INPUT:
-            terminal = await route.terminal
-            await terminal.write(payload)
+            await route.input(payload, channel)
         elif cmd == CMD_RESIZE:
             if len(payload) == 4:
                 rows = int.from_bytes(payload[0:2], "big")
                 cols = int.from_bytes(payload[2:4], "big")
-                terminal = await route.terminal
-                terminal.resize(rows=rows, cols=cols)
+                route.resize(rows, cols, channel)
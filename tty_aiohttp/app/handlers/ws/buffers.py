@@ -0,0 +1,90 @@
+import os
+
+# Reads of every terminal of a worker are carved out of shared arenas, so
+# reading allocates nothing and the chunk reaches the viewers as a view
+ARENA_SIZE = 256 * 1024
+# Free arenas kept for reuse, further ones are left to the allocator
+MAX_FREE_ARENAS = 8
+# Reads smaller than this are copied out. A keystroke echo held by a slow
+# viewer would otherwise keep a whole arena alive
+COPY_BELOW = 4 * 1024
+
+
+def _exported(arena: bytearray) -> bool:
+    # A bytearray refuses to resize while any view of it is alive
+    try:
+        del arena[-1:]
+    except BufferError:
+        return True
+    arena.append(0)
+    return False
+
+
+class ReadBuffers:
+    __slots__ = (
+        "_arena",
+        "_free",
+        "_offset",
+        "_retired",
+        "_view",
+        "arena_size",
+        "arenas_allocated",
+        "copy_below",
+        "max_free",
+    )
+
+    def __init__(
+        self,
+        arena_size: int = ARENA_SIZE,
+        max_free: int = MAX_FREE_ARENAS,
+        copy_below: int = COPY_BELOW,
+    ) -> None:
+        self.arena_size = arena_size
+        self.max_free = max_free
+        self.copy_below = copy_below
+        self.arenas_allocated = 0
+        self._arena = bytearray()
+        self._view = memoryview(self._arena)
+        self._offset = 0
+        self._free: list[bytearray] = []
+        # Filled arenas whose chunks may still be queued somewhere
+        self._retired: list[bytearray] = []
+
+    def read(self, fd: int, size: int) -> bytes | memoryview:
+        if len(self._view) - self._offset < size:
+            self._next_arena(size)
+        start = self._offset
+        count = os.readv(fd, [self._view[start : start + size]])
+        if count < self.copy_below:
+            # The space is read into again right away
+            return self._view[start : start + count].tobytes()
+        self._offset += count
+        return self._view[start : start + count]
+
+    def _next_arena(self, size: int) -> None:
+        if self._arena:
+            self._view.release()
+            self._retired.append(self._arena)
+        self._reclaim()
+        if size <= self.arena_size and self._free:
+            self._arena = self._free.pop()
+        else:
+            self._arena = bytearray(max(size, self.arena_size))
+            self.arenas_allocated += 1
+        self._view = memoryview(self._arena)
+        self._offset = 0
+
+    def _reclaim(self) -> None:
+        retired = []
+        for arena in self._retired:
+            if _exported(arena):
+                retired.append(arena)
+            elif (
+                len(arena) == self.arena_size
+                and len(self._free) < self.max_free
+            ):
+                self._free.append(arena)
+        self._retired = retired
+
+
+read_buffers = ReadBuffers()
@@ -0,0 +1,47 @@
+import struct
+import typing as t
+from contextlib import suppress
+
+from aiohttp import web
+
+# A multiplexed connection carries many terminals. Its output frames
+# start with the channel and an event, input frames have the channel
+# right after the command byte.
+CHANNEL = struct.Struct(">H")
+CHANNEL_EVENT = struct.Struct(">HB")
+MAX_CHANNEL = 0xFFFF
+
+# Whatever a connection of a single terminal would send follows
+EVENT_OUTPUT = 0x00
+# The server closed the channel, the reason follows
+EVENT_CLOSED = 0x01
+
+
+class ChannelSocket:
+    __slots__ = ("_header", "_on_close", "_ws", "channel", "closed")
+
+    def __init__(
+        self,
+        ws: web.WebSocketResponse,
+        channel: int,
+        on_close: t.Callable[[], t.Awaitable[None]],
+    ) -> None:
+        self._ws = ws
+        self._on_close = on_close
+        self._header = CHANNEL_EVENT.pack(channel, EVENT_OUTPUT)
+        self.channel = channel
+        self.closed = False
+
+    async def send_bytes(self, data: bytes | memoryview) -> None:
+        await self._ws.send_bytes(self._header + data)
+
+    async def close(self, *, code: int = 1000, message: bytes = b"") -> bool:
+        if self.closed:
+            return False
+        self.closed = True
+        with suppress(ConnectionError):
+            await self._ws.send_bytes(
+                CHANNEL_EVENT.pack(self.channel, EVENT_CLOSED) + message,
+            )
+        await self._on_close()
+        return True
@@ -0,0 +1,106 @@
+import logging
+import time
+import zlib
+from dataclasses import dataclass
+
+from aiohttp import web
+
+from tty_aiohttp.app.metrics import COMPRESS_BYTES, COMPRESS_SECONDS
+
+log = logging.getLogger(__name__)
+
+# Output frame headers used once a client negotiated a codec
+FRAME_RAW = b"\x00"
+FRAME_DEFLATE = b"\x01"
+
+CODEC_DEFLATE = "deflate"
+
+# Frames up to this size are compressed with the fastest level only
+LARGE_FRAME = 16 * 1024
+# Compressed output above this share of the input is not worth sending
+INCOMPRESSIBLE_RATIO = 0.9
+# Frames sent raw after an incompressible one before trying again
+BACKOFF_FRAMES = 16
+
+
+@dataclass
+class CompressionStats:
+    frames_raw: int = 0
+    frames_compressed: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    cpu_ns: int = 0
+
+    @property
+    def ratio(self) -> float:
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+    @property
+    def ns_per_byte(self) -> float:
+        return self.cpu_ns / self.bytes_in if self.bytes_in else 0.0
+
+
+compression_stats = CompressionStats()
+
+
+class DeflateEncoder:
+    __slots__ = ("_backoff", "level", "min_bytes", "stats")
+
+    def __init__(
+        self,
+        min_bytes: int,
+        level: int,
+        stats: CompressionStats = compression_stats,
+    ) -> None:
+        self.min_bytes = min_bytes
+        self.level = level
+        self.stats = stats
+        self._backoff = 0
+
+    def encode(self, frame: bytes | memoryview) -> bytes:
+        size = len(frame)
+        if not self.level or size < self.min_bytes or self._backoff:
+            self._backoff = max(self._backoff - 1, 0)
+            self.stats.frames_raw += 1
+            return FRAME_RAW + frame
+
+        level = min(self.level, 1) if size < LARGE_FRAME else self.level
+        started = time.thread_time_ns()
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        payload = compressor.compress(frame) + compressor.flush()
+
+        elapsed = time.thread_time_ns() - started
+        self.stats.cpu_ns += elapsed
+        self.stats.bytes_in += size
+        self.stats.bytes_out += len(payload)
+        COMPRESS_SECONDS.inc(elapsed / 1e9)
+        COMPRESS_BYTES.inc(size)
+
+        if len(payload) > size * INCOMPRESSIBLE_RATIO:
+            self._backoff = BACKOFF_FRAMES
+            self.stats.frames_raw += 1
+            return FRAME_RAW + frame
+
+        self.stats.frames_compressed += 1
+        return FRAME_DEFLATE + payload
+
+
+def create_encoder(
+    codec: str | None,
+    min_bytes: int,
+    level: int,
+) -> DeflateEncoder | None:
+    if codec == CODEC_DEFLATE:
+        return DeflateEncoder(min_bytes, level)
+    return None
+
+
+async def log_compression_stats(app: web.Application) -> None:
+    stats = compression_stats
+    log.info(
+        "Compressed %d of %d frames, ratio %.2f, %.1f ns CPU per byte",
+        stats.frames_compressed,
+        stats.frames_compressed + stats.frames_raw,
+        stats.ratio,
+        stats.ns_per_byte,
+    )
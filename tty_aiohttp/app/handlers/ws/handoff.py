@@ -0,0 +1,445 @@
+import asyncio
+import json
+import os
+import secrets
+import socket
+import struct
+import typing as t
+from collections.abc import AsyncIterator, Callable
+from contextlib import suppress
+from dataclasses import dataclass
+from logging import getLogger
+
+log = getLogger(__name__)
+
+# Upper bound of a single request to a peer worker
+HANDOFF_TIMEOUT = 5.0
+# Largest message accepted from a peer
+MAX_MESSAGE = 16 * 1024 * 1024
+LENGTH = struct.Struct("!I")
+ACK = b"\x01"
+SOCKET_SUFFIX = ".sock"
+
+OP_ADOPT = "adopt"
+OP_TAKE = "take"
+OP_WATCH = "watch"
+NOT_FOUND = json.dumps({"error": "not found"}).encode()
+
+
+@dataclass
+class SessionState:
+    token: str
+    view_token: str
+    pid: int
+    fd: int
+    scrollback: bytes = b""
+    pending_input: bytes = b""
+
+
+class SessionOwner(t.Protocol):
+    def export_session(self, token: str) -> SessionState | None: ...
+
+    async def finish_export(self, token: str, moved: bool) -> None: ...
+
+    async def adopt_session(self, state: SessionState) -> None: ...
+
+    def watch_session(
+        self,
+        token: str,
+        codec: str | None,
+        peer: "PeerSocket",
+    ) -> Callable[[], None] | None: ...
+
+
+async def _wait_io(
+    sock: socket.socket,
+    call: Callable[[], t.Any],
+    writable: bool = False,
+) -> t.Any:
+    loop = asyncio.get_running_loop()
+    add, remove = (
+        (loop.add_writer, loop.remove_writer)
+        if writable
+        else (loop.add_reader, loop.remove_reader)
+    )
+    while True:
+        try:
+            return call()
+        except BlockingIOError:
+            pass
+        ready: asyncio.Future[None] = loop.create_future()
+
+        def wake() -> None:
+            if not ready.done():
+                ready.set_result(None)
+
+        add(sock.fileno(), wake)
+        try:
+            await ready
+        finally:
+            remove(sock.fileno())
+
+
+async def send_message(
+    sock: socket.socket,
+    payload: bytes | memoryview,
+    fds: t.Sequence[int] = (),
+) -> None:
+    data = LENGTH.pack(len(payload)) + payload
+    if fds:
+        sent = await _wait_io(
+            sock,
+            lambda: socket.send_fds(sock, [data], fds),
+            writable=True,
+        )
+        data = data[sent:]
+    if data:
+        await asyncio.get_running_loop().sock_sendall(sock, data)
+
+
+async def _recv_exactly(sock: socket.socket, size: int, data: bytes) -> bytes:
+    loop = asyncio.get_running_loop()
+    chunks = [data]
+    received = len(data)
+    while received < size:
+        chunk = await loop.sock_recv(sock, min(size - received, 256 * 1024))
+        if not chunk:
+            raise ConnectionResetError("Peer closed the connection")
+        chunks.append(chunk)
+        received += len(chunk)
+    return b"".join(chunks)
+
+
+async def recv_message(
+    sock: socket.socket,
+    max_fds: int = 0,
+) -> tuple[bytes, list[int]]:
+    fds: list[int] = []
+    if max_fds:
+        # Close-on-exec, a PTY master must not reach the shells this
+        # worker starts later. Set again, not every kernel honours the
+        # flag
+        data, fds, _, _ = await _wait_io(
+            sock,
+            lambda: socket.recv_fds(
+                sock,
+                LENGTH.size,
+                max_fds,
+                socket.MSG_CMSG_CLOEXEC,
+            ),
+        )
+        for fd in fds:
+            os.set_inheritable(fd, False)
+    else:
+        data = b""
+    try:
+        header = await _recv_exactly(sock, LENGTH.size, data)
+        (size,) = LENGTH.unpack(header[: LENGTH.size])
+        if size > MAX_MESSAGE:
+            raise ValueError(f"Message of {size} bytes is too large")
+        payload = await _recv_exactly(sock, size, header[LENGTH.size :])
+    except BaseException:
+        for fd in fds:
+            os.close(fd)
+        raise
+    return payload, fds
+
+
+async def send_state(sock: socket.socket, state: SessionState) -> None:
+    header = {
+        "token": state.token,
+        "view_token": state.view_token,
+        "pid": state.pid,
+    }
+    await send_message(sock, json.dumps(header).encode(), fds=[state.fd])
+    await send_message(sock, state.scrollback)
+    await send_message(sock, state.pending_input)
+
+
+async def recv_state(sock: socket.socket) -> SessionState | None:
+    payload, fds = await recv_message(sock, max_fds=1)
+    header = json.loads(payload)
+    if "error" in header or len(fds) != 1:
+        for fd in fds:
+            os.close(fd)
+        return None
+    try:
+        scrollback, _ = await recv_message(sock)
+        pending_input, _ = await recv_message(sock)
+    except BaseException:
+        os.close(fds[0])
+        raise
+    return SessionState(
+        token=header["token"],
+        view_token=header["view_token"],
+        pid=header["pid"],
+        fd=fds[0],
+        scrollback=scrollback,
+        pending_input=pending_input,
+    )
+
+
+def list_workers(path: str) -> dict[str, int]:
+    try:
+        names = os.listdir(path)
+    except FileNotFoundError:
+        return {}
+    workers = {}
+    for name in sorted(names):
+        if not name.endswith(SOCKET_SUFFIX):
+            continue
+        generation, _, _ = name.partition("-")
+        with suppress(ValueError):
+            workers[os.path.join(path, name)] = int(generation.lstrip("g"))
+    return workers
+
+
+class PeerSocket:
+    __slots__ = ("_lock", "_sock", "closed")
+
+    def __init__(self, sock: socket.socket) -> None:
+        self._sock = sock
+        self._lock = asyncio.Lock()
+        self.closed = False
+
+    async def send_bytes(self, data: bytes | memoryview) -> None:
+        async with self._lock:
+            await send_message(self._sock, data)
+
+    async def close(self, *, code: int = 1000, message: bytes = b"") -> bool:
+        if self.closed:
+            return False
+        self.closed = True
+        with suppress(OSError):
+            self._sock.shutdown(socket.SHUT_RDWR)
+        return True
+
+
+class RemoteView:
+    __slots__ = ("_sock",)
+
+    def __init__(self, sock: socket.socket) -> None:
+        self._sock = sock
+
+    async def frames(self) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                try:
+                    frame, _ = await recv_message(self._sock)
+                except ConnectionError:
+                    return
+                yield frame
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._sock.close()
+
+
+class SessionDirectory:
+    def __init__(self, path: str, generation: int = 0) -> None:
+        self.path = path
+        self.generation = generation
+        name = f"g{generation}-{os.getpid()}-{secrets.token_hex(4)}"
+        self.address = os.path.join(path, name + SOCKET_SUFFIX)
+        self._sock: socket.socket | None = None
+        self._owner: SessionOwner | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._handlers: set[asyncio.Task[None]] = set()
+
+    def peers(self) -> list[str]:
+        return [a for a in list_workers(self.path) if a != self.address]
+
+    def successors(self) -> list[str]:
+        return [
+            address
+            for address, generation in list_workers(self.path).items()
+            if generation > self.generation
+        ]
+
+    def start(self, owner: SessionOwner) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.address)
+        sock.listen(socket.SOMAXCONN)
+        sock.setblocking(False)
+        self._sock = sock
+        self._owner = owner
+        self._task = asyncio.create_task(self._serve(sock))
+
+    async def close(self) -> None:
+        tasks = list(self._handlers)
+        if self._task is not None:
+            tasks.append(self._task)
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            with suppress(FileNotFoundError):
+                os.unlink(self.address)
+
+    async def _serve(self, sock: socket.socket) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            conn, _ = await loop.sock_accept(sock)
+            conn.setblocking(False)
+            task = asyncio.create_task(self._handle(conn))
+            self._handlers.add(task)
+            task.add_done_callback(self._handlers.discard)
+
+    async def _handle(self, conn: socket.socket) -> None:
+        try:
+            async with asyncio.timeout(HANDOFF_TIMEOUT):
+                payload, _ = await recv_message(conn)
+            request = json.loads(payload)
+            if request.get("op") == OP_TAKE:
+                await self._export(conn, request["token"])
+            elif request.get("op") == OP_ADOPT:
+                await self._adopt(conn)
+            elif request.get("op") == OP_WATCH:
+                await self._watch(conn, request["token"], request.get("codec"))
+        except asyncio.CancelledError:
+            raise
+        except (ConnectionError, TimeoutError):
+            log.debug("Peer worker went away", exc_info=True)
+        except Exception:
+            log.exception("Error serving peer worker")
+        finally:
+            conn.close()
+
+    async def _export(self, conn: socket.socket, token: str) -> None:
+        assert self._owner is not None
+        state = self._owner.export_session(token)
+        if state is None:
+            await send_message(conn, NOT_FOUND)
+            return
+        moved = False
+        try:
+            async with asyncio.timeout(HANDOFF_TIMEOUT):
+                await send_state(conn, state)
+                ack = await asyncio.get_running_loop().sock_recv(conn, 1)
+                moved = ack == ACK
+        finally:
+            await self._owner.finish_export(token, moved)
+        log.info("Session handed off to a peer worker: %s", moved)
+
+    async def _adopt(self, conn: socket.socket) -> None:
+        assert self._owner is not None
+        async with asyncio.timeout(HANDOFF_TIMEOUT):
+            state = await recv_state(conn)
+        if state is None:
+            return
+        try:
+            await self._owner.adopt_session(state)
+        except BaseException:
+            os.close(state.fd)
+            raise
+        await asyncio.get_running_loop().sock_sendall(conn, ACK)
+
+    async def _watch(
+        self,
+        conn: socket.socket,
+        token: str,
+        codec: str | None,
+    ) -> None:
+        assert self._owner is not None
+        peer = PeerSocket(conn)
+        # The header goes out before the viewer task runs for the first time
+        detach = self._owner.watch_session(token, codec, peer)
+        if detach is None:
+            await send_message(conn, NOT_FOUND)
+            return
+        try:
+            await peer.send_bytes(b"{}")
+            # Peers never send anything else, so this waits for them to leave
+            await asyncio.get_running_loop().sock_recv(conn, 1)
+        finally:
+            detach()
+
+    async def _request(
+        self,
+        address: str,
+        request: dict[str, t.Any],
+    ) -> socket.socket | None:
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, address)
+            await send_message(sock, json.dumps(request).encode())
+        except (ConnectionRefusedError, FileNotFoundError):
+            sock.close()
+            # Nobody listens there any more, the worker has exited
+            with suppress(FileNotFoundError):
+                os.unlink(address)
+            return None
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    async def take(self, token: str) -> SessionState | None:
+        for address in self.peers():
+            try:
+                async with asyncio.timeout(HANDOFF_TIMEOUT):
+                    state = await self._take_from(address, token)
+            except (ConnectionError, TimeoutError, ValueError):
+                log.warning("Failed to take session from %s", address)
+                continue
+            if state is not None:
+                return state
+        return None
+
+    async def _take_from(
+        self,
+        address: str,
+        token: str,
+    ) -> SessionState | None:
+        sock = await self._request(address, {"op": OP_TAKE, "token": token})
+        if sock is None:
+            return None
+        with sock:
+            state = await recv_state(sock)
+            if state is None:
+                return None
+            try:
+                await asyncio.get_running_loop().sock_sendall(sock, ACK)
+            except BaseException:
+                os.close(state.fd)
+                raise
+        return state
+
+    async def push(self, state: SessionState, address: str) -> bool:
+        async with asyncio.timeout(HANDOFF_TIMEOUT):
+            sock = await self._request(address, {"op": OP_ADOPT})
+            if sock is None:
+                return False
+            with sock:
+                await send_state(sock, state)
+                ack = await asyncio.get_running_loop().sock_recv(sock, 1)
+        return ack == ACK
+
+    async def watch(self, token: str, codec: str | None) -> RemoteView | None:
+        request = {"op": OP_WATCH, "token": token, "codec": codec}
+        for address in self.peers():
+            try:
+                async with asyncio.timeout(HANDOFF_TIMEOUT):
+                    sock = await self._request(address, request)
+                    if sock is None:
+                        continue
+                    try:
+                        payload, _ = await recv_message(sock)
+                    except BaseException:
+                        sock.close()
+                        raise
+            except (ConnectionError, TimeoutError, ValueError):
+                log.warning("Failed to watch session on %s", address)
+                continue
+            if "error" in json.loads(payload):
+                sock.close()
+                continue
+            return RemoteView(sock)
+        return None
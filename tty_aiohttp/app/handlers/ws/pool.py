@@ -0,0 +1,113 @@
+import asyncio
+from collections import deque
+from contextlib import suppress
+from dataclasses import dataclass
+from logging import getLogger
+
+from tty_aiohttp.app.handlers.ws.spawn import (
+    PtyProcess,
+    shell_environ,
+    spawn_shell,
+)
+from tty_aiohttp.app.metrics import POOL_HITS, POOL_MISSES
+
+log = getLogger(__name__)
+
+# Shells taken within this many seconds size the idle pool
+DEMAND_WINDOW = 10.0
+# How often one idle shell above demand is retired
+TRIM_INTERVAL = 5.0
+
+
+@dataclass
+class PoolStats:
+    hits: int = 0
+    misses: int = 0
+    spawned: int = 0
+    discarded: int = 0
+
+
+class ShellPool:
+    def __init__(self, shell: str, max_idle: int, min_idle: int = 0) -> None:
+        self.shell = shell
+        self.max_idle = max_idle
+        self.min_idle = min(min_idle, max_idle)
+        self.stats = PoolStats()
+        self._env = shell_environ()
+        self._idle: deque[PtyProcess] = deque()
+        self._taken: deque[float] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+
+    def __len__(self) -> int:
+        return len(self._idle)
+
+    @property
+    def target(self) -> int:
+        return max(self.min_idle, min(self.max_idle, len(self._taken)))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def acquire(self) -> PtyProcess | None:
+        self._taken.append(asyncio.get_running_loop().time())
+        self._wakeup.set()
+        while self._idle:
+            shell = self._idle.popleft()
+            if shell.alive:
+                self.stats.hits += 1
+                POOL_HITS.inc()
+                return shell
+            self._discard(shell)
+        self.stats.misses += 1
+        POOL_MISSES.inc()
+        return None
+
+    def _discard(self, shell: PtyProcess) -> None:
+        self.stats.discarded += 1
+        shell.kill()
+
+    def _expire(self) -> None:
+        deadline = asyncio.get_running_loop().time() - DEMAND_WINDOW
+        while self._taken and self._taken[0] < deadline:
+            self._taken.popleft()
+        for shell in [s for s in self._idle if not s.alive]:
+            self._idle.remove(shell)
+            self._discard(shell)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            self._expire()
+            if len(self._idle) > self.target:
+                self._discard(self._idle.popleft())
+            while len(self._idle) < self.target:
+                try:
+                    shell = await spawn_shell(self.shell, self._env)
+                except Exception:
+                    log.exception("Failed to pre-spawn shell %r", self.shell)
+                    break
+                self.stats.spawned += 1
+                self._idle.append(shell)
+            with suppress(TimeoutError):
+                async with asyncio.timeout(TRIM_INTERVAL):
+                    await self._wakeup.wait()
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        processes = [shell.process for shell in self._idle]
+        while self._idle:
+            self._discard(self._idle.popleft())
+        with suppress(TimeoutError):
+            async with asyncio.timeout(5):
+                await asyncio.gather(*(p.wait() for p in processes))
+        log.info(
+            "Shell pool served %d hits, %d misses",
+            self.stats.hits,
+            self.stats.misses,
+        )
@@ -1,70 +1,308 @@
 import asyncio
 import fcntl
 import os
-import pty
+import secrets
+import signal
 import struct
 import termios
+import time
 import typing as t
-from asyncio.subprocess import Process
+from collections import deque
+from contextlib import suppress
 from dataclasses import dataclass, field
 from logging import getLogger
 
 from aiohttp import web
 from aiomisc.thread_pool import threaded
-from wsrpc_aiohttp import Route, WSRPCBase, decorators
+from wsrpc_aiohttp import Route, decorators
+
+from tty_aiohttp.app.handlers.ws.buffers import read_buffers
+from tty_aiohttp.app.handlers.ws.channels import MAX_CHANNEL, ChannelSocket
+from tty_aiohttp.app.handlers.ws.codec import DeflateEncoder, create_encoder
+from tty_aiohttp.app.handlers.ws.handoff import (
+    PeerSocket,
+    RemoteView,
+    SessionDirectory,
+    SessionState,
+)
+from tty_aiohttp.app.handlers.ws.pool import ShellPool
+from tty_aiohttp.app.handlers.ws.recorder import Recorder, Recording
+from tty_aiohttp.app.handlers.ws.screen import VirtualScreen, screen_supported
+from tty_aiohttp.app.handlers.ws.scrollback import RingBuffer
+from tty_aiohttp.app.handlers.ws.spawn import (
+    PtyProcess,
+    ShellProcess,
+    spawn_shell,
+)
+from tty_aiohttp.app.metrics import (
+    CREDIT_STALLS,
+    FRAME_BYTES_SENT,
+    FRAME_SEND_SECONDS,
+    FRAMES_SENT,
+    INPUT_DROPPED_BYTES,
+    PTY_READ_BYTES,
+    PTY_READS,
+    PTY_WRITTEN_BYTES,
+    READER_PAUSES,
+    READER_RESUMES,
+    SCREEN_UPDATES,
+    SESSIONS_OPENED,
+    SESSIONS_REATTACHED,
+    VIEWER_SKIPS,
+)
 
 log = getLogger(__name__)
 
 SHELL_KEY: web.AppKey[str] = web.AppKey("shell")
 TERMINALS_KEY: web.AppKey[set["Terminal"]] = web.AppKey("terminals")
+TERMINAL_OPTIONS_KEY: web.AppKey["TerminalOptions"] = web.AppKey(
+    "terminal_options",
+)
+SESSIONS_KEY: web.AppKey[dict[str, "Terminal"]] = web.AppKey("sessions")
+SHELL_POOL_KEY: web.AppKey[ShellPool | None] = web.AppKey("shell_pool")
+SESSION_DIRECTORY_KEY: web.AppKey[SessionDirectory | None] = web.AppKey(
+    "session_directory",
+)
+RECORDER_KEY: web.AppKey[Recorder | None] = web.AppKey("recorder")
+
+# How often a paused reader rechecks a draining socket transport
+FLOW_POLL_INTERVAL = 0.01
+# Upper bound of how often detached sessions are checked for expiry
+REAP_INTERVAL = 5.0
+# Full terminal reset sent ahead of the replayed scrollback
+REPLAY_PREFIX = b"\x1bc"
+# Signals sent to a closing shell and the share of the close timeout
+# elapsed before the next one follows
+ESCALATION = (
+    (signal.SIGHUP, 0.5),
+    (signal.SIGTERM, 0.8),
+    (signal.SIGKILL, 1.0),
+)
+# Least time given to a killed process to be reaped past the deadline
+KILL_GRACE = 0.1
+# Reads ask for a few times the recent average read, at least this much
+# and at most read_size, so interactive sessions take little of the read
+# arenas while bulk output is read in large chunks
+MIN_READ_SIZE = 1024
+READ_HEADROOM = 4
+READ_SMOOTHING = 0.25
+# Terminals a single multiplexed connection may have open at once
+MAX_CHANNELS = 64
+
+
+@dataclass(frozen=True)
+class TerminalOptions:
+    # Upper bound of a single coalesced output frame
+    coalesce_bytes: int = 64 * 1024
+    # How long bulk output waits for more data before the frame is flushed
+    coalesce_delay: float = 0.005
+    # Smaller chunks are candidates for immediate (interactive) delivery
+    interactive_bytes: int = 256
+    # Output that follows an input this soon is treated as an echo
+    echo_window: float = 0.05
+    # PTY reads stop when pending output (queued, in flight and buffered
+    # by the socket transport) reaches high_watermark and resume once it
+    # drops to low_watermark
+    high_watermark: int = 256 * 1024
+    low_watermark: int = 64 * 1024
+    read_size: int = 20 * 1024
+    # Input the PTY has not taken yet, beyond this further input frames
+    # are dropped, pastes wait for drain() instead of filling it up
+    input_buffer_bytes: int = 256 * 1024
+    # Recent output kept for replay when a client reattaches
+    scrollback_bytes: int = 256 * 1024
+    # The scrollback of a detached session moves to a file mapping here
+    # until someone attaches, so idle sessions take no memory for it
+    scrollback_dir: str | None = None
+    # How long a detached session survives, zero closes it on disconnect
+    session_ttl: float = 0
+    # Output a read-only viewer may lag behind before it skips ahead
+    viewer_backlog: int = 1024 * 1024
+    # Frames of negotiated codecs smaller than this are sent uncompressed
+    compression_min_bytes: int = 1024
+    # zlib level for large frames, zero disables compression
+    compression_level: int = 6
+    # Time a closing shell gets to exit across SIGHUP, SIGTERM and SIGKILL
+    close_timeout: float = 5.0
+    # Clients that fall behind, or are hidden, get the screen state of a
+    # server-side emulator instead of the raw output and the PTY is never
+    # paused for them
+    virtual_screen: bool = False
+    # Output replayed into the emulator before an update at most, beyond
+    # that the screen starts over from this much of the scrollback
+    screen_catchup: int = 64 * 1024
+    # How often a hidden client gets a screen update
+    hidden_interval: float = 1.0
+
+    def __post_init__(self) -> None:
+        if not 0 <= self.low_watermark < self.high_watermark:
+            raise ValueError(
+                "low_watermark must be less than high_watermark",
+            )
+        # A healthy viewer lags by about one coalesced frame, a resyncing
+        # one additionally holds the scrollback replay
+        if self.viewer_backlog <= self.scrollback_bytes + self.coalesce_bytes:
+            raise ValueError(
+                "viewer_backlog must exceed scrollback_bytes + coalesce_bytes",
+            )
+        if self.virtual_screen and not screen_supported():
+            raise ValueError(
+                "virtual_screen needs pyte, install tty_aiohttp[screen]",
+            )
+        # Screen updates are rendered from the scrollback
+        if self.virtual_screen and not self.scrollback_bytes:
+            raise ValueError("virtual_screen needs scrollback_bytes")
 
 
-@dataclass
-class PTYConfig:
-    master_fd: int
-    slave_fd: int
-    shell: str
+class ViewerSocket(t.Protocol):
+    async def send_bytes(self, data: bytes | memoryview) -> None: ...
 
-    @classmethod
-    @threaded
-    def open_pty(cls, shell: str) -> "PTYConfig":
-        master_fd, slave_fd = pty.openpty()
-        return cls(master_fd, slave_fd, shell)
+    async def close(self, *, code: int = ..., message: bytes = ...) -> bool: ...
 
 
 @dataclass(eq=False)
-class Terminal:
-    process: Process
-    fd: int
-    ws: web.WebSocketResponse
+class Viewer:
+    terminal: "Terminal"
+    ws: ViewerSocket
+    read_only: bool = False
+    encoder: DeflateEncoder | None = None
 
-    _read_queue: asyncio.Queue[bytes] = field(
-        init=False,
-        default_factory=lambda: asyncio.Queue(maxsize=128),
-    )
-    _reader_paused: bool = field(init=False, default=False)
-    _write_queue: asyncio.Queue[bytes] = field(
+    hidden: bool = field(init=False, default=False)
+
+    # None asks the sender for a screen update
+    _queue: asyncio.Queue[bytes | memoryview | None] = field(
         init=False,
         default_factory=asyncio.Queue,
     )
-    _read_task: asyncio.Task[None] = field(init=False)
-    _write_task: asyncio.Task[None] = field(init=False)
-    _monitor_task: asyncio.Task[None] = field(init=False)
-    _closed: bool = field(init=False, default=False)
+    _pending_bytes: int = field(init=False, default=0)
+    # Bumped whenever the queue is dropped, a frame taken before that is
+    # not accounted against what was queued after
+    _generation: int = field(init=False, default=0)
+    _resyncing: bool = field(init=False, default=False)
+    # Raw output is dropped while the client gets screen updates instead
+    _stale: bool = field(init=False, default=False)
+    _screen_queued: bool = field(init=False, default=False)
+    # Screen lines of the last update, until raw output follows it
+    _screen_lines: list[str] | None = field(init=False, default=None)
+    _last_screen: float = field(init=False, default=float("-inf"))
+    _shown: asyncio.Event = field(init=False, default_factory=asyncio.Event)
+    _last_flush: float = field(init=False, default=float("-inf"))
+    # Output the client still accepts, None until it grants any. Frames
+    # are held back while it is used up and may overdraw it by one frame.
+    _credit: int | None = field(init=False, default=None)
+    _credited: asyncio.Event = field(init=False, default_factory=asyncio.Event)
+    _task: asyncio.Task[None] = field(init=False)
+    _close_task: asyncio.Task[bool] | None = field(init=False, default=None)
 
     def __post_init__(self) -> None:
-        self._write_task = asyncio.create_task(self._write())
-        self._read_task = asyncio.create_task(self._read())
-        self._monitor_task = asyncio.create_task(self._monitor())
-        asyncio.get_running_loop().add_reader(self.fd, self._on_read)
+        self._task = asyncio.create_task(self._send())
+
+    @property
+    def options(self) -> TerminalOptions:
+        return self.terminal.options
+
+    @property
+    def buffered_bytes(self) -> int:
+        return self._pending_bytes + self._transport_buffer_size()
+
+    def _transport_buffer_size(self) -> int:
+        # aiohttp does not expose the transport of a prepared response
+        writer = getattr(self.ws, "_writer", None)
+        transport = getattr(writer, "transport", None)
+        if transport is None or transport.is_closing():
+            return 0
+        return transport.get_write_buffer_size()
+
+    @property
+    def out_of_credit(self) -> bool:
+        return self._credit is not None and self._credit <= 0
+
+    def grant(self, size: int) -> None:
+        self._credit = (self._credit or 0) + size
+        if self._credit > 0:
+            self._credited.set()
+
+    async def _wait_for_credit(self) -> None:
+        if not self.out_of_credit:
+            return
+        CREDIT_STALLS.inc()
+        while self.out_of_credit:
+            self._credited.clear()
+            await self._credited.wait()
+
+    @property
+    def _backlog(self) -> int:
+        if self.read_only:
+            return self.options.viewer_backlog
+        return self.options.high_watermark
 
-    async def _read(self) -> None:
+    def push(self, data: bytes | memoryview) -> None:
+        if self._stale:
+            self._queue_screen()
+            return
+        self._queue.put_nowait(data)
+        self._pending_bytes += len(data)
+        if self.terminal.screen is not None:
+            if self.buffered_bytes > self._backlog:
+                log.debug("Viewer is too slow, sending the screen instead")
+                self._go_stale()
+        elif self.read_only and self._pending_bytes > self._backlog:
+            self._skip_ahead()
+
+    def set_hidden(self, hidden: bool) -> None:
+        self.hidden = hidden
+        if not hidden:
+            self._shown.set()
+            self._queue_screen()
+            return
+        self._shown.clear()
+        if not self._stale:
+            self._go_stale()
+
+    def _go_stale(self) -> None:
+        self._drain()
+        self._stale = True
+        self._screen_lines = None
+        self._queue_screen()
+
+    def _queue_screen(self) -> None:
+        if self._screen_queued:
+            return
+        self._screen_queued = True
+        self._queue.put_nowait(None)
+
+    def _skip_ahead(self) -> None:
+        # A slow viewer must never hold the PTY back. The first overflow
+        # swaps its backlog for the scrollback, the second one drops it.
+        VIEWER_SKIPS.inc()
+        if self._resyncing:
+            log.info("Dropping viewer that can not keep up")
+            self.terminal.remove_viewer(self.ws)
+            self._close_task = asyncio.create_task(
+                self.ws.close(message=b"Viewer too slow"),
+            )
+            return
+        log.debug("Viewer is too slow, skipping ahead")
+        self._drain()
+        self._resyncing = True
+        self.push(self.terminal.replay_frame())
+
+    def _drain(self) -> None:
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._pending_bytes = 0
+        self._generation += 1
+
+    async def _send(self) -> None:
         try:
             while True:
-                chunk = await self._read_queue.get()
-                await self.ws.send_bytes(chunk)
-                if self._reader_paused and not self._read_queue.full():
-                    self._resume_reader()
+                chunk = await self._queue.get()
+                generation = self._generation
+                await self._wait_for_credit()
+                if chunk is None:
+                    await self._send_screen()
+                elif generation == self._generation:
+                    await self._send_chunk(chunk)
         except asyncio.CancelledError:
             return
         except ConnectionError:
@@ -72,52 +310,446 @@ class Terminal:
         except Exception:
             log.exception("Error in terminal read task")
 
+    async def _send_chunk(self, chunk: bytes | memoryview) -> None:
+        frame, generation = await self._coalesce(chunk, self._is_bulk(chunk))
+        if generation != self._generation:
+            return
+        await self.send(frame)
+        # Unless the backlog was dropped while this was sent, the replay
+        # that replaced it is still queued
+        if generation == self._generation:
+            self._pending_bytes -= len(frame)
+            self._resyncing = False
+        self._last_flush = asyncio.get_running_loop().time()
+        if self.read_only:
+            return
+        # Nothing else wakes a paused reader up while the transport is
+        # still draining, so wait for it here. A client out of credit may
+        # take its time, grant() wakes this up
+        while not self.terminal._maybe_resume_reader() and self._queue.empty():
+            if self.out_of_credit:
+                self._credited.clear()
+                await self._credited.wait()
+            else:
+                await asyncio.sleep(FLOW_POLL_INTERVAL)
+
+    async def _send_screen(self) -> None:
+        loop = asyncio.get_running_loop()
+        # Rendered as late as possible, once the socket has drained
+        while self._transport_buffer_size() > self.options.low_watermark:
+            await asyncio.sleep(FLOW_POLL_INTERVAL)
+        delay = self._last_screen + self.options.hidden_interval - loop.time()
+        if self.hidden and delay > 0:
+            with suppress(TimeoutError):
+                async with asyncio.timeout(delay):
+                    await self._shown.wait()
+        self._screen_queued = False
+        update = self.terminal.render_screen(self._screen_lines)
+        resizes = self.terminal._screen_resizes
+        # Raw output goes on from this state unless the client is hidden
+        self._stale = self.hidden
+        frame, lines = await update
+        if self.hidden and resizes == self.terminal._screen_resizes:
+            self._screen_lines = lines
+        else:
+            self._screen_lines = None
+        self._last_screen = loop.time()
+        SCREEN_UPDATES.inc()
+        await self.send(frame)
+
+    async def send(self, data: bytes | memoryview) -> None:
+        if self._credit is not None:
+            self._credit -= len(data)
+        if self.encoder is not None:
+            data = self.encoder.encode(data)
+        started = time.perf_counter()
+        await self.ws.send_bytes(data)
+        FRAME_SEND_SECONDS.observe(time.perf_counter() - started)
+        FRAMES_SENT.inc()
+        FRAME_BYTES_SENT.inc(len(data))
+
+    def _is_bulk(self, chunk: bytes | memoryview) -> bool:
+        # Echoes and small chunks after a quiet period are flushed as is,
+        # everything else waits a little for more output to join the frame
+        now = asyncio.get_running_loop().time()
+        if now - self.terminal._last_input < self.options.echo_window:
+            return False
+        if len(chunk) >= self.options.interactive_bytes:
+            return True
+        return now - self._last_flush < self.options.coalesce_delay
+
+    async def _coalesce(
+        self,
+        chunk: bytes | memoryview,
+        bulk: bool,
+    ) -> tuple[bytes | memoryview, int]:
+        # Returns the generation of the backlog the frame was taken from
+        queue = self._queue
+        if not bulk and queue.empty():
+            return chunk, self._generation
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.options.coalesce_delay
+        chunks = [chunk]
+        size = len(chunk)
+        generation = self._generation
+        while size < self.options.coalesce_bytes:
+            if not queue.empty():
+                next_chunk = queue.get_nowait()
+            elif bulk and loop.time() < deadline:
+                try:
+                    async with asyncio.timeout_at(deadline):
+                        next_chunk = await queue.get()
+                except TimeoutError:
+                    break
+            else:
+                break
+            if next_chunk is None:
+                # The backlog was dropped for a screen update, which
+                # has to follow whatever was taken already
+                queue.put_nowait(None)
+                break
+            if generation != self._generation:
+                # Whatever was taken before belongs to a dropped backlog
+                generation = self._generation
+                chunks, size = [], 0
+            chunks.append(next_chunk)
+            size += len(next_chunk)
+        return b"".join(chunks), generation
+
+    def close(self) -> asyncio.Task[None]:
+        self._task.cancel()
+        self._drain()
+        return self._task
+
+
+@dataclass(eq=False)
+class Terminal:
+    process: ShellProcess
+    fd: int
+    ws: ViewerSocket | None
+    options: TerminalOptions = field(default_factory=TerminalOptions)
+    token: str = field(default_factory=lambda: secrets.token_urlsafe(32))
+    view_token: str = field(default_factory=lambda: secrets.token_urlsafe(32))
+    recording: Recording | None = None
+    detached_at: float | None = field(init=False, default=None)
+    scrollback: RingBuffer = field(init=False)
+    screen: VirtualScreen | None = field(init=False, default=None)
+
+    _primary: Viewer | None = field(init=False, default=None)
+    # Replaced rather than mutated, so _on_read may iterate it safely
+    _viewers: tuple[Viewer, ...] = field(init=False, default=())
+    _replay: bytes | None = field(init=False, default=None)
+    _reader_paused: bool = field(init=False, default=False)
+    _write_buffer: bytearray = field(init=False, default_factory=bytearray)
+    _input_drained: asyncio.Event = field(
+        init=False,
+        default_factory=asyncio.Event,
+    )
+    _writer_registered: bool = field(init=False, default=False)
+    _monitor_task: asyncio.Task[None] = field(init=False)
+    _closed: bool = field(init=False, default=False)
+    _suspended: bool = field(init=False, default=False)
+    _last_input: float = field(init=False, default=float("-inf"))
+    _read_size: int = field(init=False, default=MIN_READ_SIZE)
+    _read_average: float = field(init=False, default=0.0)
+    # Output up to this offset of the scrollback is in the screen
+    _screen_fed: int = field(init=False, default=0)
+    _screen_size: tuple[int, int] | None = field(init=False, default=None)
+    # Lines rendered before a resize are no use to diff against
+    _screen_resizes: int = field(init=False, default=0)
+    _screen_update: asyncio.Future[tuple[bytes, list[str]]] | None = field(
+        init=False,
+        default=None,
+    )
+
+    def __post_init__(self) -> None:
+        os.set_blocking(self.fd, False)
+        self.scrollback = RingBuffer(self.options.scrollback_bytes)
+        if self.options.virtual_screen:
+            self.screen = VirtualScreen()
+        if self.ws is not None:
+            self._primary = self._add_viewer(self.ws)
+        self._monitor_task = asyncio.create_task(self._monitor())
+        asyncio.get_running_loop().add_reader(self.fd, self._on_read)
+
+    def render_screen(
+        self,
+        previous: list[str] | None,
+    ) -> asyncio.Future[tuple[bytes, list[str]]]:
+        # The emulator is only fed when an update is due, so output no
+        # client is waiting for costs nothing to parse. Output up to now
+        # is taken right away, parsing follows in a thread, one update of
+        # a screen after another
+        assert self.screen is not None
+        written = self.scrollback.written
+        missed, self._screen_fed = written - self._screen_fed, written
+        limit = min(self.options.screen_catchup, len(self.scrollback))
+        reset = missed > limit
+        size, self._screen_size = self._screen_size, None
+        if size is not None:
+            self._screen_resizes += 1
+            for viewer in self._viewers:
+                viewer._screen_lines = None
+        if reset:
+            missed = limit
+        if reset or size is not None:
+            previous = None
+        update = asyncio.ensure_future(
+            self._update_screen(
+                self._screen_update,
+                self.scrollback.last(missed),
+                previous,
+                reset,
+                size,
+            ),
+        )
+        self._screen_update = update
+        # A cancelled viewer does not stop the updates queued after it
+        return asyncio.shield(update)
+
+    async def _update_screen(
+        self,
+        after: asyncio.Future[tuple[bytes, list[str]]] | None,
+        data: bytes,
+        previous: list[str] | None,
+        reset: bool,
+        size: tuple[int, int] | None,
+    ) -> tuple[bytes, list[str]]:
+        if after is not None:
+            await asyncio.wait([after])
+        return await threaded(self._feed_screen)(data, previous, reset, size)
+
+    def _feed_screen(
+        self,
+        data: bytes,
+        previous: list[str] | None,
+        reset: bool,
+        size: tuple[int, int] | None,
+    ) -> tuple[bytes, list[str]]:
+        assert self.screen is not None
+        if size is not None:
+            self.screen.resize(*size)
+        if reset:
+            self.screen.reset()
+        self.screen.feed(data)
+        return self.screen.render(previous)
+
+    def set_hidden(self, ws: ViewerSocket, hidden: bool) -> None:
+        if self.screen is None:
+            return
+        for viewer in self._viewers:
+            if viewer.ws is ws:
+                viewer.set_hidden(hidden)
+
+    def grant(self, ws: ViewerSocket, size: int) -> None:
+        for viewer in self._viewers:
+            if viewer.ws is ws:
+                viewer.grant(size)
+        self._maybe_resume_reader()
+
+    def replay_frame(self) -> bytes:
+        if self._replay is None:
+            self._replay = self.scrollback.tail(REPLAY_PREFIX)
+        return self._replay
+
+    def _add_viewer(
+        self,
+        ws: ViewerSocket,
+        read_only: bool = False,
+        encoder: DeflateEncoder | None = None,
+    ) -> Viewer:
+        viewer = Viewer(self, ws, read_only=read_only, encoder=encoder)
+        self._viewers += (viewer,)
+        return viewer
+
+    def add_viewer(
+        self,
+        ws: ViewerSocket,
+        encoder: DeflateEncoder | None = None,
+    ) -> None:
+        viewer = self._add_viewer(ws, read_only=True, encoder=encoder)
+        if self.scrollback:
+            viewer.push(self.replay_frame())
+
+    def remove_viewer(self, ws: ViewerSocket) -> None:
+        for viewer in self._viewers:
+            if viewer.ws is ws and viewer.read_only:
+                break
+        else:
+            return
+        self._viewers = tuple(v for v in self._viewers if v is not viewer)
+        viewer.close()
+
+    def attach(
+        self,
+        ws: ViewerSocket,
+        encoder: DeflateEncoder | None = None,
+    ) -> None:
+        self.detach()
+        self.ws = ws
+        self.detached_at = None
+        self._primary = self._add_viewer(ws, encoder=encoder)
+        if self.scrollback:
+            self._primary.push(self.replay_frame())
+        self.scrollback.restore()
+
+    def detach(self, ws: ViewerSocket | None = None) -> None:
+        primary = self._primary
+        if primary is None or (ws is not None and ws is not primary.ws):
+            return
+        self.ws = self._primary = None
+        self.detached_at = asyncio.get_running_loop().time()
+        self._viewers = tuple(v for v in self._viewers if v is not primary)
+        # Everything queued is in the scrollback already
+        primary.close()
+        self._resume_reader()
+
+    def spill_scrollback(self) -> None:
+        directory = self.options.scrollback_dir
+        if directory is None or not self.options.session_ttl:
+            return
+        self._replay = None
+        try:
+            self.scrollback.spill(directory)
+        except OSError:
+            log.warning(
+                "Failed to move scrollback to %s",
+                directory,
+                exc_info=True,
+            )
+
     async def write(self, chunk: bytes) -> None:
-        await self._write_queue.put(chunk)
+        self._last_input = asyncio.get_running_loop().time()
+        if self._closed:
+            return
+        if self._write_buffer or self._suspended:
+            self._write_buffer += chunk
+        else:
+            try:
+                written = os.write(self.fd, chunk)
+            except BlockingIOError:
+                written = 0
+            except OSError:
+                log.debug("PTY write failed", exc_info=True)
+                return
+            PTY_WRITTEN_BYTES.inc(written)
+            if written < len(chunk):
+                self._write_buffer += memoryview(chunk)[written:]
+                self._start_writer()
+
+    @property
+    def input_backlog(self) -> bool:
+        if self._closed:
+            return False
+        return len(self._write_buffer) > self.options.input_buffer_bytes
 
-    async def _write(self) -> None:
+    async def drain(self) -> None:
+        # Returns once the PTY took all input written so far
+        while self._write_buffer and not self._closed:
+            self._input_drained.clear()
+            await self._input_drained.wait()
+
+    def _on_write(self) -> None:
         try:
-            while True:
-                chunk = await self._write_queue.get()
-                await self._do_write(chunk)
-        except asyncio.CancelledError:
+            written = os.write(self.fd, self._write_buffer)
+        except BlockingIOError:
             return
-        except ConnectionError:
-            log.debug("Connection lost in terminal write task")
-        except Exception:
-            log.exception("Error in terminal write task")
+        except OSError:
+            log.debug("PTY write failed", exc_info=True)
+            self._write_buffer.clear()
+            written = 0
+        PTY_WRITTEN_BYTES.inc(written)
+        del self._write_buffer[:written]
+        if not self._write_buffer:
+            self._input_drained.set()
+            self._stop_writer()
+
+    def _start_writer(self) -> None:
+        if self._writer_registered:
+            return
+        self._writer_registered = True
+        asyncio.get_running_loop().add_writer(self.fd, self._on_write)
 
-    @threaded
-    def _do_write(self, chunk: bytes) -> None:
-        os.write(self.fd, chunk)
+    def _stop_writer(self) -> None:
+        if not self._writer_registered:
+            return
+        self._writer_registered = False
+        try:
+            asyncio.get_running_loop().remove_writer(self.fd)
+        except (ValueError, OSError):
+            pass
 
     def _on_read(self) -> None:
+        size = self._read_size
         try:
-            data = os.read(self.fd, 1024 * 20)
-            if not data:
-                return
-            try:
-                self._read_queue.put_nowait(data)
-            except asyncio.QueueFull:
-                self._pause_reader()
-                return
+            data = read_buffers.read(self.fd, size)
         except OSError:
             return
+        if not data:
+            return
+        self._read_average += (len(data) - self._read_average) * READ_SMOOTHING
+        # A full read means more output is waiting than was asked for
+        if len(data) == size:
+            size *= READ_HEADROOM
+        else:
+            size = int(self._read_average * READ_HEADROOM)
+        self._read_size = min(max(size, MIN_READ_SIZE), self.options.read_size)
+        PTY_READS.inc()
+        PTY_READ_BYTES.inc(len(data))
+        self.scrollback.append(data)
+        self._replay = None
+        if self.recording is not None:
+            self.recording.output(data)
+        # Every viewer queues the very same chunk, bulk output as a view
+        # of the read arena
+        for viewer in self._viewers:
+            viewer.push(data)
+        if self.screen is not None:
+            return
+        if (
+            self.buffered_bytes >= self.options.high_watermark
+            or self.out_of_credit
+        ):
+            self._pause_reader()
+
+    @property
+    def buffered_bytes(self) -> int:
+        # Only the primary viewer holds the PTY back, the rest skip ahead
+        if self._primary is None:
+            return 0
+        return self._primary.buffered_bytes
+
+    @property
+    def out_of_credit(self) -> bool:
+        return self._primary is not None and self._primary.out_of_credit
 
     def _pause_reader(self) -> None:
         if self._reader_paused:
             return
         self._reader_paused = True
+        READER_PAUSES.inc()
         try:
             asyncio.get_running_loop().remove_reader(self.fd)
         except (ValueError, OSError):
             pass
-        log.debug("PTY reader paused (queue full)")
+        log.debug("PTY reader paused (%d bytes buffered)", self.buffered_bytes)
+
+    def _maybe_resume_reader(self) -> bool:
+        if not self._reader_paused:
+            return True
+        if self.buffered_bytes > self.options.low_watermark:
+            return False
+        if self.out_of_credit:
+            return False
+        self._resume_reader()
+        return not self._reader_paused
 
     def _resume_reader(self) -> None:
-        if not self._reader_paused or self._closed:
+        if not self._reader_paused or self._closed or self._suspended:
             return
         self._reader_paused = False
+        READER_RESUMES.inc()
         try:
             asyncio.get_running_loop().add_reader(
                 self.fd, self._on_read,
@@ -126,23 +758,54 @@ class Terminal:
             pass
         log.debug("PTY reader resumed")
 
+    def suspend(self) -> None:
+        # Output stays in the kernel buffer and input in _write_buffer,
+        # so a new owner of the PTY picks both up unchanged
+        self._suspended = True
+        self._pause_reader()
+        self._stop_writer()
+
+    def unsuspend(self) -> None:
+        self._suspended = False
+        self._resume_reader()
+        if self._write_buffer:
+            self._start_writer()
+
+    async def release(self, message: bytes) -> None:
+        # Gives the PTY up without touching the process, which now
+        # belongs to whoever received a copy of the descriptor
+        self._monitor_task.cancel()
+        viewers = self._viewers
+        self.ws = self._primary = None
+        self._cleanup_io()
+        for viewer in viewers:
+            with suppress(ConnectionError):
+                await viewer.ws.close(message=message)
+
     def resize(self, rows: int, cols: int) -> None:
         winsize = struct.pack("HHHH", rows, cols, 0, 0)
         fcntl.ioctl(self.fd, termios.TIOCSWINSZ, winsize)
+        if self.recording is not None:
+            self.recording.resize(rows, cols)
+        if self.screen is not None:
+            # Applied by the next update, one may be parsing in a thread
+            self._screen_size = (rows, cols)
 
     async def _monitor(self) -> None:
         return_code = await self.process.wait()
         log.info("Process finished with return code %s", return_code)
+        viewers = self._viewers
         self._cleanup_io()
         message = (
             f"\r\n\x1b[31mProcess closed with code {return_code}\x1b[0m\r\n"
-        )
-        try:
-            await self.ws.send_bytes(message.encode())
-        except (ConnectionError, asyncio.CancelledError):
-            log.debug(
-                "Could not send close notification, connection lost",
-            )
+        ).encode()
+        for viewer in viewers:
+            try:
+                await viewer.send(message)
+            except (ConnectionError, asyncio.CancelledError):
+                log.debug(
+                    "Could not send close notification, connection lost",
+                )
 
     def _cleanup_io(self) -> None:
         if self._closed:
@@ -152,96 +815,445 @@ class Terminal:
             asyncio.get_running_loop().remove_reader(self.fd)
         except (ValueError, OSError):
             pass
-        self._read_task.cancel()
-        self._write_task.cancel()
+        self._stop_writer()
+        self._write_buffer.clear()
+        self._input_drained.set()
+        self.scrollback.restore()
+        if self.recording is not None:
+            self.recording.close()
+        for viewer in self._viewers:
+            viewer.close()
         try:
             os.close(self.fd)
         except OSError:
             pass
 
-    async def close(self) -> None:
+    async def close(self, deadline: float | None = None) -> bool:
+        loop = asyncio.get_running_loop()
+        if deadline is None:
+            deadline = loop.time() + self.options.close_timeout
+        groups = {self.process.pid}
+        with suppress(OSError):
+            groups.add(os.tcgetpgrp(self.fd))
+
         self._monitor_task.cancel()
         self._cleanup_io()
-        for task in (
-            self._read_task, self._write_task, self._monitor_task,
-        ):
+        tasks = [viewer._task for viewer in self._viewers]
+        tasks.append(self._monitor_task)
+        for task in tasks:
             try:
                 await task
             except (asyncio.CancelledError, Exception):
                 pass
+        return await self._terminate(groups, deadline)
+
+    async def _terminate(self, groups: set[int], deadline: float) -> bool:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        budget = max(deadline - started, 0)
+        killed = False
+        for signum, share in ESCALATION:
+            if self.process.returncode is not None:
+                break
+            killed = signum == signal.SIGKILL
+            for pgid in groups:
+                with suppress(ProcessLookupError, PermissionError):
+                    os.killpg(pgid, signum)
+            timeout_at = started + budget * share
+            if signum == signal.SIGKILL:
+                timeout_at = max(timeout_at, loop.time() + KILL_GRACE)
+            with suppress(TimeoutError):
+                async with asyncio.timeout_at(timeout_at):
+                    await self.process.wait()
         if self.process.returncode is None:
-            self.process.kill()
-            try:
-                await asyncio.wait_for(
-                    self.process.wait(),
-                    timeout=5.0,
-                )
-            except TimeoutError:
-                log.warning(
-                    "Process %s did not exit after kill",
-                    self.process.pid,
-                )
+            log.warning(
+                "Process %s did not exit after kill",
+                self.process.pid,
+            )
+        return not killed
+
+
+@dataclass(eq=False)
+class Channel:
+    ws: ViewerSocket
+    terminal: Terminal | None = None
+    read_only: bool = False
+    remote: asyncio.Task[None] | None = None
+    # Shell started ahead of the request that opens the terminal
+    spawning: asyncio.Future[PtyProcess] | None = None
+    # Output credit granted before a terminal is attached
+    credit: int = 0
+    # Input and resizes, as (rows, cols), waiting for the terminal to open
+    # or for its PTY to take the input backlog
+    inbox: deque[bytes | tuple[int, int]] = field(default_factory=deque)
+    inbox_bytes: int = 0
+    feeding: asyncio.Task[None] | None = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
 
 
 class PtyHandler(Route):
     def __init__(self, *args: t.Any, **kwargs: t.Any) -> None:
         super().__init__(*args, **kwargs)
-        self._terminal: Terminal | None = None
-        self._lock: asyncio.Lock = asyncio.Lock()
+        # A connection without multiplexing only ever has channel zero
+        self._channels: dict[int, Channel] = {}
+
+    @property
+    def ws(self) -> web.WebSocketResponse:
+        return self.socket.socket  # type: ignore[attr-defined]
+
+    @property
+    def multiplexed(self) -> bool:
+        return self.socket.request.query.get("mux") == "1"
 
     @property
     def shell(self) -> str:
         return self.socket.request.app[SHELL_KEY]
 
     @property
-    async def terminal(self) -> Terminal:
-        async with self._lock:
-            if self._terminal is not None:
-                return self._terminal
-
-            pty_config = await PTYConfig.open_pty(self.shell)
-            socket: WSRPCBase = self.socket  # type: ignore
-
-            env = os.environ.copy()
-            env["TERM"] = "xterm-256color"
-            env["COLORTERM"] = "truecolor"
-
-            def _setup_child() -> None:
-                os.setsid()
-                fcntl.ioctl(0, termios.TIOCSCTTY, 0)
-
-            process = await asyncio.create_subprocess_exec(
-                self.shell,
-                preexec_fn=_setup_child,
-                stdin=pty_config.slave_fd,
-                stdout=pty_config.slave_fd,
-                stderr=pty_config.slave_fd,
-                env=env,
-                close_fds=True,
+    def options(self) -> TerminalOptions:
+        return self.socket.request.app[TERMINAL_OPTIONS_KEY]
+
+    @property
+    def sessions(self) -> dict[str, "Terminal"]:
+        return self.socket.request.app[SESSIONS_KEY]
+
+    def is_open(self, channel: int) -> bool:
+        return channel in self._channels
+
+    def read_only(self, channel: int = 0) -> bool:
+        state = self._channels.get(channel)
+        return state is not None and state.read_only
+
+    def _channel(self, channel: int) -> Channel:
+        state = self._channels.get(channel)
+        if state is not None:
+            return state
+        if not self.multiplexed:
+            if channel:
+                raise ValueError("Connection is not multiplexed")
+            state = self._channels[channel] = Channel(self.ws)
+            return state
+        if not 0 <= channel <= MAX_CHANNEL:
+            raise ValueError("Channel out of range")
+        if len(self._channels) >= MAX_CHANNELS:
+            raise ValueError("Too many channels")
+        socket = ChannelSocket(
+            self.ws,
+            channel,
+            lambda: self._drop_channel(channel, socket),
+        )
+        state = self._channels[channel] = Channel(socket)
+        return state
+
+    async def _drop_channel(self, channel: int, ws: ViewerSocket) -> None:
+        # Closed by the server, after a reattach elsewhere for example
+        state = self._channels.get(channel)
+        if state is None or state.ws is not ws:
+            return
+        del self._channels[channel]
+        await self._close_channel(state)
+
+    def _create_encoder(self) -> DeflateEncoder | None:
+        return create_encoder(
+            self.socket.request.query.get("codec"),
+            min_bytes=self.options.compression_min_bytes,
+            level=self.options.compression_level,
+        )
+
+    async def _spawn(self) -> PtyProcess:
+        pool = self.socket.request.app[SHELL_POOL_KEY]
+        shell = pool.acquire() if pool is not None else None
+        if shell is None:
+            shell = await spawn_shell(self.shell)
+        return shell
+
+    def prespawn(self, channel: int = 0) -> None:
+        state = self._channel(channel)
+        if state.terminal is None and state.spawning is None:
+            state.spawning = asyncio.ensure_future(self._spawn())
+
+    async def terminal(self, channel: int = 0) -> Terminal:
+        state = self._channel(channel)
+        # Every keystroke comes here, the lock only matters until it is open
+        if state.terminal is not None:
+            return state.terminal
+        async with state.lock:
+            if state.terminal is not None:
+                return state.terminal
+
+            spawning, state.spawning = state.spawning, None
+            if spawning is None:
+                shell = await self._spawn()
+            else:
+                shell = await spawning
+
+            terminal = Terminal(
+                shell.process,
+                shell.fd,
+                None,
+                self.options,
+                recording=_record(self.socket.request.app, shell.process),
             )
-            os.close(pty_config.slave_fd)
+            SESSIONS_OPENED.inc()
+            terminal.attach(state.ws, self._create_encoder())
+            _track(self.socket.request.app, terminal)
+            self._attached(state, terminal)
+            return terminal
 
-            self._terminal = Terminal(
-                process,
-                pty_config.master_fd,
-                socket.socket,  # type: ignore[attr-defined]
+    async def input(self, data: bytes, channel: int = 0) -> None:
+        # Called by the socket reader, which must never wait for a shell
+        # or for a PTY that stopped reading
+        state = self._channel(channel)
+        terminal = state.terminal
+        if (
+            terminal is not None
+            and state.feeding is None
+            and not terminal.input_backlog
+        ):
+            await terminal.write(data)
+            return
+        if state.inbox_bytes + len(data) > self.options.input_buffer_bytes:
+            # Only a client that does not wait for drain() gets here
+            await self._drop_input(channel, len(data))
+            return
+        state.inbox_bytes += len(data)
+        self._queue(state, channel, data)
+
+    async def _drop_input(self, channel: int, size: int) -> None:
+        INPUT_DROPPED_BYTES.inc(size)
+        log.debug("Input backlog of channel %d is full, input dropped", channel)
+        event = {"event": "input_dropped", "channel": channel, "bytes": size}
+        with suppress(ConnectionError):
+            await self.socket.emit(event)  # type: ignore[attr-defined]
+
+    def resize(self, rows: int, cols: int, channel: int = 0) -> None:
+        state = self._channel(channel)
+        if state.terminal is None or state.feeding is not None:
+            self._queue(state, channel, (rows, cols))
+            return
+        state.terminal.resize(rows=rows, cols=cols)
+
+    def _queue(
+        self,
+        state: Channel,
+        channel: int,
+        item: bytes | tuple[int, int],
+    ) -> None:
+        state.inbox.append(item)
+        if state.feeding is None:
+            state.feeding = asyncio.create_task(
+                self._feed_inbox(state, channel),
             )
-            app = self.socket.request.app
-            app[TERMINALS_KEY].add(self._terminal)
-            return self._terminal
 
-    @decorators.proxy
-    async def ready(self, cols: int, rows: int) -> None:
-        terminal = await self.terminal
+    async def _feed_inbox(self, state: Channel, channel: int) -> None:
+        # Opens the terminal the way the first keystroke always did and
+        # waits for a PTY that stopped reading, in a task of the channel
+        try:
+            terminal = await self.terminal(channel)
+        except Exception:
+            log.exception("Failed to open the terminal for its input")
+            state.inbox.clear()
+            state.inbox_bytes = 0
+            state.feeding = None
+            return
+        # Everything of the channel is queued here until the inbox is empty
+        while state.inbox:
+            item = state.inbox.popleft()
+            if isinstance(item, tuple):
+                rows, cols = item
+                terminal.resize(rows=rows, cols=cols)
+                continue
+            if terminal.input_backlog:
+                await terminal.drain()
+            state.inbox_bytes -= len(item)
+            await terminal.write(item)
+        state.feeding = None
+
+    def _attached(self, state: Channel, terminal: Terminal) -> None:
+        state.terminal = terminal
+        if state.credit:
+            terminal.grant(state.ws, state.credit)
+            state.credit = 0
+
+    def grant(self, size: int, channel: int = 0) -> None:
+        # The first window is usually granted ahead of ready()
+        state = self._channel(channel)
+        if state.terminal is None:
+            state.credit += size
+            return
+        state.terminal.grant(state.ws, size)
+
+    def _find_session(self, token: str) -> Terminal | None:
+        terminal = self.sessions.get(token)
+        if terminal is None or terminal.process.returncode is not None:
+            return None
+        return terminal
+
+    async def _adopt(self, token: str) -> Terminal | None:
+        directory = self.socket.request.app[SESSION_DIRECTORY_KEY]
+        if directory is None:
+            return None
+        state = await directory.take(token)
+        if state is None:
+            return None
+        log.info("Adopted terminal from a peer worker")
+        return await adopt_terminal(self.socket.request.app, state)
+
+    async def _reattach(self, token: str, channel: int) -> None:
+        state = self._channel(channel)
+        async with state.lock:
+            if state.terminal is not None:
+                return
+            terminal = self._find_session(token) or await self._adopt(token)
+            if terminal is None or terminal.token != token:
+                return
+            log.info("Reattaching terminal")
+            SESSIONS_REATTACHED.inc()
+            previous = terminal.ws
+            terminal.attach(state.ws, self._create_encoder())
+            self._attached(state, terminal)
+        if previous is not None:
+            await previous.close(message=b"Session attached elsewhere")
+
+    async def open(
+        self,
+        cols: int,
+        rows: int,
+        session: str | None = None,
+        channel: int = 0,
+    ) -> Terminal:
+        if session is not None:
+            await self._reattach(session, channel)
+        terminal = await self.terminal(channel)
         terminal.resize(rows=rows, cols=cols)
+        return terminal
 
-    def _onclose(self) -> t.Any:  # type: ignore
-        log.info("Closing terminal")
-        terminal, self._terminal = self._terminal, None
+    @decorators.proxy
+    async def ready(
+        self,
+        cols: int,
+        rows: int,
+        session: str | None = None,
+        channel: int = 0,
+    ) -> dict[str, str]:
+        terminal = await self.open(cols, rows, session, channel)
+        return {"session": terminal.token, "view": terminal.view_token}
+
+    @decorators.proxy
+    async def drain(self, channel: int = 0) -> None:
+        # Answered in a task of its own, so a PTY that stopped reading
+        # holds back the paste on its channel and nothing else
+        state = self._channels.get(channel)
+        if state is None or state.read_only:
+            return
+        if state.feeding is not None:
+            # Input sent ahead of this waits in the inbox
+            await asyncio.wait([state.feeding])
+        if state.terminal is not None:
+            await state.terminal.drain()
+
+    @decorators.proxy
+    async def visibility(self, hidden: bool, channel: int = 0) -> None:
+        state = self._channels.get(channel)
+        if state is not None and state.terminal is not None:
+            state.terminal.set_hidden(state.ws, hidden)
+
+    @decorators.proxy
+    async def watch(self, session: str, channel: int = 0) -> dict[str, str]:
+        state = self._channel(channel)
+        async with state.lock:
+            if state.terminal is not None or state.remote is not None:
+                raise RuntimeError("Channel already has a terminal")
+            terminal = self._find_session(session)
+            if terminal is None:
+                await self._watch_remote(session, state)
+                return {"view": session}
+            if terminal.view_token != session:
+                raise LookupError("Session not found")
+            log.info("Attaching read-only viewer")
+            terminal.add_viewer(state.ws, self._create_encoder())
+            self._attached(state, terminal)
+            state.read_only = True
+        return {"view": terminal.view_token}
+
+    @decorators.proxy
+    async def close_channel(self, channel: int) -> None:
+        state = self._channels.pop(channel, None)
+        if state is not None:
+            await self._close_channel(state)
+
+    async def _watch_remote(self, session: str, state: Channel) -> None:
+        directory = self.socket.request.app[SESSION_DIRECTORY_KEY]
+        view = None
+        if directory is not None:
+            codec = self.socket.request.query.get("codec")
+            view = await directory.watch(session, codec)
+        if view is None:
+            raise LookupError("Session not found")
+        log.info("Attaching read-only viewer to a peer worker")
+        state.read_only = True
+        state.remote = asyncio.create_task(self._forward(view, state.ws))
+
+    async def _forward(self, view: RemoteView, ws: ViewerSocket) -> None:
+        try:
+            async for frame in view.frames():
+                await ws.send_bytes(frame)
+        except ConnectionError:
+            log.debug("Connection lost while forwarding remote output")
+
+    async def _close_channel(self, state: Channel) -> None:
+        if state.remote is not None:
+            state.remote.cancel()
+        if state.feeding is not None:
+            state.feeding.cancel()
+        spawning, state.spawning = state.spawning, None
+        if spawning is not None:
+            spawning.cancel()
+            spawning.add_done_callback(_discard_shell)
+        # Waits for a terminal that is still being opened
+        async with state.lock:
+            terminal, state.terminal = state.terminal, None
         if terminal is None:
             return
-        app = self.socket.request.app
-        return _close_and_untrack(terminal, app)
+        if state.read_only:
+            terminal.remove_viewer(state.ws)
+            return
+        if terminal.ws is not state.ws:
+            return
+        if self.options.session_ttl and terminal.process.returncode is None:
+            log.info("Detaching terminal")
+            terminal.detach()
+            terminal.spill_scrollback()
+            return
+        log.info("Closing terminal")
+        await _close_and_untrack(terminal, self.socket.request.app)
+
+    async def _onclose(self) -> None:
+        channels = list(self._channels.values())
+        self._channels.clear()
+        await asyncio.gather(*(self._close_channel(c) for c in channels))
+
+
+def _discard_shell(future: asyncio.Future[PtyProcess]) -> None:
+    if not future.cancelled() and future.exception() is None:
+        future.result().kill()
+
+
+def _record(app: web.Application, process: ShellProcess) -> Recording | None:
+    recorder = app[RECORDER_KEY]
+    return recorder.record(process.pid) if recorder is not None else None
+
+
+def _track(app: web.Application, terminal: Terminal) -> None:
+    app[TERMINALS_KEY].add(terminal)
+    app[SESSIONS_KEY][terminal.token] = terminal
+    app[SESSIONS_KEY][terminal.view_token] = terminal
+
+
+def _untrack(app: web.Application, terminal: Terminal) -> None:
+    app[TERMINALS_KEY].discard(terminal)
+    app[SESSIONS_KEY].pop(terminal.token, None)
+    app[SESSIONS_KEY].pop(terminal.view_token, None)
 
 
 async def _close_and_untrack(
@@ -251,15 +1263,198 @@ async def _close_and_untrack(
     try:
         await terminal.close()
     finally:
-        app[TERMINALS_KEY].discard(terminal)
+        _untrack(app, terminal)
+
+
+async def adopt_terminal(app: web.Application, state: SessionState) -> Terminal:
+    process = ShellProcess(state.pid, foreign=True)
+    terminal = Terminal(
+        process,
+        state.fd,
+        None,
+        app[TERMINAL_OPTIONS_KEY],
+        token=state.token,
+        view_token=state.view_token,
+        recording=_record(app, process),
+    )
+    terminal.scrollback.append(state.scrollback)
+    if state.pending_input:
+        await terminal.write(state.pending_input)
+    # Nobody is attached yet, the session TTL applies until someone is
+    terminal.detached_at = asyncio.get_running_loop().time()
+    terminal.spill_scrollback()
+    _track(app, terminal)
+    return terminal
+
+
+class LocalSessions:
+    def __init__(self, app: web.Application) -> None:
+        self.app = app
+
+    def _find(self, token: str) -> Terminal | None:
+        terminal = self.app[SESSIONS_KEY].get(token)
+        if terminal is None or terminal._suspended:
+            return None
+        if terminal.process.returncode is not None:
+            return None
+        return terminal
+
+    def export_session(self, token: str) -> SessionState | None:
+        terminal = self._find(token)
+        if terminal is None or terminal.token != token:
+            return None
+        terminal.suspend()
+        return SessionState(
+            token=terminal.token,
+            view_token=terminal.view_token,
+            pid=terminal.process.pid,
+            fd=terminal.fd,
+            scrollback=terminal.scrollback.tail(),
+            pending_input=bytes(terminal._write_buffer),
+        )
+
+    async def finish_export(self, token: str, moved: bool) -> None:
+        terminal = self.app[SESSIONS_KEY].get(token)
+        if terminal is None:
+            return
+        if not moved:
+            terminal.unsuspend()
+            return
+        _untrack(self.app, terminal)
+        await terminal.release(b"Session moved to another worker")
+
+    async def adopt_session(self, state: SessionState) -> None:
+        await adopt_terminal(self.app, state)
+        log.info("Adopted terminal from a previous generation")
+
+    def watch_session(
+        self,
+        token: str,
+        codec: str | None,
+        peer: PeerSocket,
+    ) -> t.Callable[[], None] | None:
+        terminal = self._find(token)
+        if terminal is None or terminal.view_token != token:
+            return None
+        options = self.app[TERMINAL_OPTIONS_KEY]
+        encoder = create_encoder(
+            codec,
+            min_bytes=options.compression_min_bytes,
+            level=options.compression_level,
+        )
+        terminal.add_viewer(peer, encoder)
+        return lambda: terminal.remove_viewer(peer)
+
+
+async def _reap_sessions(app: web.Application, ttl: float) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(min(ttl, REAP_INTERVAL))
+        now = loop.time()
+        for terminal in set(app[SESSIONS_KEY].values()):
+            if terminal.detached_at is None or terminal._suspended:
+                continue
+            alive = terminal.process.returncode is None
+            if alive and now - terminal.detached_at < ttl:
+                continue
+            log.info("Reaping detached terminal")
+            try:
+                await _close_and_untrack(terminal, app)
+            except Exception:
+                log.exception("Error reaping detached terminal")
+
+
+async def session_reaper(app: web.Application) -> t.AsyncIterator[None]:
+    ttl = app[TERMINAL_OPTIONS_KEY].session_ttl
+    task = asyncio.create_task(_reap_sessions(app, ttl)) if ttl else None
+    yield
+    if task is None:
+        return
+    task.cancel()
+    with suppress(asyncio.CancelledError):
+        await task
+
+
+async def shell_pool(app: web.Application) -> t.AsyncIterator[None]:
+    pool = app[SHELL_POOL_KEY]
+    if pool is not None:
+        pool.start()
+    yield
+    if pool is not None:
+        await pool.close()
+
+
+async def session_recorder(app: web.Application) -> t.AsyncIterator[None]:
+    recorder = app[RECORDER_KEY]
+    if recorder is not None:
+        recorder.start()
+    yield
+    if recorder is not None:
+        await recorder.close()
+
+
+async def session_directory(app: web.Application) -> t.AsyncIterator[None]:
+    directory = app[SESSION_DIRECTORY_KEY]
+    if directory is not None:
+        directory.start(LocalSessions(app))
+    yield
+    if directory is not None:
+        await directory.close()
+
+
+async def _hand_over(app: web.Application, terminals: list[Terminal]) -> int:
+    directory = app.get(SESSION_DIRECTORY_KEY)
+    successors = directory.successors() if directory is not None else []
+    if directory is None or not successors:
+        return 0
+    owner = LocalSessions(app)
+
+    async def move(terminal: Terminal, address: str) -> bool:
+        state = owner.export_session(terminal.token)
+        if state is None:
+            return False
+        moved = False
+        try:
+            moved = await directory.push(state, address)
+        except (ConnectionError, TimeoutError, ValueError):
+            log.warning("Failed to hand terminal over to %s", address)
+        finally:
+            await owner.finish_export(terminal.token, moved)
+        return moved
+
+    results = await asyncio.gather(
+        *(
+            move(terminal, successors[i % len(successors)])
+            for i, terminal in enumerate(terminals)
+        ),
+    )
+    return sum(results)
 
 
 async def close_all_terminals(app: web.Application) -> None:
     terminals: set[Terminal] = app[TERMINALS_KEY]
+    moved = await _hand_over(app, list(terminals))
+    if moved:
+        log.info("Handed %d terminals over to the next generation", moved)
     to_close = list(terminals)
     terminals.clear()
-    for terminal in to_close:
-        try:
-            await terminal.close()
-        except Exception:
-            log.exception("Error closing terminal on shutdown")
+    app[SESSIONS_KEY].clear()
+    if not to_close:
+        return
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + app[TERMINAL_OPTIONS_KEY].close_timeout
+    results = await asyncio.gather(
+        *(terminal.close(deadline) for terminal in to_close),
+        return_exceptions=True,
+    )
+    errors = [r for r in results if isinstance(r, BaseException)]
+    for error in errors:
+        log.error("Error closing terminal on shutdown", exc_info=error)
+    clean = sum(r is True for r in results)
+    log.info(
+        "Closed %d terminals: %d exited cleanly, %d killed, %d failed",
+        len(results),
+        clean,
+        len(results) - clean - len(errors),
+        len(errors),
+    )
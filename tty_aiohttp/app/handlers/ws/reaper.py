@@ -0,0 +1,134 @@
+import asyncio
+import os
+import signal
+from collections.abc import Callable
+from logging import getLogger
+from weakref import WeakKeyDictionary
+
+log = getLogger(__name__)
+
+ExitCallback = Callable[[int], None]
+
+# Wait status reported when the real one can not be collected
+UNKNOWN_STATUS = 255 << 8
+# How often a process of another worker is checked without pidfd support
+FOREIGN_POLL_INTERVAL = 1.0
+
+
+class ChildReaper:
+    __slots__ = ("_callbacks", "_foreign", "_loop", "_pidfds", "_sigchld")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._callbacks: dict[int, ExitCallback] = {}
+        self._pidfds: dict[int, int] = {}
+        self._foreign: dict[int, int | asyncio.TimerHandle] = {}
+        self._sigchld = False
+
+    def __len__(self) -> int:
+        return len(self._callbacks)
+
+    def __contains__(self, pid: int) -> bool:
+        return pid in self._callbacks
+
+    def watch(self, pid: int, callback: ExitCallback) -> None:
+        self._callbacks[pid] = callback
+        try:
+            pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            self._install_sigchld()
+            # The child may have exited before the handler was installed
+            self._reap(pid)
+            return
+        self._pidfds[pid] = pidfd
+        self._loop.add_reader(pidfd, self._reap, pid)
+
+    def watch_foreign(self, pid: int, callback: ExitCallback) -> None:
+        # Another process reaps it, only the exit itself is observable
+        try:
+            pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            self._poll_foreign(pid, callback)
+            return
+
+        def on_exit() -> None:
+            self._loop.remove_reader(pidfd)
+            os.close(pidfd)
+            self._foreign.pop(pid, None)
+            callback(UNKNOWN_STATUS)
+
+        self._foreign[pid] = pidfd
+        self._loop.add_reader(pidfd, on_exit)
+
+    def _poll_foreign(self, pid: int, callback: ExitCallback) -> None:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            self._foreign.pop(pid, None)
+            callback(UNKNOWN_STATUS)
+            return
+        except PermissionError:
+            pass
+        self._foreign[pid] = self._loop.call_later(
+            FOREIGN_POLL_INTERVAL,
+            self._poll_foreign,
+            pid,
+            callback,
+        )
+
+    def _install_sigchld(self) -> None:
+        if self._sigchld:
+            return
+        self._loop.add_signal_handler(signal.SIGCHLD, self._on_sigchld)
+        self._sigchld = True
+
+    def _on_sigchld(self) -> None:
+        # SIGCHLD coalesces, so every child without a pidfd is polled
+        for pid in [p for p in self._callbacks if p not in self._pidfds]:
+            self._reap(pid)
+
+    def _reap(self, pid: int) -> None:
+        try:
+            reaped, status = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            log.warning("Child %d was reaped elsewhere", pid)
+            reaped, status = pid, UNKNOWN_STATUS
+        if not reaped:
+            return
+        pidfd = self._pidfds.pop(pid, None)
+        if pidfd is not None:
+            self._loop.remove_reader(pidfd)
+            os.close(pidfd)
+        callback = self._callbacks.pop(pid, None)
+        if callback is not None:
+            callback(status)
+
+    def close(self) -> None:
+        for pidfd in self._pidfds.values():
+            self._loop.remove_reader(pidfd)
+            os.close(pidfd)
+        self._pidfds.clear()
+        self._callbacks.clear()
+        for watch in self._foreign.values():
+            if isinstance(watch, asyncio.TimerHandle):
+                watch.cancel()
+                continue
+            self._loop.remove_reader(watch)
+            os.close(watch)
+        self._foreign.clear()
+        if self._sigchld:
+            self._loop.remove_signal_handler(signal.SIGCHLD)
+            self._sigchld = False
+
+
+_reapers: WeakKeyDictionary[asyncio.AbstractEventLoop, ChildReaper] = (
+    WeakKeyDictionary()
+)
+
+
+def get_reaper() -> ChildReaper:
+    loop = asyncio.get_running_loop()
+    reaper = _reapers.get(loop)
+    if reaper is None:
+        reaper = _reapers[loop] = ChildReaper(loop)
+    return reaper
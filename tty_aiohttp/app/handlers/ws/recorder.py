@@ -0,0 +1,327 @@
+import asyncio
+import codecs
+import gzip
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+import typing as t
+from dataclasses import dataclass
+from functools import partial
+from logging import getLogger
+
+from aiomisc.thread_pool import threaded
+
+from tty_aiohttp.app.metrics import RECORDED_BYTES, RECORDING_DROPPED_BYTES
+
+log = getLogger(__name__)
+
+# Output read within this long is written as a single event
+BATCH_DELAY = 0.02
+# A batch goes to the writer early once it grows this large
+BATCH_BYTES = 64 * 1024
+# How long the writer waits for events before flushing its open files
+FLUSH_INTERVAL = 1.0
+# Size of a recording that was never resized
+DEFAULT_SIZE = (80, 24)
+
+Call = t.Callable[[], None]
+
+
+@dataclass(frozen=True)
+class RecordingOptions:
+    # Sessions are not recorded without a directory
+    directory: str | None = None
+    # Output waiting for the writer, beyond this it is dropped
+    queue_bytes: int = 4 * 1024 * 1024
+    # Uncompressed size of a file before the next one is started
+    rotate_bytes: int = 64 * 1024 * 1024
+    compression_level: int = 6
+
+
+@dataclass
+class RecorderStats:
+    recorded: int = 0
+    dropped: int = 0
+    files: int = 0
+    errors: int = 0
+
+
+class Cast:
+    # Owned by the writer thread, the event loop only queues calls to it
+    __slots__ = (
+        "_decoder",
+        "_file",
+        "_gzip",
+        "_recorder",
+        "_started",
+        "_written",
+        "dirty",
+        "failed",
+        "name",
+        "part",
+        "size",
+    )
+
+    def __init__(self, recorder: "Recorder", name: str) -> None:
+        self._recorder = recorder
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._file: t.BinaryIO | None = None
+        self._gzip: gzip.GzipFile | None = None
+        self._started = 0.0
+        self._written = 0
+        self.dirty = False
+        self.failed = False
+        self.name = name
+        self.part = 0
+        self.size = DEFAULT_SIZE
+
+    @property
+    def path(self) -> str:
+        return os.path.join(
+            self._recorder.options.directory or "",
+            f"{self.name}.{self.part}.cast.gz",
+        )
+
+    def _open(self, at: float) -> gzip.GzipFile:
+        self.part += 1
+        # Recordings hold everything typed and printed in a session
+        self._file = open(
+            self.path,
+            "xb",
+            opener=lambda path, flags: os.open(path, flags, 0o600),
+        )
+        self._gzip = gzip.GzipFile(
+            mode="wb",
+            fileobj=self._file,
+            compresslevel=self._recorder.options.compression_level,
+        )
+        self._recorder.stats.files += 1
+        self._recorder._casts.add(self)
+        self._started = at
+        self._written = 0
+        cols, rows = self.size
+        header = {
+            "version": 2,
+            "width": cols,
+            "height": rows,
+            "timestamp": int(time.time() - (time.monotonic() - at)),
+        }
+        self._write(self._gzip, header)
+        return self._gzip
+
+    def _write(self, stream: gzip.GzipFile, line: object) -> None:
+        data = json.dumps(line, ensure_ascii=False).encode() + b"\n"
+        stream.write(data)
+        self._written += len(data)
+        self.dirty = True
+
+    def _event(self, at: float, kind: str, data: str) -> None:
+        if self.failed:
+            return
+        try:
+            stream = self._gzip or self._open(at)
+            self._write(stream, [round(at - self._started, 6), kind, data])
+            if self._written >= self._recorder.options.rotate_bytes:
+                self.close()
+        except OSError:
+            log.exception("Failed to write recording %s", self.path)
+            self._recorder.stats.errors += 1
+            self.failed = True
+            self.close()
+
+    def output(self, at: float, data: bytes) -> None:
+        # Characters split between reads are kept by the decoder
+        text = self._decoder.decode(data)
+        if text:
+            self._event(at, "o", text)
+
+    def resize(self, at: float, cols: int, rows: int) -> None:
+        if (cols, rows) == self.size:
+            return
+        self.size = (cols, rows)
+        # A file opened by this event has the new size in its header
+        if self._gzip is not None:
+            self._event(at, "r", f"{cols}x{rows}")
+
+    def marker(self, at: float, label: str) -> None:
+        self._event(at, "m", label)
+
+    def flush(self) -> None:
+        self.dirty = False
+        if self._gzip is None:
+            return
+        try:
+            self._gzip.flush()
+        except OSError:
+            log.exception("Failed to flush recording %s", self.path)
+
+    def close(self) -> None:
+        self.dirty = False
+        self._recorder._casts.discard(self)
+        stream, raw = self._gzip, self._file
+        self._gzip = self._file = None
+        try:
+            if stream is not None:
+                stream.close()
+        except OSError:
+            log.exception("Failed to close recording %s", self.path)
+        finally:
+            if raw is not None:
+                raw.close()
+
+
+class Recording:
+    # The event loop side of a Cast, output is batched here and the
+    # writer thread gets a call per batch
+    __slots__ = (
+        "_cast",
+        "_dropping",
+        "_flush_handle",
+        "_pending",
+        "_pending_at",
+        "_recorder",
+        "closed",
+    )
+
+    def __init__(self, recorder: "Recorder", cast: Cast) -> None:
+        self._recorder = recorder
+        self._cast = cast
+        self._pending = bytearray()
+        self._pending_at = 0.0
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._dropping = False
+        self.closed = False
+
+    @property
+    def name(self) -> str:
+        return self._cast.name
+
+    def output(self, data: bytes | memoryview) -> None:
+        if self.closed:
+            return
+        if not self._pending:
+            self._pending_at = time.monotonic()
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                BATCH_DELAY,
+                self.flush,
+            )
+        # A copy, the read arena is reused once the reader moves on
+        self._pending += data
+        if len(self._pending) >= BATCH_BYTES:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        data, at = bytes(self._pending), self._pending_at
+        self._pending.clear()
+        output = partial(self._cast.output, at, data)
+        if self._recorder.submit(output, len(data)):
+            self._dropping = False
+            return
+        if not self._dropping:
+            self._dropping = True
+            marker = partial(self._cast.marker, at, "output dropped")
+            self._recorder.submit(marker)
+
+    def resize(self, rows: int, cols: int) -> None:
+        if self.closed:
+            return
+        self.flush()
+        at = time.monotonic()
+        self._recorder.submit(partial(self._cast.resize, at, cols, rows))
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        self._recorder.submit(self._cast.close)
+
+
+class Recorder:
+    def __init__(self, options: RecordingOptions) -> None:
+        self.options = options
+        self.stats = RecorderStats()
+        self._queue: queue.SimpleQueue[tuple[Call, int] | None] = (
+            queue.SimpleQueue()
+        )
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        # Casts with an open file, only touched by the writer thread
+        self._casts: set[Cast] = set()
+
+    @property
+    def queued_bytes(self) -> int:
+        return self._queued
+
+    def start(self) -> None:
+        if self._thread is not None or self.options.directory is None:
+            return
+        os.makedirs(self.options.directory, mode=0o700, exist_ok=True)
+        self._thread = threading.Thread(
+            target=self._run,
+            name="session-recorder",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def record(self, pid: int) -> Recording:
+        stamp = time.strftime("%Y%m%dT%H%M%S")
+        cast = Cast(self, f"{stamp}-{pid}-{secrets.token_hex(3)}")
+        log.info("Recording session of PID %s as %s", pid, cast.name)
+        return Recording(self, cast)
+
+    def submit(self, call: Call, size: int = 0) -> bool:
+        # Only output counts against the queue, so a recording is always
+        # resized and closed even while its output is dropped
+        if self._thread is None:
+            return False
+        with self._lock:
+            if size and self._queued + size > self.options.queue_bytes:
+                self.stats.dropped += size
+                RECORDING_DROPPED_BYTES.inc(size)
+                return False
+            self._queued += size
+        self.stats.recorded += size
+        RECORDED_BYTES.inc(size)
+        self._queue.put((call, size))
+        return True
+
+    def _run(self) -> None:
+        while True:
+            try:
+                item = self._queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                # Idle files are flushed, so a recording on disk lags the
+                # session by about a second
+                for cast in self._casts:
+                    if cast.dirty:
+                        cast.flush()
+                continue
+            if item is None:
+                break
+            call, size = item
+            if size:
+                with self._lock:
+                    self._queued -= size
+            try:
+                call()
+            except Exception:
+                log.exception("Session recorder failed")
+        for cast in list(self._casts):
+            cast.close()
+
+    async def close(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(None)
+        await threaded(thread.join)()
@@ -0,0 +1,110 @@
+import typing as t
+from logging import getLogger
+
+try:
+    import pyte
+    from pyte.graphics import BG_AIXTERM, BG_ANSI, FG_AIXTERM, FG_ANSI
+except ImportError:  # pragma: no cover
+    pyte = None  # type: ignore[assignment]
+    BG_AIXTERM = BG_ANSI = FG_AIXTERM = FG_ANSI = {}
+
+log = getLogger(__name__)
+
+FOREGROUND = {name: code for code, name in {**FG_ANSI, **FG_AIXTERM}.items()}
+BACKGROUND = {name: code for code, name in {**BG_ANSI, **BG_AIXTERM}.items()}
+# Character attributes and the SGR parameter that turns each one on
+FLAGS = (
+    ("bold", 1),
+    ("italics", 3),
+    ("underscore", 4),
+    ("blink", 5),
+    ("reverse", 7),
+    ("strikethrough", 9),
+)
+
+HIDE_CURSOR = "\x1b[?25l"
+SHOW_CURSOR = "\x1b[?25h"
+# Attributes back to defaults, then the rest of the line erased
+END_OF_LINE = "\x1b[0m\x1b[K"
+
+
+def screen_supported() -> bool:
+    return pyte is not None
+
+
+def _color(value: str, named: dict[str, int], extended: int) -> str:
+    code = named.get(value)
+    if code is not None:
+        return str(code)
+    # 256 colors and true colors are kept as hex RGB
+    try:
+        red, green, blue = (int(value[i : i + 2], 16) for i in (0, 2, 4))
+    except ValueError:
+        return str(extended + 1)
+    return f"{extended};2;{red};{green};{blue}"
+
+
+def _sgr(char: t.Any) -> str:
+    params = ["0"]
+    params.extend(str(code) for name, code in FLAGS if getattr(char, name))
+    params.append(_color(char.fg, FOREGROUND, 38))
+    params.append(_color(char.bg, BACKGROUND, 48))
+    return f"\x1b[{';'.join(params)}m"
+
+
+class VirtualScreen:
+    __slots__ = ("_screen", "_stream")
+
+    def __init__(self, rows: int = 24, cols: int = 80) -> None:
+        if pyte is None:
+            raise RuntimeError("The virtual screen needs the pyte package")
+        self._screen = pyte.Screen(cols, rows)
+        self._stream = pyte.ByteStream(self._screen)
+
+    def feed(self, data: bytes) -> None:
+        try:
+            self._stream.feed(data)
+        except Exception:
+            log.exception("Terminal emulator failed, resetting the screen")
+            self.reset()
+
+    def resize(self, rows: int, cols: int) -> None:
+        self._screen.resize(rows, cols)
+
+    def reset(self) -> None:
+        self._screen.reset()
+
+    def _line(self, y: int) -> str:
+        line = self._screen.buffer[y]
+        parts = []
+        attrs = None
+        for x in range(min(max(line, default=-1) + 1, self._screen.columns)):
+            char = line[x]
+            # The right half of a wide character
+            if not char.data:
+                continue
+            if char[1:] != attrs:
+                parts.append(_sgr(char))
+                attrs = char[1:]
+            parts.append(char.data)
+        return "".join(parts)
+
+    def render(self, previous: list[str] | None) -> tuple[bytes, list[str]]:
+        # Lines the client has from the previous render are skipped,
+        # without them every line is drawn
+        lines = [self._line(y) for y in range(self._screen.lines)]
+        parts = [HIDE_CURSOR]
+        for y, line in enumerate(lines):
+            if (
+                previous is not None
+                and y < len(previous)
+                and previous[y] == line
+            ):
+                continue
+            parts.append(f"\x1b[{y + 1};1H{line}{END_OF_LINE}")
+        cursor = self._screen.cursor
+        parts.append(f"\x1b[{cursor.y + 1};{cursor.x + 1}H")
+        parts.append(_sgr(cursor.attrs))
+        if not cursor.hidden:
+            parts.append(SHOW_CURSOR)
+        return "".join(parts).encode(), lines
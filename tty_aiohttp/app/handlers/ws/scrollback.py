@@ -0,0 +1,110 @@
+import mmap
+import os
+import sys
+import tempfile
+
+
+def _map(fd: int, size: int) -> mmap.mmap:
+    # Since 3.13 a mapping does not have to hold a descriptor, thousands
+    # of spilled sessions would otherwise take as many descriptors
+    if sys.version_info >= (3, 13):
+        return mmap.mmap(fd, size, trackfd=False)
+    return mmap.mmap(fd, size)
+
+
+class RingBuffer:
+    __slots__ = ("_buffer", "_capacity", "_map", "_written")
+
+    def __init__(self, capacity: int) -> None:
+        self._capacity = capacity
+        self._buffer = memoryview(bytearray(capacity))
+        self._map: mmap.mmap | None = None
+        self._written = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def __len__(self) -> int:
+        return min(self._written, self._capacity)
+
+    @property
+    def written(self) -> int:
+        return self._written
+
+    @property
+    def spilled(self) -> bool:
+        return self._map is not None
+
+    def spill(self, directory: str) -> None:
+        # Moves the contents to a file mapping of the same layout. The file
+        # is unlinked right away, nothing is left behind by a crash
+        if self._map is not None or not self._capacity:
+            return
+        fd, path = tempfile.mkstemp(prefix="scrollback-", dir=directory)
+        try:
+            os.unlink(path)
+            os.ftruncate(fd, self._capacity)
+            # Written through the descriptor, so no page of the mapping is
+            # resident until a replay reads it
+            os.pwrite(fd, self._buffer[: len(self)], 0)
+            mapping = _map(fd, self._capacity)
+        finally:
+            os.close(fd)
+        self._buffer.release()
+        self._map = mapping
+        self._buffer = memoryview(mapping)
+
+    def restore(self) -> None:
+        mapping = self._map
+        if mapping is None:
+            return
+        buffer = bytearray(self._capacity)
+        buffer[: len(self)] = self._buffer[: len(self)]
+        self._buffer.release()
+        self._buffer = memoryview(buffer)
+        self._map = None
+        mapping.close()
+
+    def append(self, data: bytes | memoryview) -> None:
+        capacity = self._capacity
+        if not capacity:
+            return
+        size = len(data)
+        if size >= capacity:
+            # Laid out as if written in pieces, written keeps counting
+            # every byte
+            self._written += size
+            data = data[size - capacity :]
+            start = self._written % capacity
+            self._buffer[start:] = data[: capacity - start]
+            self._buffer[:start] = data[capacity - start :]
+        else:
+            start = self._written % capacity
+            head = min(size, capacity - start)
+            self._buffer[start : start + head] = data[:head]
+            self._buffer[: size - head] = data[head:]
+            self._written += size
+        if self._map is not None:
+            # Output of a spilled session goes to the page cache, not RSS
+            self._map.madvise(mmap.MADV_DONTNEED)
+
+    def tail(self, prefix: bytes = b"") -> bytes:
+        # The prefix is joined in, so a replay frame is a single copy
+        capacity = self._capacity
+        if self._written <= capacity:
+            return b"".join((prefix, self._buffer[: self._written]))
+        start = self._written % capacity
+        return b"".join((prefix, self._buffer[start:], self._buffer[:start]))
+
+    def last(self, size: int) -> bytes:
+        size = min(size, len(self))
+        if not size:
+            return b""
+        end = self._written % self._capacity
+        if end >= size:
+            return self._buffer[end - size : end].tobytes()
+        return b"".join((self._buffer[end - size :], self._buffer[:end]))
+
+    def clear(self) -> None:
+        self._written = 0
@@ -0,0 +1,217 @@
+import asyncio
+import fcntl
+import os
+import pty
+import signal
+import subprocess
+import termios
+import time
+from collections.abc import Sequence
+from contextlib import suppress
+from dataclasses import dataclass
+from logging import getLogger
+
+from aiomisc.thread_pool import threaded
+
+from tty_aiohttp.app.handlers.ws.reaper import get_reaper
+from tty_aiohttp.app.metrics import SPAWN_SECONDS
+
+log = getLogger(__name__)
+
+# Signals Python ignores that a shell expects at their defaults
+RESTORE_SIGNALS = (signal.SIGPIPE, signal.SIGXFSZ)
+# Cleared once posix_spawn turns out to lack setsid support
+POSIX_SPAWN_SETSID = True
+# Open descriptors of this process
+FD_DIR = "/proc/self/fd"
+
+
+class ShellProcess:
+    __slots__ = ("_exited", "_popen", "pid", "returncode")
+
+    def __init__(
+        self,
+        pid: int,
+        popen: subprocess.Popen[bytes] | None = None,
+        foreign: bool = False,
+    ) -> None:
+        self.pid = pid
+        # Held so it is not finalized, and polled, while the child runs
+        self._popen = popen
+        self.returncode: int | None = None
+        self._exited: asyncio.Future[int] = (
+            asyncio.get_running_loop().create_future()
+        )
+        if foreign:
+            # Adopted from another worker, which still reaps it
+            get_reaper().watch_foreign(pid, self._set_returncode)
+        else:
+            get_reaper().watch(pid, self._set_returncode)
+
+    def _set_returncode(self, status: int) -> None:
+        self.returncode = os.waitstatus_to_exitcode(status)
+        if self._popen is not None:
+            self._popen.returncode = self.returncode
+        if not self._exited.done():
+            self._exited.set_result(self.returncode)
+
+    async def wait(self) -> int:
+        return await asyncio.shield(self._exited)
+
+    def send_signal(self, signum: int) -> None:
+        if self.returncode is not None:
+            return
+        try:
+            os.kill(self.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        self.send_signal(signal.SIGKILL)
+
+
+@dataclass(frozen=True)
+class PtyProcess:
+    process: ShellProcess
+    fd: int
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    def kill(self) -> None:
+        self.process.kill()
+        os.close(self.fd)
+
+
+def shell_environ() -> dict[str, str]:
+    env = os.environ.copy()
+    env["TERM"] = "xterm-256color"
+    env["COLORTERM"] = "truecolor"
+    return env
+
+
+def _setup_child() -> None:
+    os.setsid()
+    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+
+def _spawn_preexec(
+    argv: Sequence[str],
+    env: dict[str, str],
+    slave_fd: int,
+) -> subprocess.Popen[bytes]:
+    return subprocess.Popen(
+        argv,
+        preexec_fn=_setup_child,
+        stdin=slave_fd,
+        stdout=slave_fd,
+        stderr=slave_fd,
+        env=env,
+        close_fds=True,
+    )
+
+
+def _close_on_exec() -> None:
+    # posix_spawn has nothing like close_fds. Python opens descriptors
+    # non-inheritable, any made inheritable since would otherwise reach
+    # the shell, a PTY master of another session among them
+    for name in os.listdir(FD_DIR):
+        fd = int(name)
+        if fd <= 2:
+            continue
+        with suppress(OSError):
+            if os.get_inheritable(fd):
+                os.set_inheritable(fd, False)
+
+
+def _spawn_posix(
+    argv: Sequence[str],
+    env: dict[str, str],
+    slave_fd: int,
+) -> int:
+    # The child becomes a session leader first, so opening the slave by
+    # path makes it the controlling terminal without any Python code
+    # running between fork and exec.
+    _close_on_exec()
+    return os.posix_spawnp(
+        argv[0],
+        list(argv),
+        env,
+        file_actions=[
+            (os.POSIX_SPAWN_OPEN, 0, os.ttyname(slave_fd), os.O_RDWR, 0),
+            (os.POSIX_SPAWN_DUP2, 0, 1),
+            (os.POSIX_SPAWN_DUP2, 0, 2),
+        ],
+        setsid=True,
+        setsigdef=RESTORE_SIGNALS,
+        setsigmask=(),
+    )
+
+
+def spawn_on_pty(
+    argv: Sequence[str],
+    env: dict[str, str],
+    preexec: bool = False,
+) -> tuple[int, int, subprocess.Popen[bytes] | None]:
+    global POSIX_SPAWN_SETSID
+
+    master_fd, slave_fd = pty.openpty()
+    try:
+        if POSIX_SPAWN_SETSID and not preexec:
+            try:
+                return _spawn_posix(argv, env, slave_fd), master_fd, None
+            except NotImplementedError:
+                log.warning(
+                    "posix_spawn can not start a new session here, "
+                    "falling back to fork with preexec_fn",
+                )
+                POSIX_SPAWN_SETSID = False
+        popen = _spawn_preexec(argv, env, slave_fd)
+        return popen.pid, master_fd, popen
+    except BaseException:
+        os.close(master_fd)
+        raise
+    finally:
+        os.close(slave_fd)
+
+
+async def spawn(
+    argv: Sequence[str],
+    env: dict[str, str] | None = None,
+) -> PtyProcess:
+    started = time.perf_counter()
+    future = asyncio.ensure_future(
+        threaded(spawn_on_pty)(
+            argv,
+            env if env is not None else shell_environ(),
+        ),
+    )
+    try:
+        pid, fd, popen = await asyncio.shield(future)
+    except asyncio.CancelledError:
+        # The thread still starts the shell, and nobody would own it
+        future.add_done_callback(_kill_orphan)
+        raise
+    SPAWN_SECONDS.observe(time.perf_counter() - started)
+    return PtyProcess(ShellProcess(pid, popen), fd)
+
+
+def _kill_orphan(
+    future: asyncio.Future[tuple[int, int, subprocess.Popen[bytes] | None]],
+) -> None:
+    if future.cancelled() or future.exception() is not None:
+        return
+    pid, fd, popen = future.result()
+    log.debug("Killing shell %s spawned for a cancelled request", pid)
+    PtyProcess(ShellProcess(pid, popen), fd).kill()
+
+
+async def spawn_shell(
+    shell: str,
+    env: dict[str, str] | None = None,
+) -> PtyProcess:
+    return await spawn((shell,), env)
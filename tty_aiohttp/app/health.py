@@ -0,0 +1,123 @@
+import asyncio
+import os
+import resource
+from collections import Counter
+from collections.abc import AsyncIterator
+from contextlib import suppress
+from dataclasses import dataclass, field
+
+from aiohttp import web
+from aiomisc.counters import get_statistics
+from aiomisc.thread_pool import ThreadPoolStatistic
+
+from tty_aiohttp.app.handlers.ws.pty import TERMINALS_KEY
+from tty_aiohttp.app.metrics import (
+    LOOP_LAG_SECONDS,
+    OPEN_FDS,
+    OUTPUT_QUEUE_BYTES,
+    POOL_BACKLOG,
+    TERMINALS,
+)
+
+SAMPLE_INTERVAL = 0.05
+# Listing the descriptor table costs more, so it is refreshed less often
+FD_SAMPLE_INTERVAL = 1.0
+LAG_SMOOTHING = 0.3
+
+
+@dataclass(frozen=True)
+class HealthOptions:
+    max_loop_lag: float = 1.0
+    max_pool_backlog: int = 100
+    # 0 means no limit
+    max_terminals: int = 0
+    min_free_fds: int = 64
+
+
+@dataclass(frozen=True)
+class HealthSample:
+    loop_lag: float = 0.0
+    pool_backlog: int = 0
+    terminals: int = 0
+    open_fds: int = 0
+    fd_limit: int = 0
+
+    @property
+    def free_fds(self) -> int | None:
+        return self.fd_limit - self.open_fds if self.fd_limit else None
+
+    def failures(self, options: HealthOptions) -> list[str]:
+        failed = []
+        if self.loop_lag > options.max_loop_lag:
+            failed.append("loop_lag")
+        if self.pool_backlog > options.max_pool_backlog:
+            failed.append("pool_backlog")
+        if options.max_terminals and self.terminals >= options.max_terminals:
+            failed.append("terminals")
+        free_fds = self.free_fds
+        if free_fds is not None and free_fds < options.min_free_fds:
+            failed.append("fds")
+        return failed
+
+
+@dataclass
+class Health:
+    options: HealthOptions = HealthOptions()
+    sample: HealthSample = field(default_factory=HealthSample)
+
+
+HEALTH_KEY: web.AppKey[Health] = web.AppKey("health")
+
+
+def pool_backlog() -> int:
+    # Work submitted to the thread pools of this process and not done yet
+    counts: Counter[str] = Counter()
+    for result in get_statistics(ThreadPoolStatistic):
+        counts[result.metric] += result.value
+    return counts["submitted"] - counts["done"]
+
+
+def count_open_fds() -> int:
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return 0
+
+
+def fd_limit() -> int:
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    return 0 if soft == resource.RLIM_INFINITY else soft
+
+
+async def _sample(app: web.Application, health: Health) -> None:
+    loop = asyncio.get_running_loop()
+    lag = 0.0
+    open_fds, sampled_fds = 0, float("-inf")
+    while True:
+        started = loop.time()
+        await asyncio.sleep(SAMPLE_INTERVAL)
+        now = loop.time()
+        lag += (max(now - started - SAMPLE_INTERVAL, 0.0) - lag) * LAG_SMOOTHING
+        if now - sampled_fds >= FD_SAMPLE_INTERVAL:
+            open_fds, sampled_fds = count_open_fds(), now
+        terminals = app[TERMINALS_KEY]
+        health.sample = HealthSample(
+            loop_lag=lag,
+            pool_backlog=pool_backlog(),
+            terminals=len(terminals),
+            open_fds=open_fds,
+            fd_limit=fd_limit(),
+        )
+        TERMINALS.set(len(terminals))
+        OUTPUT_QUEUE_BYTES.set(sum(t.buffered_bytes for t in terminals))
+        LOOP_LAG_SECONDS.set(lag)
+        POOL_BACKLOG.set(health.sample.pool_backlog)
+        OPEN_FDS.set(open_fds)
+
+
+async def health_sampler(app: web.Application) -> AsyncIterator[None]:
+    task = asyncio.create_task(_sample(app, app[HEALTH_KEY]))
+    yield
+    task.cancel()
+    with suppress(asyncio.CancelledError):
+        await task
@@ -0,0 +1,270 @@
+import mmap
+from bisect import bisect_left
+from collections.abc import Iterator
+
+# Each worker owns one row of doubles in a segment mapped before forking,
+# so recording is a plain store and never takes a lock
+VALUE_SIZE = 8
+
+LATENCY_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+        self.size = 0
+        self.workers = 1
+        self.values = memoryview(bytearray()).cast("d")
+        self._segment: mmap.mmap | None = None
+
+    def register(self, metric: "Metric", slots: int) -> int:
+        if self._segment is not None:
+            raise RuntimeError("Metrics are registered before allocation")
+        index = self.size
+        self.size += slots
+        self.metrics.append(metric)
+        return index
+
+    def allocate(self, workers: int = 1) -> None:
+        self.values.release()
+        self.workers = workers
+        # Anonymous shared mapping, the forked workers keep the same pages
+        self._segment = mmap.mmap(-1, self.size * VALUE_SIZE * workers)
+        self.bind(0)
+
+    def bind(self, worker: int) -> None:
+        assert self._segment is not None
+        offset = worker * self.size * VALUE_SIZE
+        self.values = memoryview(self._segment)[
+            offset : offset + self.size * VALUE_SIZE
+        ].cast("d")
+
+    def rows(self) -> list[list[float]]:
+        assert self._segment is not None
+        values: memoryview[float] = memoryview(self._segment).cast("d")
+        return [
+            list(values[worker * self.size : (worker + 1) * self.size])
+            for worker in range(self.workers)
+        ]
+
+    def counter(self, name: str, help: str) -> "Counter":
+        return Counter(self, name, help)
+
+    def gauge(self, name: str, help: str) -> "Gauge":
+        return Gauge(self, name, help)
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> "Histogram":
+        return Histogram(self, name, help, buckets)
+
+    def render(self) -> str:
+        rows = self.rows()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples(rows))
+        return "\n".join(lines) + "\n"
+
+
+class Metric:
+    __slots__ = ("_index", "_registry", "help", "name")
+
+    type = "untyped"
+
+    def __init__(
+        self,
+        registry: Registry,
+        name: str,
+        help: str,
+        slots: int = 1,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self._registry = registry
+        self._index = registry.register(self, slots)
+
+    def samples(self, rows: list[list[float]]) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    __slots__ = ()
+
+    type = "counter"
+
+    def inc(self, value: float = 1) -> None:
+        self._registry.values[self._index] += value
+
+    def samples(self, rows: list[list[float]]) -> Iterator[str]:
+        total = sum(row[self._index] for row in rows)
+        yield f"{self.name}_total {total!r}"
+
+
+class Gauge(Metric):
+    __slots__ = ()
+
+    type = "gauge"
+
+    def set(self, value: float) -> None:
+        self._registry.values[self._index] = value
+
+    def samples(self, rows: list[list[float]]) -> Iterator[str]:
+        # Summing levels of different workers means nothing, so every
+        # worker keeps its own sample
+        for worker, row in enumerate(rows):
+            yield f'{self.name}{{worker="{worker}"}} {row[self._index]!r}'
+
+
+class Histogram(Metric):
+    __slots__ = ("_sum", "buckets")
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        registry: Registry,
+        name: str,
+        help: str,
+        buckets: tuple[float, ...],
+    ) -> None:
+        self.buckets = buckets
+        # One slot per bucket, one for +Inf and one for the sum
+        super().__init__(registry, name, help, slots=len(buckets) + 2)
+        self._sum = self._index + len(buckets) + 1
+
+    def observe(self, value: float) -> None:
+        values = self._registry.values
+        values[self._index + bisect_left(self.buckets, value)] += 1
+        values[self._sum] += value
+
+    def samples(self, rows: list[list[float]]) -> Iterator[str]:
+        count = 0.0
+        for offset, bound in enumerate((*self.buckets, float("inf"))):
+            count += sum(row[self._index + offset] for row in rows)
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            yield f'{self.name}_bucket{{le="{le}"}} {count!r}'
+        total = sum(row[self._sum] for row in rows)
+        yield f"{self.name}_sum {total!r}"
+        yield f"{self.name}_count {count!r}"
+
+
+REGISTRY = Registry()
+
+PTY_READS = REGISTRY.counter("tty_pty_reads", "Reads from PTY masters")
+PTY_READ_BYTES = REGISTRY.counter(
+    "tty_pty_read_bytes",
+    "Bytes read from PTY masters",
+)
+PTY_WRITTEN_BYTES = REGISTRY.counter(
+    "tty_pty_written_bytes",
+    "Bytes of input written to PTY masters",
+)
+READER_PAUSES = REGISTRY.counter(
+    "tty_reader_pauses",
+    "PTY reads paused because a client fell behind",
+)
+READER_RESUMES = REGISTRY.counter(
+    "tty_reader_resumes",
+    "PTY reads resumed after a client caught up",
+)
+FRAMES_SENT = REGISTRY.counter("tty_frames_sent", "Output frames sent")
+FRAME_BYTES_SENT = REGISTRY.counter(
+    "tty_frame_bytes_sent",
+    "Bytes of output frames sent, after compression",
+)
+FRAME_SEND_SECONDS = REGISTRY.histogram(
+    "tty_frame_send_seconds",
+    "Time to hand an output frame to the connection",
+)
+VIEWER_SKIPS = REGISTRY.counter(
+    "tty_viewer_skips",
+    "Read-only viewers that skipped ahead to the scrollback",
+)
+CREDIT_STALLS = REGISTRY.counter(
+    "tty_credit_stalls",
+    "Output held back until a client granted more credit",
+)
+SCREEN_UPDATES = REGISTRY.counter(
+    "tty_screen_updates",
+    "Screen snapshots and diffs sent in place of raw output",
+)
+SESSIONS_OPENED = REGISTRY.counter("tty_sessions_opened", "Shells started")
+SESSIONS_REATTACHED = REGISTRY.counter(
+    "tty_sessions_reattached",
+    "Sessions reattached by a new connection",
+)
+INPUT_DROPPED_BYTES = REGISTRY.counter(
+    "tty_input_dropped_bytes",
+    "Input bytes dropped because the PTY had a full input backlog",
+)
+RECORDED_BYTES = REGISTRY.counter(
+    "tty_recorded_bytes",
+    "Output bytes queued for the session recorder",
+)
+RECORDING_DROPPED_BYTES = REGISTRY.counter(
+    "tty_recording_dropped_bytes",
+    "Output bytes left out of recordings while the recorder fell behind",
+)
+POOL_HITS = REGISTRY.counter(
+    "tty_pool_hits",
+    "Sessions given a shell from the prespawned pool",
+)
+POOL_MISSES = REGISTRY.counter(
+    "tty_pool_misses",
+    "Sessions that found the prespawned pool empty",
+)
+COMPRESS_SECONDS = REGISTRY.counter(
+    "tty_compress_seconds",
+    "CPU time spent compressing output frames",
+)
+COMPRESS_BYTES = REGISTRY.counter(
+    "tty_compress_bytes",
+    "Output bytes passed to the compressor",
+)
+SPAWN_SECONDS = REGISTRY.histogram(
+    "tty_spawn_seconds",
+    "Time to start a shell on a new PTY",
+)
+STATIC_REQUESTS = REGISTRY.counter(
+    "tty_static_requests",
+    "Requests for static assets",
+)
+STATIC_NOT_MODIFIED = REGISTRY.counter(
+    "tty_static_not_modified",
+    "Static asset requests answered with 304",
+)
+STATIC_SECONDS = REGISTRY.histogram(
+    "tty_static_seconds",
+    "Time to prepare a static asset response",
+)
+TERMINALS = REGISTRY.gauge("tty_terminals", "Live terminals of a worker")
+OUTPUT_QUEUE_BYTES = REGISTRY.gauge(
+    "tty_output_queue_bytes",
+    "Output waiting to reach the attached clients of a worker",
+)
+LOOP_LAG_SECONDS = REGISTRY.gauge(
+    "tty_event_loop_lag_seconds",
+    "Smoothed event loop lag of a worker",
+)
+POOL_BACKLOG = REGISTRY.gauge(
+    "tty_thread_pool_backlog",
+    "Thread pool work submitted and not done yet in a worker",
+)
+OPEN_FDS = REGISTRY.gauge("tty_open_fds", "Open file descriptors of a worker")
+
+REGISTRY.allocate()
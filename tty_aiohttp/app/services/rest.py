@@ -7,15 +7,41 @@ from aiohttp.web_app import Application, Middleware
 from aiomisc.service.aiohttp import AIOHTTPService
 
 from tty_aiohttp.app import ASSETS_ROOT, FONTS_ROOT
+from tty_aiohttp.app.balancer import (
+    WORKER_SLOT_KEY,
+    WorkerSlot,
+    load_reporter,
+)
 from tty_aiohttp.app.handlers.index import IconHandler, IndexHandler
 from tty_aiohttp.app.handlers.static import StaticResource
+from tty_aiohttp.app.handlers.v1.metrics import MetricsHandler
 from tty_aiohttp.app.handlers.v1.ping import PingHandler
 from tty_aiohttp.app.handlers.ws import PtyWebSocket
+from tty_aiohttp.app.handlers.ws.codec import log_compression_stats
+from tty_aiohttp.app.handlers.ws.handoff import SessionDirectory
+from tty_aiohttp.app.handlers.ws.pool import ShellPool
 from tty_aiohttp.app.handlers.ws.pty import (
+    RECORDER_KEY,
+    SESSION_DIRECTORY_KEY,
+    SESSIONS_KEY,
     SHELL_KEY,
+    SHELL_POOL_KEY,
+    TERMINAL_OPTIONS_KEY,
     TERMINALS_KEY,
     PtyHandler,
+    TerminalOptions,
     close_all_terminals,
+    session_directory,
+    session_reaper,
+    session_recorder,
+    shell_pool,
+)
+from tty_aiohttp.app.handlers.ws.recorder import Recorder, RecordingOptions
+from tty_aiohttp.app.health import (
+    HEALTH_KEY,
+    Health,
+    HealthOptions,
+    health_sampler,
 )
 from tty_aiohttp.app.utils.serializers import config_serializers
 from tty_aiohttp.utils.argparse import Environment
@@ -33,6 +59,14 @@ class REST(AIOHTTPService):
 
     env: Environment
     shell: str = DEFAULT_SHELL
+    terminal_options: TerminalOptions = TerminalOptions()
+    health_options: HealthOptions = HealthOptions()
+    recording_options: RecordingOptions = RecordingOptions()
+    shell_pool_size: int = 0
+    shell_pool_min: int = 1
+    session_dir: str | None = None
+    generation: int = 0
+    worker_slot: WorkerSlot | None = None
 
     _middlewares: tuple[Middleware, ...] = tuple()
     __dependencies__: tuple[str, ...] = tuple()
@@ -41,6 +75,7 @@ class REST(AIOHTTPService):
         ("GET", "/", IndexHandler),
         ("GET", "/icon.svg", IconHandler),
         ("GET", "/api/v1/ping", PingHandler),
+        ("GET", "/api/v1/metrics", MetricsHandler),
     )
 
     WS_ROUTES: WsHandlersType = (("pty", PtyHandler),)
@@ -50,7 +85,15 @@ class REST(AIOHTTPService):
         app = web.Application()
 
         app[TERMINALS_KEY] = set()
+        app[SESSIONS_KEY] = {}
         app.on_shutdown.append(close_all_terminals)
+        app.on_shutdown.append(log_compression_stats)
+        app.cleanup_ctx.append(session_reaper)
+        app.cleanup_ctx.append(shell_pool)
+        app.cleanup_ctx.append(session_directory)
+        app.cleanup_ctx.append(session_recorder)
+        app.cleanup_ctx.append(health_sampler)
+        app.cleanup_ctx.append(load_reporter)
 
         self._add_routes(app)
         self._add_middlewares(app)
@@ -78,6 +121,25 @@ class REST(AIOHTTPService):
         for name in chain(self.__required__, self.__dependencies__):
             app[name] = getattr(self, name)
         app[SHELL_KEY] = self.shell
+        app[TERMINAL_OPTIONS_KEY] = self.terminal_options
+        app[HEALTH_KEY] = Health(self.health_options)
+        app[SHELL_POOL_KEY] = None
+        if self.shell_pool_size:
+            app[SHELL_POOL_KEY] = ShellPool(
+                self.shell,
+                max_idle=self.shell_pool_size,
+                min_idle=self.shell_pool_min,
+            )
+        app[RECORDER_KEY] = None
+        if self.recording_options.directory:
+            app[RECORDER_KEY] = Recorder(self.recording_options)
+        app[WORKER_SLOT_KEY] = self.worker_slot
+        app[SESSION_DIRECTORY_KEY] = None
+        if self.session_dir:
+            app[SESSION_DIRECTORY_KEY] = SessionDirectory(
+                self.session_dir,
+                generation=self.generation,
+            )
 
     def _add_middlewares(self, app: web.Application) -> None:
         for middleware in self._middlewares:
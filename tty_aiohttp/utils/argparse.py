@@ -28,3 +28,4 @@ def validate(
 
 positive_int = validate(int, constrain=lambda x: x > 0)
 uint = validate(int, constrain=lambda x: x >= 0)
+positive_float = validate(float, constrain=lambda x: x > 0)